@@ -1,8 +1,27 @@
+import functools
+import hashlib
+import os
+import re
 import sys
+import tempfile
+from array import array
 from collections import deque
-from instructions import Instructions
+from typing import Callable, Iterable, TextIO
+from image import Image
+from instructions import Instructions, encode_r, encode_i, encode_jal
+from linker import ObjectFile, Relocation, link, RELOC_BRANCH, RELOC_DATA, RELOC_JAL
 
-DEBUG_PRINT = True
+# prints every step of the assembly, turned on with --debug
+DEBUG_PRINT = False
+
+# where --flat places .data, the layout images had before they were sectioned
+FLAT_DATA_BASE = 1000
+
+# part of every cache key, bump it whenever the image built from the same source changes
+ASSEMBLER_VERSION = "1"
+# images memoized by assemble()
+ASSEMBLE_MEMO_SIZE = 64
+HASH_CHUNK_SIZE = 1 << 16
 
 # register names are in order based on RISC-V spec
 ABI_NAMES = [
@@ -21,104 +40,40 @@ REGISTER_LOOKUP = {name : i for i, name in enumerate(ABI_NAMES)}
 for i in range(1, 31+1):
     REGISTER_LOOKUP["r" + str(i)] = i
 
-# remove comments and newlines from each line
-# if resulting line is empty, remove it
-def assembler_clean(lines: list[str]) -> list[str]:
-    clean_lines = []
-    for line in lines:
-        # remove hashtag comments
-        index = line.find("#")
-        if (index != -1):
-            line = line[:index]
-        # remove extra spaces and newlines
-        line = line.strip()
-        # only add non-empty lines
-        if len(line) > 0:
-            clean_lines.append(line)
-    return clean_lines
-
-def assembler_process_data(lines):
-    words: list[int] = []
-    label_lookup  = {}
-    for line in lines:
-        # identify labels
-        label_tokens = line.split(":")
-        # last token is non-label instruction
-        for i in range(len(label_tokens) - 1):
-            label = label_tokens[i].strip().upper()
-            # labels come before the words on the same line
-            label_lookup[label] = len(words)
-        words.extend(int(s) for s in label_tokens[-1].split())
-    return (words, label_lookup)
-
-
-# 1. remove newlines and comments from each line
-# 2. identify labels and link them with the instruction
-#   - labels are anything before a colon
-def assembler_preprocess(lines: list[str]) -> list[str, list[str]]:
-    line_entries: list[str, list[str]] = []
-    for line in lines:
-        # identify labels
-        tokens = line.split(":")
-        labels = []
-        # last token is non-label instruction
-        for i in range(len(tokens) - 1):
-            labels.append(tokens[i].strip())
-        line_entries.append([tokens[-1], labels])
-
-    # Add an extra NO_OP instruction at the very end to catch the end labels
-    #  (labels that are placed after the final instruction in the assembly code)
-    line_entries.append(["NO_OP", []])
-
-    # if DEBUG_PRINT:
-    #     print("raw line entries:")
-    #     for entry in line_entries:
-    #         print(f"{entry}")
-    #     print()
-
-    # remove entries with empty line 
-    # if removed entry has labels, transfer those labels to
-    #   the next entry with non-empty lines
-    revised_entries = []
-    orphaned_labels = []
-    for entry in line_entries:
-        line, labels = entry
-        # non-empty line
-        if line:
-            labels.extend(orphaned_labels)
-            orphaned_labels.clear()
-            revised_entries.append(entry)
-        # empty line
-        else:
-            orphaned_labels.extend(labels)
+# remove a hashtag comment, spaces and the newline from a line
+def assembler_strip(line: str) -> str:
+    index = line.find("#")
+    if (index != -1):
+        line = line[:index]
+    return line.strip()
 
-    if DEBUG_PRINT:
-        print(".text line entries:")
-        for entry in revised_entries:
-            print(f"{entry}")
-        print()
 
-    return revised_entries
+# a token is a group of contiguous characters that are alphanumeric, "_", or "-"
+# anything else is a delimiter
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+TOKEN_INTEGER = re.compile(r"-?[0-9]+")
 
 
 # splits line into tokens.
-# a token is a group of contiguous characters that are alphanumeric, "_", or "-" 
-# anything else is a delimiter
-# supports hashtag comments at the end of the line.
 def assembler_tokenize(line: str) -> deque[str]:
-    tokens = [[]]
-    for char in line:
-        if char.isalnum() or char == "_" or char == "-":
-            tokens[-1].append(char)
-        elif len(tokens[-1]) > 0:
-            tokens.append([])
-    tokens = deque("".join(char_list) for char_list in tokens)
-    if len(tokens[-1]) == 0:
-        tokens.pop()
-    return tokens
+    return deque(TOKEN_PATTERN.findall(line))
+
+# bit width of each field shown in the debug table
+FIELD_WIDTHS = {"opcode": 7, "rd": 6, "rs1": 6, "rs2": 6, "imm": 11}
+JAL_FIELD_WIDTHS = {"opcode": 7, "imm": 25}
+
+# instruction class held in bits 3 to 5 of the opcode
+OPCODE_CLASS_SHIFT = 3
+OPCODE_CLASS_MASK = 0b111
+R_TYPE_CLASS = 0b001
+I_TYPE_CLASS = 0b011
+BRANCH_CLASS = 0b110
 
 # converts assembly instruciton to 32 bit machine code
-def assembler_parse_line(index: int, line: str, text_label_lookup: dict, data_label_lookup: dict) -> str:
+# labels missing from the lookups raise ValueError, unless fixups is given: then the immediate is left
+#   as 0 and (index, label, branch) is appended to fixups so the word can be backpatched later
+def assembler_parse_line(index: int, line: str, text_label_lookup: dict, data_label_lookup: dict,
+                         fixups: list[tuple[int, str, int]] | None = None) -> int:
     if DEBUG_PRINT:
         print(f"Parsing Instruction {index}: {line}")
 
@@ -127,110 +82,105 @@ def assembler_parse_line(index: int, line: str, text_label_lookup: dict, data_la
     if DEBUG_PRINT:
         print(f"Tokens: {list(tokens)}")
 
-    binary_strings: deque[str] = deque()
-
     # first token from left is always the instruction name
     instr_name = tokens.popleft().upper()
     opcode = Instructions[instr_name].value
-    opcode_str = f"{opcode:07b}"
-    binary_strings.appendleft(opcode_str)
+    opcode_class = (opcode >> OPCODE_CLASS_SHIFT) & OPCODE_CLASS_MASK
 
-    def process_reg():
+    def process_reg() -> int:
         reg_name = tokens.popleft().lower()
-        reg_num = REGISTER_LOOKUP[reg_name]
-        binary_strings.appendleft(f"{reg_num:06b}")
+        return REGISTER_LOOKUP[reg_name]
 
     # branch = 0: I-type, imm is either a .data variable or literal integer
     # branch = 1 or 2: Branch/Jump, imm is a label and will translate to offset
     # NOTE: unlike the MIPS jump, the RISCV jump does relative addressing
-    def process_imm(branch=0):
+    def process_imm(branch=0) -> int:
         token = tokens.popleft()
         imm = 0
         if branch == 0:  # I-Type
             t = token.upper()
             if t in data_label_lookup:
-                imm = int(data_label_lookup[t]) + 1000  # data offset
-                print(f"variable address: {imm}")
-            else:
+                imm = int(data_label_lookup[t])  # data address
+                if DEBUG_PRINT:
+                    print(f"variable address: {imm}")
+            elif TOKEN_INTEGER.fullmatch(token):
                 imm = int(token)
+            elif fixups is not None:
+                fixups.append((index, t, branch))
+            else:
+                raise ValueError(f"undefined .data label {token}")
         elif branch == 1 or branch == 2:  # branch/jump
             label = token.upper()
-            target_index = text_label_lookup[label]
-            imm = target_index - index
+            if label in text_label_lookup:
+                imm = text_label_lookup[label] - index
+            elif fixups is not None:
+                fixups.append((index, label, branch))
+            else:
+                raise ValueError(f"undefined label {token}")
             if DEBUG_PRINT:
                 if branch == 1:
                     print(f"branch offset: {imm}")
                 else:
                     print(f"jump offset: {imm}")
+        return imm
 
-        # python can't do 2's complement so I have to do it myself
-        if (imm < 0):
-            li = list(f"{-imm:b}")
-            flip = False
-            for i in reversed(range(len(li))):
-                if flip:
-                    li[i] = "1" if li[i] == "0" else "0"
-                elif li[i] == "1":
-                    flip = True
-            bin = "".join(li)
-        else:
-            bin = f"{imm:b}"
-        # need to pad with 1s or 0s based on sign
-        pad = (branch == 2) and 25 or 11
-        binary_strings.appendleft(bin.rjust(pad, "1" if imm < 0 else "0"))
-
-    operand_names = ["opcode"]
+    # operand values by field name, only used for the debug table
+    operands: dict[str, int] = {"opcode": opcode}
 
     # NO_OP
     if instr_name == "NO_OP":
-        pass
+        result = opcode
     # LW
     elif instr_name == "LW":
-        process_reg()  # rd
-        process_imm()  # imm
-        process_reg()  # rs1
-        # need to swap imm and rs1 to comply with format
-        d = binary_strings
-        d[0], d[1] = d[1], d[0]
-        operand_names.extend(["rd", "rs1", "imm"])
+        rd = process_reg()
+        imm = process_imm()
+        rs1 = process_reg()
+        result = encode_i(opcode, rd, rs1, imm)
+        operands.update(rd=rd, rs1=rs1, imm=imm)
     # SW
     elif instr_name == "SW":
-        process_reg()  # rs2
-        process_imm()  # imm
-        process_reg()  # rs1
-        # need to swap imm and rs2 to comply with format
-        d = binary_strings
-        d[0], d[1] = d[1], d[0]
-        operand_names.extend(["rs2", "rs1", "imm"])
+        rs2 = process_reg()
+        imm = process_imm()
+        rs1 = process_reg()
+        result = encode_i(opcode, rs2, rs1, imm)
+        operands.update(rs2=rs2, rs1=rs1, imm=imm)
     # JAL
     elif instr_name == "JAL":
-        process_imm(2)  # imm
-        operand_names.extend(["imm"])
+        imm = process_imm(2)
+        result = encode_jal(opcode, imm)
+        operands.update(imm=imm)
     # R-Type
-    elif opcode_str[1:4] == "001":
-        process_reg()  # rd
-        process_reg()  # rs1
-        process_reg()  # rs2
-        operand_names.extend(["rd", "rs1", "rs2"])
+    elif opcode_class == R_TYPE_CLASS:
+        rd = process_reg()
+        rs1 = process_reg()
+        rs2 = process_reg()
+        result = encode_r(opcode, rd, rs1, rs2)
+        operands.update(rd=rd, rs1=rs1, rs2=rs2)
     # I-Type
-    elif opcode_str[1:4] == "011":
-        process_reg()  # rd
-        process_reg()  # rs1
-        process_imm()  # imm
-        operand_names.extend(["rd", "rs1", "imm"])
+    elif opcode_class == I_TYPE_CLASS:
+        rd = process_reg()
+        rs1 = process_reg()
+        imm = process_imm()
+        result = encode_i(opcode, rd, rs1, imm)
+        operands.update(rd=rd, rs1=rs1, imm=imm)
     # Branch
-    elif opcode_str[1:4] == "110":
-        process_reg()  # rs1
-        process_reg()  # rs2
-        process_imm(1)  # imm
-        operand_names.extend(["rs1", "rs2", "imm"])
+    elif opcode_class == BRANCH_CLASS:
+        rs1 = process_reg()
+        rs2 = process_reg()
+        imm = process_imm(1)
+        result = encode_i(opcode, rs1, rs2, imm)
+        operands.update(rs1=rs1, rs2=rs2, imm=imm)
+    else:
+        result = opcode
 
     if DEBUG_PRINT:
-        operand_names.reverse()
+        widths = JAL_FIELD_WIDTHS if instr_name == "JAL" else FIELD_WIDTHS
         line1, line2 = "| ", "| "
-        for i, bin in enumerate(binary_strings):
-            name = operand_names[i]
-            max_width = max(len(bin), len(name))
+        # most significant field first
+        for name, value in reversed(operands.items()):
+            width = widths[name]
+            bin = f"{value & ((1 << width) - 1):0{width}b}"
+            max_width = max(width, len(name))
             line1 += name.rjust(max_width) + " | "
             line2 += bin.rjust(max_width) + " | "
         border = "-" * (len(line1) - 1)
@@ -238,129 +188,246 @@ def assembler_parse_line(index: int, line: str, text_label_lookup: dict, data_la
         print(line1[:-1])
         print(line2[:-1])
         print(border)
+        print(f"Machine Code: {result:032b}\n")
+        print(f"Machine Code: 0x{result:08X}\n")
+
+    return result
 
-    # if DEBUG_PRINT:
-    #     print(f"Binary Strings: {list(binary_strings)}")
 
-    result = "".join(binary_strings).zfill(32)
+# assembles one module in a single pass over its lines, lines can be any iterable such as an open file
+# labels are resolved as they are defined and references to labels defined further down are backpatched
+#   once the source has been read. .data references and labels the module does not define become
+#   relocations, which link() applies once every module has a final address
+# ".global LABEL, ..." exports labels to other modules, ".entry LABEL" sets the entry point
+# the .text section ends with an extra NO_OP that catches labels after the last instruction
+# when source is given, (1 based line number, line without comment) is appended to it for every .text word
+def assembler_assemble_object(lines: Iterable[str], name: str | None = None,
+                              source: list[tuple[int, str]] | None = None) -> ObjectFile:
+    text_words = array("I")
+    data_words: list[int] = []
+    text_label_lookup: dict[str, int] = {}
+    data_label_lookup: dict[str, int] = {}
+    fixups: list[tuple[int, str, int]] = []
+    exports: set[str] = set()
+    entry_label: str | None = None
+    in_text = True
+
+    for number, line in enumerate(lines, 1):
+        line = assembler_strip(line)
+        if not line:
+            continue
+        if line == ".data" or line == ".text":
+            in_text = line == ".text"
+            continue
+        if line.startswith(".entry"):
+            entry_label = assembler_tokenize(line)[-1].upper()
+            continue
+        if line.startswith(".global"):
+            exports.update(token.upper() for token in list(assembler_tokenize(line))[1:])
+            continue
+        # labels are anything before a colon
+        tokens = line.split(":")
+        source_line, line = line, tokens[-1]
+        if in_text:
+            # lines holding only labels attach them to the next instruction
+            for label in tokens[:-1]:
+                text_label_lookup[label.strip().upper()] = len(text_words)
+            if line.strip():
+                if source is not None:
+                    source.append((number, source_line))
+                # .data addresses are not known yet, so every .data reference is a fixup
+                text_words.append(assembler_parse_line(len(text_words), line, text_label_lookup, {}, fixups))
+        else:
+            # labels come before the words on the same line
+            for label in tokens[:-1]:
+                data_label_lookup[label.strip().upper()] = len(data_words)
+            data_words.extend(int(s) for s in line.split())
+
+    # Add an extra NO_OP instruction at the very end to catch the end labels
+    #  (labels that are placed after the final instruction in the assembly code)
+    text_words.append(Instructions.NO_OP.value)
+
+    relocations: list[Relocation] = []
+    for index, label, branch in fixups:
+        if branch == 0 and label in data_label_lookup:
+            # the offset into this module's .data, the linker adds where .data ends up
+            text_words[index] |= encode_i(0, 0, 0, data_label_lookup[label])
+            relocations.append(Relocation(RELOC_DATA, index))
+        elif branch == 1 and label in text_label_lookup:
+            text_words[index] |= encode_i(0, 0, 0, text_label_lookup[label] - index)
+        elif branch == 2 and label in text_label_lookup:
+            text_words[index] |= encode_jal(0, text_label_lookup[label] - index)
+        else:
+            # imported from another module
+            relocations.append(Relocation((RELOC_DATA, RELOC_BRANCH, RELOC_JAL)[branch], index, label))
+
+    symbols = {label: (".text", offset) for label, offset in text_label_lookup.items()}
+    symbols.update((label, (".data", offset)) for label, offset in data_label_lookup.items())
+    for label in exports:
+        if label not in symbols:
+            raise ValueError(f"exported label {label} is not defined")
+    if entry_label is not None and entry_label not in text_label_lookup:
+        raise ValueError(f"undefined entry label {entry_label}")
 
     if DEBUG_PRINT:
-        print(f"Machine Code: {result}\n")
-        print(f"Machine Code: 0x{int(result, 2):08X}\n")
+        print(".data words: " + str(data_words))
+        print(".data label lookup:" + str(data_label_lookup))
+        print(f".text label lookup: {text_label_lookup}")
+        print(f"backpatched {len(fixups) - len(relocations)} forward references, {len(relocations)} relocations\n")
+
+    return ObjectFile(text_words, data_words, symbols, exports, relocations, entry_label, name)
+
+
+# maps every .text instruction to the source line it came from, for tools that report by pc
+# returns [(1 based line number, line without comment), ...] indexed by instruction
+#   and the .text label lookup, labels after the last instruction point at the final NO_OP
+# both come from the assembler pass itself, so pcs and labels match the image symbol table
+def assembler_source_map(lines: Iterable[str]) -> tuple[list[tuple[int, str]], dict[str, int]]:
+    source: list[tuple[int, str]] = []
+    obj = assembler_assemble_object(lines, source=source)
+    label_lookup = {label: offset for label, (section, offset) in obj.symbols.items() if section == ".text"}
+    return source, label_lookup
+
+
+# assembles a whole program: a single module linked on its own
+# .data is placed right after .text unless data_base is given
+# returns an Image with a .text and a .data section and every label in its symbol table
+def assembler_assemble(lines: Iterable[str], data_base: int | None = None) -> Image:
+    return link([assembler_assemble_object(lines)], data_base)
+
+
+# directory of the on disk cache, ASSEMBLER_CACHE_DIR overrides the per user default
+def assembler_cache_dir() -> str:
+    if "ASSEMBLER_CACHE_DIR" in os.environ:
+        return os.environ["ASSEMBLER_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "cmpe220-assembler")
+
+
+# sha256 of the assembler version, the options that change the output and the source bytes
+def assembler_cache_key(chunks: Iterable[bytes], *options) -> str:
+    digest = hashlib.sha256(f"{ASSEMBLER_VERSION}:{options!r}\n".encode())
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_chunks(file_path: str) -> Iterable[bytes]:
+    with open(file_path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            yield chunk
+
+
+# returns what build makes of the source file, reusing the result stored for an identical source
+# the file is hashed in chunks first, so a hit never parses it and a miss still streams it
+def _assemble_cached(file_path: str, options: tuple, build: Callable[[TextIO], Image | ObjectFile],
+                     load: Callable[[bytes], Image | ObjectFile], cache_dir: str | None) -> Image | ObjectFile:
+    if cache_dir is None:
+        cache_dir = assembler_cache_dir()
+    cache_path = os.path.join(cache_dir, assembler_cache_key(_read_chunks(file_path), *options) + ".bin")
+    try:
+        with open(cache_path, "rb") as f:
+            return load(f.read())
+    except (OSError, ValueError):
+        # missing or unreadable entries are rebuilt
+        pass
 
+    with open(file_path, "r") as f:
+        result = build(f)
+    os.makedirs(cache_dir, exist_ok=True)
+    # written to a temporary file first so a concurrent build never reads half an entry
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(result.to_bytes())
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
     return result
 
+
+# assembles a source file into an image through the cache
+# cache_dir defaults to assembler_cache_dir(), pass use_cache=False to always assemble
+def assembler_assemble_file(file_path: str, data_base: int | None = None, use_cache: bool = True,
+                            cache_dir: str | None = None) -> Image:
+    if not use_cache:
+        with open(file_path, "r") as f:
+            return assembler_assemble(f, data_base)
+    return _assemble_cached(file_path, (data_base,), lambda f: assembler_assemble(f, data_base), Image.from_bytes, cache_dir)
+
+
+# assembles a source file into an object named after the file, through the cache like assembler_assemble_file
+def assembler_assemble_object_file(file_path: str, use_cache: bool = True, cache_dir: str | None = None) -> ObjectFile:
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    if not use_cache:
+        with open(file_path, "r") as f:
+            return assembler_assemble_object(f, name)
+    return _assemble_cached(file_path, ("object", name), lambda f: assembler_assemble_object(f, name),
+                            ObjectFile.from_bytes, cache_dir)
+
+
+@functools.lru_cache(maxsize=ASSEMBLE_MEMO_SIZE)
+def _assemble_bytes(source: str, data_base: int | None) -> bytes:
+    return assembler_assemble(source.splitlines(), data_base).to_bytes()
+
+
+def assemble(source: str, data_base: int | None = None) -> Image:
+    """Assembles source text in process, the most recently used sources are memoized.
+
+    Every call returns a new Image, so callers can change it without affecting later calls.
+    """
+    return Image.from_bytes(_assemble_bytes(source, data_base))
+
+
 # =====================================================================================
-# USAGE: python assembler.py <source assembly filename> <destination binary filename>
-# (destination binary file can be omitted if you only want to verify console output)
+# USAGE: python assembler.py [--debug] [--flat | --object] [--no-cache] <source assembly filename> <destination binary filename>
+# (destination binary file can be omitted if you only want to verify the source assembles,
+#  --debug prints every step to the console,
+#  --flat writes the headerless layout with .data at FLAT_DATA_BASE instead of a sectioned image,
+#  --object writes a relocatable object for linker.py instead of an image,
+#  --no-cache always assembles instead of reusing the image cached for an identical source)
 # =====================================================================================
 if __name__ == "__main__":
-    src_filename = sys.argv[1]
+    args = sys.argv[1:]
+    if "--debug" in args:
+        args.remove("--debug")
+        DEBUG_PRINT = True
+    flat = "--flat" in args
+    if flat:
+        args.remove("--flat")
+    as_object = "--object" in args
+    if as_object:
+        args.remove("--object")
+    # debug output comes from parsing, so it skips the cache too
+    use_cache = "--no-cache" not in args and not DEBUG_PRINT
+    if "--no-cache" in args:
+        args.remove("--no-cache")
+    src_filename = args[0]
     dest_filename = None
-    if (len(sys.argv) >= 3):
-        dest_filename = sys.argv[2]
-
-    lines = []
-    with open(src_filename, "r") as f:
-        lines = f.readlines()
-
-    clean_lines = assembler_clean(lines)
-
-    text_lines = []
-    data_lines = []
-    section = text_lines
-    for line in clean_lines:
-        if line == ".data":
-            section = data_lines
-        elif line == ".text":
-            section = text_lines
-        else:
-            section.append(line)
+    if (len(args) >= 2):
+        dest_filename = args[1]
 
-    if (DEBUG_PRINT):
-        print(".data lines:")
-        for line in data_lines:
-            print("\t" + line)
-        print(".text lines:")
-        for line in text_lines:
-            print("\t" + line)
-        print()
-       
-    # process the data lines first
-    data_words, data_label_lookup = assembler_process_data(data_lines)
+    if as_object:
+        obj = assembler_assemble_object_file(src_filename, use_cache)
+        if DEBUG_PRINT:
+            print(f"exports: {sorted(obj.exports)}, imports: {sorted(obj.imports)}, relocations: {obj.relocations}")
+        if dest_filename:
+            obj.save(dest_filename)
+        sys.exit(0)
 
-    if (DEBUG_PRINT):
-        print(".data words: " + str(data_words))
-        print(".data label lookup:" + str(data_label_lookup))
-        print()
-
-
-    line_entries = assembler_preprocess(text_lines)
-    # extract lines from first column of line_entries
-    # and setup a lookup that maps label to current line number
-    lines = []
-    text_label_lookup: dict[str, int] = {}
-    for i, (line, labels) in enumerate(line_entries):
-        for label in labels:
-            text_label_lookup[label] = i
-        lines.append(line)
-
-    if DEBUG_PRINT:
-        print(f".text label lookup: {text_label_lookup}\n")
-
-    machine_codes = []
-    for index, line in enumerate(lines):
-        machine_codes.append(assembler_parse_line(index, line, text_label_lookup, data_label_lookup))
-
-    text_byte_array = []
-    for word in machine_codes:
-        text_byte_array.append(int(word[0:8], 2))
-        text_byte_array.append(int(word[8:16], 2))
-        text_byte_array.append(int(word[16:24], 2))
-        text_byte_array.append(int(word[24:32], 2))
-
-    text_zero_array = []
-    if (len(text_byte_array) < 1000 * 4):
-        text_zero_array = [0] * (1000 * 4 - len(text_byte_array))
-
-    data_byte_array = []
-    for word in data_words:
-        word_bin = "{0:b}".format(word).rjust(32, "0")
-        data_byte_array.append(int(word_bin[0:8], 2))
-        data_byte_array.append(int(word_bin[8:16], 2))
-        data_byte_array.append(int(word_bin[16:24], 2))
-        data_byte_array.append(int(word_bin[24:32], 2))
-
-    data_zero_array = []
-    if (len(data_zero_array) < 1000 * 4):
-        data_zero_array = [0] * (1000 * 4 - len(data_byte_array))
+    image = assembler_assemble_file(src_filename, FLAT_DATA_BASE if flat else None, use_cache)
 
     if (DEBUG_PRINT):
         print("Binary File Output:")
-
-        print(".text section [0000 - 0999]")
-        address = 0
-        for i in range(0, len(text_byte_array), 4):
-            line = "\t" + str(address).rjust(4, "0") + ": "
-            line += " ".join(str(n).rjust(3) for n in text_byte_array[i:i+4])
-            address += 1
-            print(line)
-        print("\t------------------------")
-        print(f"\t{address:04} to 0999: all zeroes")
-
-        print(".data section [1000 - 1999]")
-        address = 1000
-        for i in range(0, len(data_byte_array), 4):
-            line = "\t" + str(address).rjust(4, "0") + ": "
-            line += " ".join(str(n).rjust(3) for n in data_byte_array[i:i+4])
-            address += 1
-            print(line)
-        print("\t------------------------")
-        print(f"\t{address:04} to 1999: all zeroes")
+        for section in image.sections:
+            print(f"{section.name} section [{section.base:04} - {section.end - 1:04}]")
+            for address, word in enumerate(section.words, section.base):
+                line = "\t" + str(address).rjust(4, "0") + ": "
+                line += " ".join(str(n).rjust(3) for n in (word & 0xFFFFFFFF).to_bytes(4, "big"))
+                print(line)
+        if image.entry is not None:
+            print(f"entry: {image.entry:04}")
 
     if dest_filename:
-        with open(dest_filename, "wb") as f:
-            f.write(bytes(text_byte_array))
-            f.write(bytes(text_zero_array))
-            f.write(bytes(data_byte_array))
-            f.write(bytes(data_zero_array))
+        image.save(dest_filename, flat)
@@ -0,0 +1,179 @@
+import numpy as np
+
+from cpu import HaltReason, RunResult, limit_reached, PC_REGISTER, RETURN_ADDRESS_REGITSTER
+from image import Image, is_image
+from instructions import decode_instruction_table, Flags
+
+USE_IMM_FLAG = Flags.USE_IMM_FLAG.value
+REG_WRITE_FLAG = Flags.REG_WRITE_FLAG.value
+MEM_READ_FLAG = Flags.MEM_READ_FLAG.value
+MEM_WRITE_FLAG = Flags.MEM_WRITE_FLAG.value
+BRANCH_FLAG = Flags.BRANCH_FLAG.value
+JAL_FLAG = Flags.JAL_FLAG.value
+
+# alu operations in the order the alu checks them, vectorized over lanes
+ALU_OPS = [
+    (Flags.ALUOP_ADD_FLAG.value, np.add),
+    (Flags.ALUOP_MUL_FLAG.value, np.multiply),
+    (Flags.ALUOP_SHL_FLAG.value, np.left_shift),
+    (Flags.ALUOP_SHR_FLAG.value, np.right_shift),
+    (Flags.ALUOP_SUB_FLAG.value, np.subtract),
+    (Flags.ALUOP_SLT_FLAG.value, lambda a, b: (a < b).astype(np.int64)),
+    (Flags.ALUOP_SGE_FLAG.value, lambda a, b: (a >= b).astype(np.int64)),
+    (Flags.ALUOP_SNE_FLAG.value, lambda a, b: (a != b).astype(np.int64)),
+    (Flags.ALUOP_SEQ_FLAG.value, lambda a, b: (a == b).astype(np.int64)),
+]
+
+
+def alu_lanes(flags: int, rs1: np.ndarray, rs2: np.ndarray) -> np.ndarray:
+    for flag, op in ALU_OPS:
+        if flags & flag:
+            return op(rs1, rs2)
+    # at least 1 alu op flag must be set
+    raise ValueError("")
+
+
+class CPUBatch:
+    """CPU that runs one program on many independent lanes at once.
+
+    Each lane has its own register file (a row of an (N, registers) array), ram (a row of an
+    (N, ram_size) array) and pc. Every step fetches the word at each running lane's pc, decodes each
+    distinct word once and executes it with vectorized operations on the lanes that fetched it, so lanes
+    that diverge at a branch keep running on their own path. Lanes that reach a NO_OP are halted.
+    Follows the same instruction semantics as CPUClocked, with values held as 64 bit integers and
+    no mmio (every address must be inside ram).
+    """
+    def __init__(self, lanes: int, num_registers: int, ram_size: int):
+        self._regs: np.ndarray = np.zeros((lanes, num_registers), dtype=np.int64)
+        self._ram: np.ndarray = np.zeros((lanes, ram_size), dtype=np.int64)
+        self._pc: np.ndarray = np.zeros(lanes, dtype=np.int64)
+        self._halted: np.ndarray = np.zeros(lanes, dtype=bool)
+        self._retired: np.ndarray = np.zeros(lanes, dtype=np.int64)
+        self._decoded: dict[int, tuple[int, int, int, int, int]] = {}
+
+    @property
+    def lanes(self) -> int:
+        return self._regs.shape[0]
+
+    @property
+    def next_instruction(self) -> np.ndarray:
+        return self._pc.copy()
+
+    @property
+    def halted(self) -> np.ndarray:
+        return self._halted.copy()
+
+    @property
+    def retired(self) -> np.ndarray:
+        # guest instructions completed per lane
+        return self._retired.copy()
+
+    def load_program(self, words: list[int], base: int = 0):
+        # the same words are written into every lane's ram
+        self._ram[:, base:base + len(words)] = np.asarray(words, dtype=np.int64)
+
+    def load_file(self, file_path: str) -> Image | None:
+        """Loads a program image into every lane, returns the Image for sectioned files and None for flat ones.
+
+        Like RAM.load_file, a sectioned image has each section written at its base address. Every lane
+        starts at the image's entry point when it has one.
+        """
+        if is_image(file_path):
+            image = Image.load(file_path)
+            for section in image.sections:
+                if section.end > self._ram.shape[1]:
+                    raise ValueError(f"program too large for RAM (program = {section.end}, ram = {self._ram.shape[1]})")
+            for section in image.sections:
+                self.load_program(section.words, section.base)
+            if image.entry is not None:
+                self._pc[:] = image.entry
+            return image
+        words = np.fromfile(file_path, dtype=">u4")
+        if len(words) > self._ram.shape[1]:
+            raise ValueError(f"program too large for RAM (program = {len(words)}, ram = {self._ram.shape[1]})")
+        self.load_program(words.astype(np.int64))
+        return None
+
+    def set_register(self, register_number: int, values: int | np.ndarray):
+        # a single value is written to every lane, an array gives one value per lane
+        if register_number == 0:
+            return
+        self._regs[:, register_number] = values
+
+    def read_register(self, register_number: int) -> np.ndarray:
+        return self._regs[:, register_number].copy()
+
+    def dump_regs(self) -> np.ndarray:
+        return self._regs.copy()
+
+    def read_ram(self, addr: int) -> np.ndarray:
+        return self._ram[:, addr].copy()
+
+    def _decode(self, instr: int) -> tuple[int, int, int, int, int]:
+        decoded = self._decoded.get(instr)
+        if decoded is None:
+            decoded = self._decoded[instr] = decode_instruction_table(instr)
+        return decoded
+
+    def _check_addrs(self, addrs: np.ndarray):
+        if addrs.size and (addrs.min() < 0 or addrs.max() >= self._ram.shape[1]):
+            raise ValueError(f"Addres out of bounds. Ram size: {self._ram.shape[1]}")
+
+    def step(self) -> int:
+        """Executes one instruction on every running lane, returns the number of lanes that ran one"""
+        active = np.flatnonzero(~self._halted)
+        if active.size == 0:
+            return 0
+        self._check_addrs(self._pc[active])
+        words = self._ram[active, self._pc[active]]
+        executed = 0
+        for instr in np.unique(words):
+            lanes = active[words == instr]
+            flags, rd_addr, rs1_addr, rs2_addr, imm = self._decode(int(instr))
+            if flags == 0:
+                # EOF is coded as no op
+                self._halted[lanes] = True
+                continue
+
+            rs1 = self._regs[lanes, rs1_addr]
+            rs2 = self._regs[lanes, rs2_addr]
+            alu_out = alu_lanes(flags, rs1, np.int64(imm) if flags & USE_IMM_FLAG else rs2)
+
+            write_value = alu_out
+            if flags & MEM_READ_FLAG:
+                self._check_addrs(alu_out)
+                write_value = self._ram[lanes, alu_out]
+            elif flags & MEM_WRITE_FLAG:
+                self._check_addrs(alu_out)
+                self._ram[lanes, alu_out] = rs2
+
+            pc = self._pc[lanes]
+            if rd_addr == PC_REGISTER and flags & REG_WRITE_FLAG:
+                self._pc[lanes] = write_value
+            else:
+                if flags & JAL_FLAG:
+                    self._regs[lanes, RETURN_ADDRESS_REGITSTER] = pc + 1
+                elif flags & REG_WRITE_FLAG and rd_addr != 0:
+                    self._regs[lanes, rd_addr] = write_value
+                if flags & BRANCH_FLAG:
+                    self._pc[lanes] = np.where(alu_out > 0, pc + imm, pc + 1)
+                else:
+                    self._pc[lanes] = pc + 1
+            self._retired[lanes] += 1
+            executed += lanes.size
+        return executed
+
+    def run(self, max_steps: int | None = None) -> RunResult:
+        """Steps until every lane has halted or max_steps steps have run.
+
+        The result counts instructions summed over lanes and steps as cycles.
+        """
+        instructions = 0
+        steps = 0
+        while not self._halted.all():
+            reason = limit_reached(0, steps, None, max_steps)
+            if reason is not None:
+                return RunResult(reason, instructions, steps)
+            instructions += self.step()
+            steps += 1
+        return RunResult(HaltReason.HALTED, instructions, steps)
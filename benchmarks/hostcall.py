@@ -0,0 +1,85 @@
+import sys
+import time
+
+from cpu import Bus, RAM, CPUClocked
+from hostcall import HostCallPort, HOSTCALL_MEMCPY, HOSTCALL_FACTORIAL
+from instructions import Instructions, r_type, i_type, b_type, lw, sw
+
+RAM_SIZE = 8192
+PORT_BASE = RAM_SIZE
+
+
+def guest_memcpy() -> list[int]:
+    # r1 = dst, r2 = src, r3 = number of words
+    return [
+        b_type(Instructions.BEQ, 3, 0, 7), # done when r3 == 0
+        lw(4, 2, 0),
+        sw(1, 4, 0),
+        i_type(Instructions.ADDI, 1, 1, 1),
+        i_type(Instructions.ADDI, 2, 2, 1),
+        i_type(Instructions.ADDI, 3, 3, -1),
+        b_type(Instructions.BEQ, 0, 0, -6),
+        0,
+    ]
+
+
+def guest_factorial() -> list[int]:
+    # r1 = n, result in r1
+    return [
+        i_type(Instructions.ADDI, 2, 0, 1), # r2 = 1
+        b_type(Instructions.BEQ, 1, 0, 4), # done when r1 == 0
+        r_type(Instructions.MUL, 2, 2, 1),
+        i_type(Instructions.ADDI, 1, 1, -1),
+        b_type(Instructions.BEQ, 0, 0, -3),
+        r_type(Instructions.ADD, 1, 2, 0), # r1 = r2
+        0,
+    ]
+
+
+def host_call(number: int) -> list[int]:
+    return [
+        i_type(Instructions.ADDI, 5, 0, number),
+        r_type(Instructions.ADD, 10, 0, 11), # r10 = port base, preloaded in r11
+        sw(10, 5, 0),
+        0,
+    ]
+
+
+def run(program: list[int], registers: dict[int, int]) -> tuple[float, int, CPUClocked, RAM]:
+    ram = RAM(RAM_SIZE)
+    ram.write_words(0, program)
+    ram.write_words(1000, list(range(3000)))
+    port = HostCallPort(ram)
+    cpu = CPUClocked(num_registers=32, bus=Bus(ram, PORT_BASE, port))
+    port.attach(cpu)
+    cpu.set_register(11, PORT_BASE)
+    for register, value in registers.items():
+        cpu.set_register(register, value)
+    start = time.perf_counter()
+    result = cpu.run()
+    return time.perf_counter() - start, result.instructions, cpu, ram
+
+
+def compare(name: str, guest: list[int], number: int, registers: dict[int, int], returns: bool) -> None:
+    guest_time, guest_instructions, guest_cpu, guest_ram = run(guest, registers)
+    host_time, host_instructions, host_cpu, host_ram = run(host_call(number), registers)
+    # both versions must leave the same data behind
+    assert guest_ram.read_words(1000, RAM_SIZE - 1000) == host_ram.read_words(1000, RAM_SIZE - 1000)
+    if returns:
+        assert guest_cpu.read_register(1) == host_cpu.read_register(1)
+    print(f"{name}:")
+    print(f"\tguest: {guest_instructions} instructions in {guest_time * 1000:.2f} ms")
+    print(f"\thost call: {host_instructions} instructions in {host_time * 1000:.2f} ms")
+    print(f"\tspeedup: {guest_time / host_time:.0f}x")
+
+
+# ======================================================================
+# USAGE: python -m benchmarks.hostcall [<words> [<n>]]
+# compares guest code against host calls for memcpy of <words> words
+# and <n>! on CPUClocked (defaults 3000 and 300)
+# ======================================================================
+if __name__ == "__main__":
+    words = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    compare(f"memcpy {words} words", guest_memcpy(), HOSTCALL_MEMCPY, {1: 5000, 2: 1000, 3: words}, returns=False)
+    compare(f"factorial {n}", guest_factorial(), HOSTCALL_FACTORIAL, {1: n}, returns=True)
@@ -0,0 +1,286 @@
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from cpu import Bus, RAM, CPU, CPUClocked, STDOut
+from instructions import Instructions, r_type, i_type, b_type, lw, sw, jal
+from pipeline import CPUPipelined
+
+RAM_SIZE = 8192
+MMIO_BASE = RAM_SIZE
+STACK_BASE = 4096
+STREAM_SRC = 1024
+STREAM_DST = 2048
+STREAM_LENGTH = 512
+
+ENGINES = {
+    "cpu": CPU,
+    "clocked": CPUClocked,
+    "pipelined": CPUPipelined,
+}
+
+# assembly sources timed through assembler.py
+ASSEMBLER_SOURCES = ["Fibsq.asm", "fact.asm", "hello_world.asm"]
+
+# runs per measurement, the fastest one is kept
+WORKLOAD_REPEAT = 3
+ASSEMBLER_REPEAT = 20
+
+# a result is a regression when it is this much worse than the baseline
+DEFAULT_THRESHOLD = 0.10
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def alu_loop() -> list[int]:
+    # r7 = iterations, like Fibsq.asm but the values stay small
+    return [
+        r_type(Instructions.ADD, 5, 5, 7),
+        r_type(Instructions.SUB, 6, 5, 6),
+        i_type(Instructions.ADDI, 8, 6, 3),
+        i_type(Instructions.ADDI, 7, 7, -1),
+        b_type(Instructions.BNE, 7, 0, -4),
+        0,
+    ]
+
+
+def call_loop() -> list[int]:
+    # r7 = iterations, each calls a function that saves and restores ra and r7 on the stack like fact.asm
+    return [
+        jal(4),
+        i_type(Instructions.ADDI, 7, 7, -1),
+        b_type(Instructions.BNE, 7, 0, -2),
+        0,
+        sw(30, 31, 0), # push ra
+        sw(30, 7, 1), # push r7
+        i_type(Instructions.ADDI, 30, 30, 2),
+        i_type(Instructions.ADDI, 30, 30, -2),
+        lw(7, 30, 1), # pop r7
+        lw(31, 30, 0), # pop ra
+        r_type(Instructions.ADD, 29, 0, 31), # return
+    ]
+
+
+def mmio_loop() -> list[int]:
+    # r7 = bytes to print, r4 = STDOut base, like hello_world.asm
+    return [
+        sw(4, 3, 0),
+        i_type(Instructions.ADDI, 7, 7, -1),
+        b_type(Instructions.BNE, 7, 0, -2),
+        sw(4, 3, 1), # flush
+        0,
+    ]
+
+
+def stream_loop() -> list[int]:
+    # r7 = passes, r8 = words per pass, r9 = source, r10 = destination; copies and sums the source
+    return [
+        r_type(Instructions.ADD, 1, 9, 0),
+        r_type(Instructions.ADD, 2, 10, 0),
+        r_type(Instructions.ADD, 3, 8, 0),
+        lw(4, 1, 0),
+        sw(2, 4, 0),
+        r_type(Instructions.ADD, 5, 5, 4),
+        i_type(Instructions.ADDI, 1, 1, 1),
+        i_type(Instructions.ADDI, 2, 2, 1),
+        i_type(Instructions.ADDI, 3, 3, -1),
+        b_type(Instructions.BNE, 3, 0, -6),
+        i_type(Instructions.ADDI, 7, 7, -1),
+        b_type(Instructions.BNE, 7, 0, -11),
+        0,
+    ]
+
+
+# name: (program, registers at start, iterations at scale 1)
+WORKLOADS = {
+    "alu": (alu_loop, {}, 40000),
+    "call": (call_loop, {30: STACK_BASE}, 20000),
+    "mmio": (mmio_loop, {4: MMIO_BASE, 3: ord("A")}, 60000),
+    "stream": (stream_loop, {8: STREAM_LENGTH, 9: STREAM_SRC, 10: STREAM_DST}, 40),
+}
+
+# the single cycle cpu does not link on JAL, so it cannot run the call workload
+UNSUPPORTED = {("cpu", "call")}
+
+
+def peak_rss_kb() -> int:
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_workload(engine: str, workload: str, scale: float) -> dict:
+    make_program, registers, iterations = WORKLOADS[workload]
+    seconds = setup = None
+    for _ in range(WORKLOAD_REPEAT):
+        start = time.perf_counter()
+        ram = RAM(RAM_SIZE)
+        ram.write_words(0, make_program())
+        ram.write_words(STREAM_SRC, list(range(STREAM_LENGTH)))
+        cpu = ENGINES[engine](num_registers=32, bus=Bus(ram, MMIO_BASE, STDOut(capture=True)))
+        for register, value in registers.items():
+            cpu.set_register(register, value)
+        cpu.set_register(7, max(1, int(iterations * scale)))
+        elapsed = time.perf_counter() - start
+        setup = elapsed if setup is None else min(setup, elapsed)
+
+        start = time.perf_counter()
+        result = cpu.run()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return {
+        "instructions": result.instructions,
+        "cycles": result.cycles,
+        "seconds": seconds,
+        "setup_seconds": setup,
+        "instructions_per_second": result.instructions / seconds,
+        "cycles_per_second": result.cycles / seconds,
+        "cpi": result.cycles / result.instructions,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def run_assembler(source: str) -> dict:
+    seconds = None
+    with tempfile.TemporaryDirectory() as tmp:
+        argv = sys.argv
+        # --no-cache so every run parses the source instead of reading the cached image
+        sys.argv = ["assembler.py", "--no-cache", os.path.join(REPO_ROOT, source), os.path.join(tmp, "out.bin")]
+        try:
+            for _ in range(ASSEMBLER_REPEAT):
+                start = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    runpy.run_path(os.path.join(REPO_ROOT, "assembler.py"), run_name="__main__")
+                elapsed = time.perf_counter() - start
+                seconds = elapsed if seconds is None else min(seconds, elapsed)
+        finally:
+            sys.argv = argv
+    with open(os.path.join(REPO_ROOT, source)) as f:
+        lines = len(f.readlines())
+    return {
+        "lines": lines,
+        "seconds": seconds,
+        "lines_per_second": lines / seconds,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def run_child(*args: str) -> dict:
+    # every measurement runs in a fresh interpreter so peak rss belongs to that case alone
+    output = subprocess.run([sys.executable, "-m", "benchmarks.suite", "--child", *args],
+                            cwd=REPO_ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def startup_seconds(repeat: int = 5) -> float:
+    # best wall time to start python and import the emulator
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import cpu"], cwd=REPO_ROOT, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_suite(scale: float) -> dict:
+    results = {}
+    for engine in ENGINES:
+        for workload in WORKLOADS:
+            if (engine, workload) not in UNSUPPORTED:
+                results[f"{engine}/{workload}"] = run_child("workload", engine, workload, str(scale))
+    for source in ASSEMBLER_SOURCES:
+        results[f"assembler/{source}"] = run_child("assembler", source)
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "startup_seconds": startup_seconds(),
+        "results": results,
+    }
+
+
+# metric compared for each kind of result and whether higher is better
+COMPARED_METRICS = [
+    ("instructions_per_second", True),
+    ("lines_per_second", True),
+    ("peak_rss_kb", False),
+]
+
+
+def compare(current: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list[str]:
+    """Prints each metric against the baseline, returns the names of the ones that regressed"""
+    regressions = []
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:28} (not in baseline)")
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            if metric not in result or metric not in old:
+                continue
+            change = result[metric] / old[metric] - 1
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{name} {metric}")
+            print(f"{name:28} {metric:24} {old[metric]:>14.1f} -> {result[metric]:>14.1f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def print_results(current: dict) -> None:
+    print(f"startup: {current['startup_seconds'] * 1000:.1f} ms")
+    for name, result in current["results"].items():
+        if "instructions_per_second" in result:
+            print(f"{name:28} {result['instructions_per_second']:>12.0f} instr/s {result['cycles_per_second']:>12.0f} cycles/s "
+                  f"{result['cpi']:>6.2f} CPI {result['peak_rss_kb']:>8} KB")
+        else:
+            print(f"{name:28} {result['seconds'] * 1000:>10.1f} ms {result['lines_per_second']:>12.0f} lines/s "
+                  f"{result['peak_rss_kb']:>8} KB")
+
+
+# ======================================================================
+# USAGE: python -m benchmarks.suite [--output results.json] [--baseline baseline.json] [--scale 1.0]
+# runs every workload on every engine and times assembler.py, each in its own process
+# with --baseline it exits with status 1 if any metric regressed past --threshold
+# ======================================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="emulator benchmark suite")
+    parser.add_argument("--output", help="write results as json to this file")
+    parser.add_argument("--baseline", help="compare against results stored by an earlier --output")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the iterations of every workload")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown before flagging a regression")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        kind, *rest = args.child
+        if kind == "workload":
+            engine, workload, scale = rest
+            print(json.dumps(run_workload(engine, workload, float(scale))))
+        else:
+            print(json.dumps(run_assembler(rest[0])))
+        sys.exit(0)
+
+    current = run_suite(args.scale)
+    print_results(current)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
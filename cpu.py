@@ -1,20 +1,64 @@
+import mmap
+import os
+import struct
+import sys
 from abc import ABC, abstractmethod
+from array import array
 from enum import Enum
-from instructions import decode_instruction, Flags
-
-DEBUG_CPU = True
+from typing import BinaryIO
+from image import Image, is_image
+from profiler import Profiler
+from snapshot import PageTracker, Snapshot, snapshot_machine, restore_machine
+from tracing import TraceSink, is_traced, TRACE_REG_WRITE, TRACE_MEM_READ, TRACE_MEM_WRITE
+from instructions import decode_instruction_table, Flags, REG_WRITE_FLAG, MEM_READ_FLAG, MEM_WRITE_FLAG, BRANCH_FLAG, JAL_FLAG
 
 ZERO = 0
 STACK_POINTER_REGISTER = 30
 PC_REGISTER = 29
 RETURN_ADDRESS_REGITSTER = 31
 
+# cycles CPUClocked spends per instruction, and on the NO_OP that ends a program (fetch + decode)
+CYCLES_PER_INSTRUCTION = 5
+CYCLES_TO_HALT = 2
+
+# packed word storage used by ArrayRAM, MappedRAM and PagedRAM
+WORD_TYPECODE = "i"
+WORD_BYTES = 4
+WORD_MASK = 0xFFFFFFFF
+WORD_SIGN_BIT = 0x80000000
+# words per PagedRAM page, as a power of two
+PAGE_SHIFT = 10
+# addresses per bus dispatch table entry, as a power of two
+BUS_PAGE_SHIFT = 6
+# addresses given to the legacy memory_mapped_io device
+DEFAULT_MMIO_SIZE = 256
+# bytes STDOut buffers before flushing on its own
+STDOUT_FLUSH_THRESHOLD = 1 << 16
+# bytes STDIn asks the host reader for at once
+STDIN_BUFFER_SIZE = 1 << 16
+# DMA register offsets and control commands
+DMA_SRC = 0
+DMA_DST = 1
+DMA_LENGTH = 2
+DMA_CONTROL = 3
+DMA_STATUS = 4
+DMA_MEM_TO_MEM = 1
+DMA_FILE_TO_MEM = 2
+DMA_MEM_TO_FILE = 3
+# big endian word layout of program images
+WORD_STRUCT = struct.Struct(">i")
+
 
 class RegisterFile:
     """Class representing a CPU's register file."""
     def __init__(self, num_register: int):
         self._registers: list[int] = [0] * num_register
 
+    @property
+    def registers(self) -> list[int]:
+        # the live register list, used by execution engines that bypass the read/write methods
+        return self._registers
+
     def read_register(self, read_addr: int) -> int:
         return self._registers[read_addr]
 
@@ -35,6 +79,36 @@ class RegisterFile:
     def dump_regs(self):
         return self._registers[:]
 
+class DecodeCache:
+    """Class caching decoded instructions by the address they were fetched from"""
+    def __init__(self):
+        self._entries: dict[int, tuple[int, int, int, int, int, int]] = {}
+
+    def lookup(self, addr: int) -> tuple[int, int, int, int, int, int] | None:
+        # returns (instr, flags, rd_addr, rs1_addr, rs2_addr, imm) or None on a miss
+        return self._entries.get(addr)
+
+    def insert(self, addr: int, instr: int, decoded: tuple[int, int, int, int, int]) -> tuple[int, int, int, int, int, int]:
+        entry = (instr, *decoded)
+        self._entries[addr] = entry
+        return entry
+
+    def invalidate(self, addr: int) -> None:
+        self._entries.pop(addr, None)
+
+    def invalidate_range(self, start: int, stop: int) -> None:
+        # walk whichever is smaller, the range or the cache
+        if stop - start > len(self._entries):
+            for addr in [addr for addr in self._entries if start <= addr < stop]:
+                del self._entries[addr]
+        else:
+            for addr in range(start, stop):
+                self._entries.pop(addr, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
 class Memory(ABC):
     @abstractmethod
     def write_addr(self, addr: int, value: int) -> None:
@@ -43,28 +117,146 @@ class Memory(ABC):
     def read_addr(self, addr: int) -> int:
         raise NotImplementedError("")
 
+    def attach_decode_cache(self, cache: DecodeCache) -> None:
+        # devices that can hold code override this to invalidate the cache on writes
+        return
+
 
 
 
 
 class STDOut(Memory):
-    """Class imitating a basic stdout mmio device"""
-    def __init__(self):
-        self._buffer: str = ""
+    """Class imitating a basic stdout mmio device.
+
+    Writing to address 1 flushes the buffer, writing to any other address appends the low byte of the
+    value. Flushed bytes go to a host binary stream, a file descriptor, or (in capture mode) are kept
+    for getvalue(). The buffer is also flushed once it reaches flush_threshold bytes.
+    """
+    def __init__(self, stream: BinaryIO | None = None, fd: int | None = None, capture: bool = False,
+                 flush_threshold: int = STDOUT_FLUSH_THRESHOLD):
+        self._buffer: bytearray = bytearray()
+        self._stream: BinaryIO | None = stream
+        self._fd: int | None = fd
+        self._captured: bytearray | None = bytearray() if capture else None
+        self._flush_threshold: int = flush_threshold
     
     def read_addr(self, addr: int) -> int:
         # reads are not allowed, so zero is always returned
         return 0
     
     def write_addr(self, addr: int, value: int) -> None:
-        # if any value is written to addr 1, buffer is flushed and printed to stdout
+        # if any value is written to addr 1, buffer is flushed to the host
         if addr == 1:
-            print(f"STDOUT: {self._buffer}")
-            self._buffer = ""
+            self.flush()
         else:
             # writes to any other address append to the buffer
-            self._buffer = self._buffer + (chr(value))
+            self._buffer.append(value & 0xFF)
+            if len(self._buffer) >= self._flush_threshold:
+                self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        if self._captured is not None:
+            self._captured += self._buffer
+        elif self._fd is not None:
+            data = bytes(self._buffer)
+            while data:
+                data = data[os.write(self._fd, data):]
+        else:
+            stream = self._stream
+            if stream is None:
+                # looked up on every flush so redirected stdout is respected
+                stream = getattr(sys.stdout, "buffer", None)
+            if stream is None:
+                sys.stdout.write(self._buffer.decode(errors="replace"))
+                sys.stdout.flush()
+            else:
+                stream.write(self._buffer)
+                stream.flush()
+        self._buffer.clear()
+
+    def getvalue(self) -> bytes:
+        # everything the guest has written so far, only available in capture mode
+        if self._captured is None:
+            raise ValueError("STDOut is not in capture mode")
+        return bytes(self._captured + self._buffer)
+
+    def snapshot_state(self) -> tuple[bytes, bytes | None]:
+        return bytes(self._buffer), None if self._captured is None else bytes(self._captured)
+
+    def restore_state(self, state: tuple[bytes, bytes | None]) -> None:
+        buffer, captured = state
+        self._buffer = bytearray(buffer)
+        if self._captured is not None and captured is not None:
+            self._captured = bytearray(captured)
+
+
+
+class STDIn(Memory):
+    """Class imitating a basic stdin mmio device.
+
+    Reading address 0 returns the number of bytes buffered and ready (0 once the input is exhausted),
+    address 1 returns the next byte and address 2 the next big endian word, both -1 at the end of input.
+    A word cut short by the end of input is padded with zeros. Input comes from a host binary stream,
+    a file path or sys.stdin and is pulled in chunks of up to buffer_size bytes.
+    """
+    def __init__(self, source: BinaryIO | str | None = None, buffer_size: int = STDIN_BUFFER_SIZE):
+        self._owned: bool = isinstance(source, str)
+        self._stream: BinaryIO | None = open(source, "rb") if isinstance(source, str) else source
+        self._buffer_size: int = buffer_size
+        self._buffer: bytes = b""
+        self._pos: int = 0
+
+    def _fill(self, count: int) -> int:
+        # pulls input until count bytes are buffered or the input ends, returns the bytes buffered
+        available = len(self._buffer) - self._pos
+        while available < count:
+            stream = self._stream
+            if stream is None:
+                stream = sys.stdin.buffer
+            read = getattr(stream, "read1", stream.read)
+            chunk = read(self._buffer_size)
+            if not chunk:
+                break
+            self._buffer = self._buffer[self._pos:] + chunk
+            self._pos = 0
+            available = len(self._buffer)
+        return available
+
+    def read_addr(self, addr: int) -> int:
+        if addr == 0:
+            return self._fill(1)
+        if addr == 1:
+            if self._fill(1) == 0:
+                return -1
+            self._pos += 1
+            return self._buffer[self._pos - 1]
+        if addr == 2:
+            available = self._fill(WORD_BYTES)
+            if available == 0:
+                return -1
+            word = self._buffer[self._pos:self._pos + WORD_BYTES].ljust(WORD_BYTES, b"\0")
+            self._pos += min(available, WORD_BYTES)
+            return WORD_STRUCT.unpack(word)[0]
+        return 0
+
+    def write_addr(self, addr: int, value: int) -> None:
+        # writes are ignored
+        pass
+
+    def snapshot_state(self) -> bytes:
+        # only the buffered input can be saved, the host stream is not rewound on restore
+        return self._buffer[self._pos:]
+
+    def restore_state(self, state: bytes) -> None:
+        self._buffer = state
+        self._pos = 0
 
+    def close(self) -> None:
+        # only closes files the device opened itself
+        if self._owned:
+            self._stream.close()
 
 
 class RAM(Memory):
@@ -72,9 +264,52 @@ class RAM(Memory):
     def __init__(self, size: int, stack_addr: int | None = None):
         self._size: int = size
         self._stack_addr: int | None = stack_addr
-        self._memory: list[int] = [0] * size
+        self._memory: list[int] = self._allocate(size)
+        self._decode_caches: list[DecodeCache] = []
 
-    def load_file(self, file_path: str):
+    def _allocate(self, size: int) -> list[int]:
+        return [0] * size
+
+    def _check_program_size(self, num_words: int) -> None:
+        if self._stack_addr is not None and num_words > self._stack_addr:
+            raise ValueError(f"program too large for RAM (program = {num_words}, ram = {self._stack_addr})")    
+        if num_words > self._size:
+            raise ValueError(f"program too large for RAM (program = {num_words}, ram = {self._size})")    
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def memory(self) -> list[int]:
+        # the backing word list, execution engines index it directly for loads
+        return self._memory
+
+    def attach_decode_cache(self, cache: DecodeCache) -> None:
+        self._decode_caches.append(cache)
+
+    def load_file(self, file_path: str) -> Image | None:
+        """Loads a program image, returns the Image for sectioned files and None for flat ones.
+
+        A flat image is copied word for word starting at address 0, a sectioned one has each of its
+        sections written at its base address.
+        """
+        if is_image(file_path):
+            image = Image.load(file_path)
+            self.load_image(image)
+            return image
+        self._load_flat(file_path)
+        return None
+
+    def load_image(self, image: Image) -> None:
+        for section in image.sections:
+            self._check_program_size(section.end)
+        for section in image.sections:
+            self.write_words(section.base, section.words)
+        for cache in self._decode_caches:
+            cache.clear()
+
+    def _load_flat(self, file_path: str):
         res: list[int]= []
         with open(file_path, "rb") as f:
             while True:
@@ -82,19 +317,20 @@ class RAM(Memory):
                 if len(chunk) < 4:
                     break
                 res.append(int.from_bytes(chunk, 'big'))
-        if self._stack_addr is not None and len(res) > self._stack_addr:
-            raise ValueError(f"program too large for RAM (program = {len(res)}, ram = {self._stack_addr})")    
-        if len(res) > self._size:
-            raise ValueError(f"program too large for RAM (program = {len(res)}, ram = {self._size})")    
+        self._check_program_size(len(res))
 
         for i, word in enumerate(res):
             self._memory[i] = word          
+        for cache in self._decode_caches:
+            cache.clear()
 
 
     def write_addr(self, addr: int, value: int) -> None:
         if addr > self._size:
             raise ValueError(f"Addres out of bounds. Addr: {addr}. Ram size: {self._size}")
         self._memory[addr] = value
+        for cache in self._decode_caches:
+            cache.invalidate(addr)
         # print('write', addr, self._memory)
     
     def read_addr(self, addr: int) -> int:
@@ -103,44 +339,507 @@ class RAM(Memory):
             raise ValueError(f"Addres out of bounds. Addr: {addr}. Ram size: {self._size}")
         return self._memory[addr]
 
+    def _check_range(self, addr: int, count: int) -> None:
+        if addr < 0 or count < 0 or addr + count > self._size:
+            raise ValueError(f"Addres range out of bounds. Addr: {addr}. Count: {count}. Ram size: {self._size}")
+
+    def _invalidate_range(self, start: int, stop: int) -> None:
+        for cache in self._decode_caches:
+            cache.invalidate_range(start, stop)
+
+    def read_words(self, addr: int, count: int) -> list[int]:
+        # copy of count words starting at addr
+        self._check_range(addr, count)
+        return self._memory[addr:addr + count]
+
+    def write_words(self, addr: int, words: list[int] | array) -> None:
+        # stores words starting at addr with one slice assignment
+        self._check_range(addr, len(words))
+        self._memory[addr:addr + len(words)] = words
+        self._invalidate_range(addr, addr + len(words))
+
+    def copy_words(self, src: int, dst: int, count: int) -> None:
+        # overlapping ranges are fine, the source is read in full before the destination is written
+        self.write_words(dst, self.read_words(src, count))
+
+
+class ArrayRAM(RAM):
+    """Class representing Random Access Memory stored as packed 32 bit words.
+
+    Values are wrapped to signed 32 bit words on write, like a real 32 bit memory.
+    """
+    def _allocate(self, size: int) -> array:
+        return array(WORD_TYPECODE, bytes(size * WORD_BYTES))
+
+    def _load_flat(self, file_path: str):
+        # read the whole big endian image straight into a word array with one call
+        with open(file_path, "rb") as f:
+            num_words = os.fstat(f.fileno()).st_size // WORD_BYTES
+            self._check_program_size(num_words)
+            words = array(WORD_TYPECODE, bytes(num_words * WORD_BYTES))
+            f.readinto(words)
+        if sys.byteorder == "little":
+            words.byteswap()
+        self._memory[:num_words] = words
+        for cache in self._decode_caches:
+            cache.clear()
+
+    def write_addr(self, addr: int, value: int) -> None:
+        if addr > self._size:
+            raise ValueError(f"Addres out of bounds. Addr: {addr}. Ram size: {self._size}")
+        self._memory[addr] = ((value + WORD_SIGN_BIT) & WORD_MASK) - WORD_SIGN_BIT
+        for cache in self._decode_caches:
+            cache.invalidate(addr)
+
+    def write_words(self, addr: int, words: list[int] | array) -> None:
+        if not isinstance(words, array) or words.typecode != WORD_TYPECODE:
+            words = array(WORD_TYPECODE, [((value + WORD_SIGN_BIT) & WORD_MASK) - WORD_SIGN_BIT for value in words])
+        super().write_words(addr, words)
+
+    def view(self, start: int = 0, stop: int | None = None) -> memoryview:
+        # zero copy view of a range of words in native byte order
+        return memoryview(self._memory)[start:stop]
+
+    def dump(self, file_path: str, start: int = 0, stop: int | None = None):
+        # write a range of words as a big endian image that load_file can read back
+        words = array(WORD_TYPECODE, self.view(start, stop))
+        if sys.byteorder == "little":
+            words.byteswap()
+        with open(file_path, "wb") as f:
+            f.write(words)
+
+
+class MappedRAM(RAM):
+    """Class representing Random Access Memory backed by a memory mapped program image.
+
+    load_file maps a flat image instead of copying it, so pages are only read in when the guest touches
+    them. Writes go to a private copy on write mapping, or back to the file if persist is set.
+    Addresses past the end of the image are backed by anonymous zero filled memory. Sectioned images
+    do not match the layout of ram, so they are copied into anonymous memory.
+    """
+    def __init__(self, size: int, stack_addr: int | None = None, persist: bool = False):
+        self._persist: bool = persist
+        self._map: mmap.mmap | None = None
+        self._mapped_words: int = 0
+        super().__init__(size, stack_addr)
+
+    def _allocate(self, size: int) -> mmap.mmap | None:
+        # until an image is loaded all of ram is anonymous memory
+        self._tail: mmap.mmap | None = mmap.mmap(-1, size * WORD_BYTES) if size > 0 else None
+        return None
+
+    @property
+    def memory(self) -> None:
+        # words are stored big endian in the mapping, so there is no word list to index
+        return None
+
+    def _load_flat(self, file_path: str):
+        self.close()
+        with open(file_path, "r+b" if self._persist else "rb") as f:
+            num_words = os.fstat(f.fileno()).st_size // WORD_BYTES
+            self._check_program_size(num_words)
+            if self._persist and num_words < self._size:
+                # grow the file so every ram address is backed by it
+                f.truncate(self._size * WORD_BYTES)
+                num_words = self._size
+            if num_words > 0:
+                access = mmap.ACCESS_WRITE if self._persist else mmap.ACCESS_COPY
+                self._map = mmap.mmap(f.fileno(), num_words * WORD_BYTES, access=access)
+        self._mapped_words = num_words
+        tail_words = self._size - num_words
+        self._tail = mmap.mmap(-1, tail_words * WORD_BYTES) if tail_words > 0 else None
+        for cache in self._decode_caches:
+            cache.clear()
+
+    def load_image(self, image: Image) -> None:
+        # sections are not laid out like ram in the file, so they are copied into anonymous memory
+        if self._persist:
+            raise ValueError("persist needs a flat image that can be mapped as ram")
+        self.close()
+        self._tail = mmap.mmap(-1, self._size * WORD_BYTES) if self._size > 0 else None
+        super().load_image(image)
+
+    def flush(self):
+        # write back changes to the image file, only meaningful when persist is set
+        if self._map is not None and self._persist:
+            self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self.flush()
+            self._map.close()
+            self._map = None
+        if self._tail is not None:
+            self._tail.close()
+            self._tail = None
+        self._mapped_words = 0
+
+    def write_addr(self, addr: int, value: int) -> None:
+        if addr > self._size:
+            raise ValueError(f"Addres out of bounds. Addr: {addr}. Ram size: {self._size}")
+        value = ((value + WORD_SIGN_BIT) & WORD_MASK) - WORD_SIGN_BIT
+        if addr < self._mapped_words:
+            WORD_STRUCT.pack_into(self._map, addr * WORD_BYTES, value)
+        else:
+            WORD_STRUCT.pack_into(self._tail, (addr - self._mapped_words) * WORD_BYTES, value)
+        for cache in self._decode_caches:
+            cache.invalidate(addr)
+
+    def read_addr(self, addr: int) -> int:
+        if addr > self._size:
+            raise ValueError(f"Addres out of bounds. Addr: {addr}. Ram size: {self._size}")
+        if addr < self._mapped_words:
+            return WORD_STRUCT.unpack_from(self._map, addr * WORD_BYTES)[0]
+        return WORD_STRUCT.unpack_from(self._tail, (addr - self._mapped_words) * WORD_BYTES)[0]
+
+    def _segments(self, addr: int, count: int) -> list[tuple[mmap.mmap, int, int, int]]:
+        # splits a word range into (mapping, start byte, end byte, words before it) for the image and the tail
+        segments = []
+        stop = addr + count
+        if addr < self._mapped_words:
+            end = min(stop, self._mapped_words)
+            segments.append((self._map, addr * WORD_BYTES, end * WORD_BYTES, 0))
+        if stop > self._mapped_words:
+            start = max(addr, self._mapped_words)
+            segments.append((self._tail, (start - self._mapped_words) * WORD_BYTES,
+                             (stop - self._mapped_words) * WORD_BYTES, start - addr))
+        return segments
+
+    def read_words(self, addr: int, count: int) -> array:
+        self._check_range(addr, count)
+        words = array(WORD_TYPECODE)
+        for mapping, start, end, _ in self._segments(addr, count):
+            words.frombytes(mapping[start:end])
+        if sys.byteorder == "little":
+            words.byteswap()
+        return words
+
+    def write_words(self, addr: int, words: list[int] | array) -> None:
+        self._check_range(addr, len(words))
+        words = array(WORD_TYPECODE, [((value + WORD_SIGN_BIT) & WORD_MASK) - WORD_SIGN_BIT for value in words])
+        if sys.byteorder == "little":
+            words.byteswap()
+        data = memoryview(words).cast("B")
+        for mapping, start, end, offset in self._segments(addr, len(words)):
+            mapping[start:end] = data[offset * WORD_BYTES:offset * WORD_BYTES + end - start]
+        self._invalidate_range(addr, addr + len(words))
+
+
+class PagedRAM(RAM):
+    """Class representing sparse Random Access Memory split into fixed size pages.
+
+    Pages are allocated on the first non-zero write, reads from untouched pages return zero, so large
+    address spaces (e.g. the 2^24 words JAL can reach) only cost memory for the pages in use.
+    """
+    def __init__(self, size: int, stack_addr: int | None = None, page_shift: int = PAGE_SHIFT):
+        self._page_shift: int = page_shift
+        self._page_mask: int = (1 << page_shift) - 1
+        super().__init__(size, stack_addr)
+
+    def _allocate(self, size: int) -> list[array | None]:
+        # page table, None marks a page that has never been written
+        return [None] * ((size + self._page_mask) >> self._page_shift)
+
+    @property
+    def memory(self) -> None:
+        # there is no flat word list to index
+        return None
+
+    @property
+    def resident_pages(self) -> int:
+        return sum(page is not None for page in self._memory)
+
+    def _new_page(self) -> array:
+        return array(WORD_TYPECODE, bytes(WORD_BYTES << self._page_shift))
+
+    def untouched(self, addr: int, count: int) -> bool:
+        # whether every page covering the range was never written, so it reads as zero
+        first = addr >> self._page_shift
+        last = (addr + count - 1) >> self._page_shift
+        return all(page is None for page in self._memory[first:last + 1])
+
+    def _load_flat(self, file_path: str):
+        with open(file_path, "rb") as f:
+            num_words = os.fstat(f.fileno()).st_size // WORD_BYTES
+            self._check_program_size(num_words)
+            words = array(WORD_TYPECODE, bytes(num_words * WORD_BYTES))
+            f.readinto(words)
+        if sys.byteorder == "little":
+            words.byteswap()
+        page_size = self._page_mask + 1
+        for start in range(0, num_words, page_size):
+            index = start >> self._page_shift
+            if self._memory[index] is None:
+                self._memory[index] = self._new_page()
+            chunk = words[start:start + page_size]
+            self._memory[index][:len(chunk)] = chunk
+        for cache in self._decode_caches:
+            cache.clear()
+
+    def write_addr(self, addr: int, value: int) -> None:
+        if addr < 0 or addr >= self._size:
+            raise ValueError(f"Addres out of bounds. Addr: {addr}. Ram size: {self._size}")
+        page = self._memory[addr >> self._page_shift]
+        if page is None:
+            if value == 0:
+                # untouched pages already read as zero
+                return
+            page = self._memory[addr >> self._page_shift] = self._new_page()
+        page[addr & self._page_mask] = ((value + WORD_SIGN_BIT) & WORD_MASK) - WORD_SIGN_BIT
+        for cache in self._decode_caches:
+            cache.invalidate(addr)
+
+    def read_addr(self, addr: int) -> int:
+        if addr < 0 or addr >= self._size:
+            raise ValueError(f"Addres out of bounds. Addr: {addr}. Ram size: {self._size}")
+        page = self._memory[addr >> self._page_shift]
+        if page is None:
+            return 0
+        return page[addr & self._page_mask]
+
+    def read_words(self, addr: int, count: int) -> array:
+        self._check_range(addr, count)
+        words = array(WORD_TYPECODE)
+        stop = addr + count
+        while addr < stop:
+            offset = addr & self._page_mask
+            end = min(stop - addr, self._page_mask + 1 - offset) + offset
+            page = self._memory[addr >> self._page_shift]
+            if page is None:
+                words.frombytes(bytes((end - offset) * WORD_BYTES))
+            else:
+                words.extend(page[offset:end])
+            addr += end - offset
+        return words
+
+    def write_words(self, addr: int, words: list[int] | array) -> None:
+        self._check_range(addr, len(words))
+        if not isinstance(words, array) or words.typecode != WORD_TYPECODE:
+            words = array(WORD_TYPECODE, [((value + WORD_SIGN_BIT) & WORD_MASK) - WORD_SIGN_BIT for value in words])
+        start = addr
+        done = 0
+        while done < len(words):
+            offset = addr & self._page_mask
+            n = min(len(words) - done, self._page_mask + 1 - offset)
+            chunk = words[done:done + n]
+            index = addr >> self._page_shift
+            if self._memory[index] is None:
+                if not any(chunk):
+                    # untouched pages already read as zero
+                    addr += n
+                    done += n
+                    continue
+                self._memory[index] = self._new_page()
+            self._memory[index][offset:offset + n] = chunk
+            addr += n
+            done += n
+        self._invalidate_range(start, start + len(words))
+
+
+class DMA(Memory):
+    """Class imitating a dma mmio device that copies blocks of words without running guest code.
+
+    The guest writes the source, destination and length registers, then a command to the control
+    register, which runs the whole transfer as one bulk copy on the ram. Transfers to and from the
+    host file use word offsets into the file, stored as big endian words like a program image.
+    The status register holds the number of words moved by the last command.
+    """
+    def __init__(self, ram: RAM, file_path: str | None = None):
+        self._ram: RAM = ram
+        self._file_path: str | None = file_path
+        self._file: BinaryIO | None = None
+        self._src: int = 0
+        self._dst: int = 0
+        self._length: int = 0
+        self._status: int = 0
+
+    def read_addr(self, addr: int) -> int:
+        if addr == DMA_SRC:
+            return self._src
+        if addr == DMA_DST:
+            return self._dst
+        if addr == DMA_LENGTH:
+            return self._length
+        if addr == DMA_STATUS:
+            return self._status
+        return 0
+
+    def write_addr(self, addr: int, value: int) -> None:
+        if addr == DMA_SRC:
+            self._src = value
+        elif addr == DMA_DST:
+            self._dst = value
+        elif addr == DMA_LENGTH:
+            self._length = value
+        elif addr == DMA_CONTROL:
+            self._status = self._transfer(value)
+
+    def snapshot_state(self) -> tuple[int, int, int, int]:
+        return self._src, self._dst, self._length, self._status
+
+    def restore_state(self, state: tuple[int, int, int, int]) -> None:
+        self._src, self._dst, self._length, self._status = state
+
+    def _host_file(self) -> BinaryIO:
+        if self._file is None:
+            if self._file_path is None:
+                raise ValueError("DMA has no host file")
+            self._file = os.fdopen(os.open(self._file_path, os.O_RDWR | os.O_CREAT), "r+b")
+        return self._file
+
+    def _transfer(self, command: int) -> int:
+        if command == DMA_MEM_TO_MEM:
+            self._ram.copy_words(self._src, self._dst, self._length)
+            return self._length
+        if command == DMA_FILE_TO_MEM:
+            f = self._host_file()
+            f.seek(self._src * WORD_BYTES)
+            words = array(WORD_TYPECODE)
+            data = f.read(self._length * WORD_BYTES)
+            # a partial word at the end of the file is dropped
+            words.frombytes(data[:len(data) - len(data) % WORD_BYTES])
+            if sys.byteorder == "little":
+                words.byteswap()
+            self._ram.write_words(self._dst, words)
+            return len(words)
+        if command == DMA_MEM_TO_FILE:
+            words = array(WORD_TYPECODE, [((value + WORD_SIGN_BIT) & WORD_MASK) - WORD_SIGN_BIT
+                                          for value in self._ram.read_words(self._src, self._length)])
+            if sys.byteorder == "little":
+                words.byteswap()
+            f = self._host_file()
+            f.seek(self._dst * WORD_BYTES)
+            f.write(words)
+            f.flush()
+            return self._length
+        raise ValueError(f"unknown DMA command {command}")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _unmapped(addr: int, value: int | None = None) -> int:
+    raise ValueError("Address out of bounds")
+
+
+_UNMAPPED_PAGE = (_unmapped, _unmapped, 0)
+
+
+class _SplitPage:
+    """A bus page shared by more than one device (or partly unmapped), resolved by scanning its regions"""
+    def __init__(self, regions: list[tuple[int, int, Memory]]):
+        self._regions: list[tuple[int, int, Memory]] = regions
+
+    def read_addr(self, addr: int) -> int:
+        for base, end, device in self._regions:
+            if base <= addr < end:
+                return device.read_addr(addr - base)
+        raise ValueError("Address out of bounds")
+
+    def write_addr(self, addr: int, value: int) -> None:
+        for base, end, device in self._regions:
+            if base <= addr < end:
+                return device.write_addr(addr - base, value)
+        raise ValueError("Address out of bounds")
+
 
 class Bus:
-    """Class that handles read/write oeprations to ram and a singular I/O device"""
-    def __init__(self, random_access_memory: Memory, max_ram_addr: int | None = None, memory_mapped_io: Memory | None = None):
-        self._ram: Memory = random_access_memory 
-        self._mmio: Memory | None = memory_mapped_io 
+    """Class that routes read/write operations to the devices mapped into the address space.
+
+    Ram is always mapped at address 0. Other devices are mapped to their own address ranges and see
+    addresses relative to the start of their range. Accesses are dispatched through a table with an
+    entry per page of addresses, so routing costs one index no matter how many devices are attached.
+    For compatibility a single memory_mapped_io device is mapped at max_ram_addr.
+    """
+    def __init__(self, random_access_memory: Memory, max_ram_addr: int | None = None, memory_mapped_io: Memory | None = None,
+                 page_shift: int = BUS_PAGE_SHIFT):
         if memory_mapped_io is not None and max_ram_addr is None:
-            raise ValueError("")
-        self._max_ram_addr: int | None = max_ram_addr
+            raise ValueError("max_ram_addr is required to map an mmio device")
+        if max_ram_addr is None:
+            max_ram_addr = getattr(random_access_memory, "size", None)
+            if max_ram_addr is None:
+                raise ValueError("max_ram_addr is required for memories without a size")
+        self._ram: Memory = random_access_memory 
+        self._max_ram_addr: int = max_ram_addr
+        self._page_shift: int = page_shift
+        self._regions: list[tuple[int, int, Memory]] = []
+        self._pages: list[tuple] = []
+        self._limit: int = 0
+        self.map_device(0, max_ram_addr, random_access_memory)
+        if memory_mapped_io is not None:
+            self.map_device(max_ram_addr, DEFAULT_MMIO_SIZE, memory_mapped_io)
 
-    def read_addr(self, addr: int) -> int:
-        # read an address, if it exceeds the ram max addr, it is a read to the mmio device
-        if self._max_ram_addr is None:
-            print(f"bus read, addr: {addr} [{self._ram.read_addr(addr)}]")
-            return self._ram.read_addr(addr)
+    @property
+    def ram(self) -> Memory:
+        return self._ram
 
-        if addr > self._max_ram_addr:
-            if self._mmio is None:
-                raise ValueError("Address out of bounds")
-            return self._mmio.read_addr(addr - self._max_ram_addr)
-        print(f"bus read, addr: {addr} [{self._ram.read_addr(addr)}]")
-        return self._ram.read_addr(addr)
+    @property
+    def devices(self) -> list[tuple[int, int, Memory]]:
+        # (base, size, device) for every mapped device, ram first
+        return [(base, end - base, device) for base, end, device in self._regions]
+
+    def map_device(self, base: int, size: int, device: Memory) -> None:
+        """Maps device to addresses [base, base + size), it sees them as [0, size)"""
+        if base < 0 or size <= 0:
+            raise ValueError(f"invalid device range (base = {base}, size = {size})")
+        for other_base, other_end, _ in self._regions:
+            if base < other_end and other_base < base + size:
+                raise ValueError(f"device range [{base}, {base + size}) overlaps [{other_base}, {other_end})")
+        self._regions.append((base, base + size, device))
+        self._map_pages(base, base + size, device)
+
+    def _map_pages(self, base: int, end: int, device: Memory):
+        # one (read, write, base) entry per page, only the pages covering [base, end) change
+        page_size = 1 << self._page_shift
+        self._limit = max(self._limit, end)
+        num_pages = (self._limit + page_size - 1) >> self._page_shift
+        self._pages.extend([_UNMAPPED_PAGE] * (num_pages - len(self._pages)))
+        # pages wholly inside the range cannot hold another device, since ranges never overlap
+        whole_start = (base + page_size - 1) >> self._page_shift
+        whole_stop = end >> self._page_shift
+        if whole_stop > whole_start:
+            self._pages[whole_start:whole_stop] = [(device.read_addr, device.write_addr, base)] * (whole_stop - whole_start)
+        for index in {base >> self._page_shift, (end - 1) >> self._page_shift}:
+            if not whole_start <= index < whole_stop:
+                self._pages[index] = self._page_entry(index)
+
+    def _page_entry(self, index: int) -> tuple:
+        # pages not wholly inside one device dispatch through a _SplitPage
+        page_start = index << self._page_shift
+        page_end = page_start + (1 << self._page_shift)
+        overlapping = [region for region in self._regions if region[0] < page_end and page_start < region[1]]
+        if len(overlapping) == 1 and overlapping[0][0] <= page_start and page_end <= overlapping[0][1]:
+            base, _, device = overlapping[0]
+            return device.read_addr, device.write_addr, base
+        split = _SplitPage(overlapping)
+        return split.read_addr, split.write_addr, 0
+
+    def ram_window(self) -> tuple[int, int]:
+        # number of addresses starting at 0 that reads and writes route to ram
+        return self._max_ram_addr, self._max_ram_addr
+
+    def attach_decode_cache(self, cache: DecodeCache) -> None:
+        self._ram.attach_decode_cache(cache)
+
+    def is_ram_addr(self, addr: int) -> bool:
+        # instructions fetched from ram can be cached, mmio reads cannot
+        return 0 <= addr < self._max_ram_addr
 
+    def read_addr(self, addr: int) -> int:
+        if 0 <= addr < self._limit:
+            read, _, base = self._pages[addr >> self._page_shift]
+            return read(addr - base)
+        raise ValueError("Address out of bounds")
 
     def write_addr(self, addr: int, value: int, flags: int):
-        # write to an address, if it exceeds the ram max addr, it is a write to the mmio device
-        if flags & Flags.MEM_WRITE_FLAG.value <= 0:
+        if flags & MEM_WRITE_FLAG <= 0:
             return
-        if self._max_ram_addr is None:
-            print(f"bus write, addr: {addr} [value]")
-            return self._ram.write_addr(addr, value)
-
-        if addr >= self._max_ram_addr:
-            if self._mmio is None:
-                raise ValueError("Address out of bounds")
-            return self._mmio.write_addr(addr - self._max_ram_addr, value)
-        print(f"bus write, addr: {addr} [value]")
-        return self._ram.write_addr(addr, value)
+        if 0 <= addr < self._limit:
+            _, write, base = self._pages[addr >> self._page_shift]
+            return write(addr - base, value)
+        raise ValueError("Address out of bounds")
 
 
 class ProgramCounter:
@@ -195,13 +894,109 @@ def alu(flags: int, rs1: int, rs2: int, imm: int):
     return rd
 
 
+class CPUStates(Enum):
+    STOPPED = -1
+    FETCH = 0
+    DECODE = 1 
+    EXECUTE = 2 
+    MEM = 3 
+    WB = 4
+
+
+class HaltReason(Enum):
+    HALTED = 0 # reached the NO_OP that marks the end of the program
+    INSTRUCTION_LIMIT = 1
+    CYCLE_LIMIT = 2
+
+
+class RunResult:
+    """Class describing why a run stopped and how much work it did"""
+    def __init__(self, reason: HaltReason, instructions: int, cycles: int):
+        self.reason: HaltReason = reason
+        self.instructions: int = instructions
+        self.cycles: int = cycles
+
+    def __repr__(self) -> str:
+        return f"RunResult(reason={self.reason.name}, instructions={self.instructions}, cycles={self.cycles})"
+
+
+def limit_reached(instructions: int, cycles: int, max_instructions: int | None, max_cycles: int | None) -> HaltReason | None:
+    # returns the budget that has run out, if any
+    if max_instructions is not None and instructions >= max_instructions:
+        return HaltReason.INSTRUCTION_LIMIT
+    if max_cycles is not None and cycles >= max_cycles:
+        return HaltReason.CYCLE_LIMIT
+    return None
+
+
+def trace_kind(flags: int, rd_addr: int) -> int:
+    # which fields of a trace record an instruction with these flags fills in
+    kind = 0
+    if flags & REG_WRITE_FLAG and rd_addr != 0:
+        kind |= TRACE_REG_WRITE
+    if flags & MEM_READ_FLAG:
+        kind |= TRACE_MEM_READ
+    if flags & MEM_WRITE_FLAG:
+        kind |= TRACE_MEM_WRITE
+    return kind
+
+
+def step_cycles(cpu, instructions: int, cycles: int, max_instructions: int | None, max_cycles: int | None, to_boundary: bool = False) -> tuple[RunResult | None, int, int]:
+    # runs cpu.cycle() until the program ends or a budget runs out, with to_boundary it also returns
+    # (without a result) as soon as the cpu is back at the start of an instruction
+    while not (to_boundary and cpu.cur_state == CPUStates.FETCH.value):
+        reason = limit_reached(instructions, cycles, max_instructions, max_cycles)
+        if reason is not None:
+            return RunResult(reason, instructions, cycles), instructions, cycles
+        state = cpu.cycle()
+        cycles += 1
+        if state == CPUStates.STOPPED.value:
+            return RunResult(HaltReason.HALTED, instructions, cycles), instructions, cycles
+        if state == CPUStates.WB.value:
+            instructions += 1
+    return None, instructions, cycles
+
+
+def fetch_decode(bus: Bus, cache: DecodeCache, addr: int) -> tuple[int, int, int, int, int, int]:
+    # fetch and decode the instruction at addr, reusing the cached decode if the word is unchanged
+    entry = cache.lookup(addr)
+    if entry is not None:
+        return entry
+    instr = bus.read_addr(addr) # read raw instruction bits from bus
+    decoded = decode_instruction_table(instr) # decode instruction
+    if not bus.is_ram_addr(addr):
+        return (instr, *decoded)
+    return cache.insert(addr, instr, decoded)
+
+
 class CPU:
-    """CPU class that completes one instruction per clock cycle."""
-    def __init__(self, num_registers: int, bus: Bus):
+    """CPU class that completes one instruction per clock cycle.
+
+    If built with a trace sink or a profiler, every retired instruction is recorded and run() steps
+    cycle(), otherwise run() uses the untraced loop.
+    """
+    def __init__(self, num_registers: int, bus: Bus, trace: TraceSink | None = None, profiler: Profiler | None = None):
         self._reg_file: RegisterFile = RegisterFile(num_registers)
         self._pc: ProgramCounter = ProgramCounter(0)
         self._bus: Bus = bus
+        self._decode_cache: DecodeCache = DecodeCache()
+        bus.attach_decode_cache(self._decode_cache)
+        self._trace: TraceSink | None = trace if is_traced(trace) else None
+        self._profiler: Profiler | None = profiler
+        self._page_tracker: PageTracker | None = None
+
 
+    def dump_regs(self) -> list[int]:
+        return self._reg_file.dump_regs()
+
+    @property
+    def next_instruction(self) -> int:
+        return self._pc.next_instruction
+
+    @next_instruction.setter
+    def next_instruction(self, addr: int):
+        # moves the pc between instructions, e.g. to start at an image's entry point
+        self._pc.write_next_instruction(addr)
 
     def set_register(self, register_number: int, value: int):
         self._reg_file.write_register(register_number, value)
@@ -209,16 +1004,44 @@ class CPU:
     def read_register(self, register_number: int):
         return self._reg_file.read_register(register_number)
 
-    def cycle(self):
-        # fetch stage
-        instr = self._bus.read_addr(self._pc.next_instruction) # read raw instruction bits from bus
+    @property
+    def cur_state(self) -> int:
+        # completes a whole instruction per cycle, so it is always about to fetch
+        return CPUStates.FETCH.value
+
+    def _tracker(self) -> PageTracker:
+        # created on first use, so machines that never snapshot do not track writes
+        if self._page_tracker is None:
+            self._page_tracker = PageTracker(self._bus.ram)
+        return self._page_tracker
+
+    def snapshot(self) -> Snapshot:
+        """Captures registers, pc, ram and device state, only pages written since the last snapshot are copied"""
+        state = {"registers": self._reg_file.dump_regs(), "pc": self._pc.next_instruction}
+        return snapshot_machine(state, self._tracker(), self._bus)
+
+    def restore(self, snapshot: Snapshot):
+        restore_machine(snapshot, self._tracker(), self._bus)
+        self._reg_file.registers[:] = snapshot.cpu["registers"]
+        self._pc.write_next_instruction(snapshot.cpu["pc"])
+
+    def fetch_decode(self, addr: int) -> tuple[int, int, int, int, int, int]:
+        return fetch_decode(self._bus, self._decode_cache, addr)
+
+    def _profile(self, instr: int, flags: int, alu_out: int):
+        if flags & MEM_READ_FLAG:
+            self._profiler.mem_read(alu_out)
+        elif flags & MEM_WRITE_FLAG:
+            self._profiler.mem_write(alu_out)
+        taken = alu_out > 0 if flags & BRANCH_FLAG else None
+        self._profiler.retire(self._pc.next_instruction, instr, 1, taken)
 
-        # decode stage
-        flags, rd_addr, rs1_addr, rs2_addr, imm =  decode_instruction(instr) # decode instruction
+    def cycle(self) -> int:
+        # fetch and decode stage
+        instr, flags, rd_addr, rs1_addr, rs2_addr, imm = self.fetch_decode(self._pc.next_instruction)
         if flags == 0:
             # if no flags are set, then EOF reached ( EOF coded as no op)
-            print(">Reached End of Program")
-            exit()
+            return CPUStates.STOPPED.value
         rs1, rs2 = self._reg_file.read_registers(rs1_addr, rs2_addr) # read register file
 
         # execute stage
@@ -233,23 +1056,80 @@ class CPU:
 
         # write back stage
         self._reg_file.update_register(rd_addr, alu_out, bus_out, flags) # update registers if operation has a return
+        if self._trace is not None:
+            write_value = bus_out if flags & MEM_READ_FLAG else alu_out
+            mem_value = bus_out if flags & MEM_READ_FLAG else rs2
+            kind = trace_kind(flags, rd_addr)
+            self._trace.record(self._pc.next_instruction, instr, rd_addr, write_value, alu_out, mem_value, kind)
+        if self._profiler is not None:
+            self._profile(instr, flags, alu_out)
         self._pc.set_next_instruction(alu_out, imm, flags) # update pc for next instruction 
+        return CPUStates.WB.value
+
+    def run(self, max_instructions: int | None = None, max_cycles: int | None = None) -> RunResult:
+        """Runs until the end of the program or until a budget runs out, one cycle per instruction"""
+        if self._trace is not None or self._profiler is not None:
+            result, _, _ = step_cycles(self, 0, 0, max_instructions, max_cycles)
+            return result
+        regs = self._reg_file.registers
+        cached = self._decode_cache.lookup
+        fetch = self.fetch_decode
+        bus_read = self._bus.read_addr
+        bus_write = self._bus.write_addr
+        pc = self._pc.next_instruction
+        count = 0
+        limit = -1
+        for budget in (max_instructions, max_cycles):
+            if budget is not None and (limit < 0 or budget < limit):
+                limit = budget
+        reason = HaltReason.HALTED
+        try:
+            while True:
+                if count == limit:
+                    reason = limit_reached(count, count, max_instructions, max_cycles)
+                    break
+                _, flags, rd_addr, rs1_addr, rs2_addr, imm = cached(pc) or fetch(pc)
+                if flags == 0:
+                    break
+                rs2 = regs[rs2_addr]
+                alu_out = alu(flags, regs[rs1_addr], rs2, imm)
+                if flags & MEM_READ_FLAG:
+                    if flags & REG_WRITE_FLAG and rd_addr != 0:
+                        regs[rd_addr] = bus_read(alu_out)
+                    else:
+                        bus_read(alu_out)
+                elif flags & MEM_WRITE_FLAG:
+                    bus_write(alu_out, rs2, flags)
+                elif flags & REG_WRITE_FLAG and rd_addr != 0:
+                    regs[rd_addr] = alu_out
+                if flags & BRANCH_FLAG and alu_out > 0:
+                    pc += imm
+                else:
+                    pc += 1
+                count += 1
+        finally:
+            self._pc.write_next_instruction(pc)
+        return RunResult(reason, count, count)
 
 
-class CPUStates(Enum):
-    STOPPED = -1
-    FETCH = 0
-    DECODE = 1 
-    EXECUTE = 2 
-    MEM = 3 
-    WB = 4
+class CPUClocked:
+    """CPU class that takes one clock cycle per stage, five per instruction.
 
+    If built with a trace sink or a profiler, every retired instruction is recorded at write back and
+    run() steps cycle(), otherwise run() uses the untraced loop.
+    """
+    # values held between stages, saved by snapshot()
+    LATCHES = ("_decoded", "_instr", "_flags", "_rd_addr", "_rs1_addr", "_rs2_addr", "_imm", "_rs1", "_rs2", "_alu_out", "_bus_out")
 
-class CPUClocked:
-    def __init__(self, num_registers: int, bus: Bus):
+    def __init__(self, num_registers: int, bus: Bus, trace: TraceSink | None = None, profiler: Profiler | None = None):
         self._reg_file: RegisterFile = RegisterFile(num_registers)
         self._pc: ProgramCounter = ProgramCounter(0)
         self._bus: Bus = bus
+        self._decode_cache: DecodeCache = DecodeCache()
+        bus.attach_decode_cache(self._decode_cache)
+        self._decoded: tuple[int, int, int, int, int, int] | None = None
+        self._trace: TraceSink | None = trace if is_traced(trace) else None
+        self._profiler: Profiler | None = profiler
         self._state: CPUStates = CPUStates.FETCH
 
         self._instr: int = 0
@@ -262,6 +1142,7 @@ class CPUClocked:
         self._rs2: int = 0
         self._alu_out: int = 0
         self._bus_out: int = 0
+        self._page_tracker: PageTracker | None = None
 
 
 
@@ -273,6 +1154,11 @@ class CPUClocked:
     def next_instruction(self) -> int:
         return self._pc.next_instruction
 
+    @next_instruction.setter
+    def next_instruction(self, addr: int):
+        # moves the pc between instructions, e.g. to start at an image's entry point
+        self._pc.write_next_instruction(addr)
+
     @property
     def cur_state(self) -> int:
         return self._state.value
@@ -283,32 +1169,75 @@ class CPUClocked:
     def read_register(self, register_number: int):
         return self._reg_file.read_register(register_number)
 
+    def _tracker(self) -> PageTracker:
+        # created on first use, so machines that never snapshot do not track writes
+        if self._page_tracker is None:
+            self._page_tracker = PageTracker(self._bus.ram)
+        return self._page_tracker
+
+    def snapshot(self) -> Snapshot:
+        """Captures registers, pc, latches, ram and device state, only pages written since the last snapshot are copied"""
+        state = {"registers": self._reg_file.dump_regs(), "pc": self._pc.next_instruction, "state": self._state.value}
+        for latch in self.LATCHES:
+            state[latch] = getattr(self, latch)
+        return snapshot_machine(state, self._tracker(), self._bus)
+
+    def restore(self, snapshot: Snapshot):
+        restore_machine(snapshot, self._tracker(), self._bus)
+        self._reg_file.registers[:] = snapshot.cpu["registers"]
+        self._pc.write_next_instruction(snapshot.cpu["pc"])
+        self._state = CPUStates(snapshot.cpu["state"])
+        for latch in self.LATCHES:
+            setattr(self, latch, snapshot.cpu[latch])
+
+    def _record_trace(self):
+        # record the instruction about to be written back
+        flags = self._flags
+        if flags & JAL_FLAG:
+            rd_addr, write_value, kind = RETURN_ADDRESS_REGITSTER, self._pc.next_instruction + 1, TRACE_REG_WRITE
+        else:
+            rd_addr = self._rd_addr
+            write_value = self._bus_out if flags & MEM_READ_FLAG else self._alu_out
+            kind = trace_kind(flags, rd_addr)
+        mem_value = self._bus_out if flags & MEM_READ_FLAG else self._rs2
+        self._trace.record(self._pc.next_instruction, self._instr, rd_addr, write_value, self._alu_out, mem_value, kind)
+
+    def _profile(self):
+        flags = self._flags
+        if flags & MEM_READ_FLAG:
+            self._profiler.mem_read(self._alu_out)
+        elif flags & MEM_WRITE_FLAG:
+            self._profiler.mem_write(self._alu_out)
+        taken = self._alu_out > 0 if flags & BRANCH_FLAG else None
+        self._profiler.retire(self._pc.next_instruction, self._instr, CYCLES_PER_INSTRUCTION, taken)
+
     def cycle(self) -> int:
-        # print(self._pc.next_instruction)
         cur_state = self._state
-
-        if DEBUG_CPU:
-            print(f"\n[STATE = {self._state.name}] [PC = {self._pc.next_instruction}")
-            if self._instr != 0 and self._state != CPUStates.FETCH:
-                print(f" INSTR = 0x{self._instr:08X} ")
-
-            reg = self._reg_file.dump_regs()
-            t0, t1, t2 = reg[5], reg[6], reg[7]
-            print(f" r1 = {reg[1]},  r2 = {reg[2]}, r30 = {reg[30]}, r31 = {reg[31]}")
-
+        if self._profiler is not None:
+            self._profiler.stage(cur_state.value)
 
         match self._state:
             # fetch stage
             case CPUStates.FETCH:
-                # read raw instruction bits from memory
-                self._instr = self._bus.read_addr(self._pc.next_instruction) 
+                # read raw instruction bits from memory, a cached word also carries its decoded fields
+                addr = self._pc.next_instruction
+                self._decoded = self._decode_cache.lookup(addr)
+                if self._decoded is None:
+                    self._instr = self._bus.read_addr(addr)
+                else:
+                    self._instr = self._decoded[0]
                 self._state = CPUStates.DECODE
             # decode stage
             case CPUStates.DECODE:
                 # decodes instruction for control flags, and reads register file
-                self._flags, self._rd_addr, self._rs1_addr, self._rs2_addr, self._imm =  decode_instruction(self._instr)
+                if self._decoded is None:
+                    decoded = decode_instruction_table(self._instr)
+                    if self._bus.is_ram_addr(self._pc.next_instruction):
+                        self._decode_cache.insert(self._pc.next_instruction, self._instr, decoded)
+                    self._flags, self._rd_addr, self._rs1_addr, self._rs2_addr, self._imm = decoded
+                else:
+                    _, self._flags, self._rd_addr, self._rs1_addr, self._rs2_addr, self._imm = self._decoded
                 if self._flags == 0:
-                    print(">Reached End of Program")
                     return CPUStates.STOPPED.value
 
                 self._rs1, self._rs2 = self._reg_file.read_registers(self._rs1_addr, self._rs2_addr)
@@ -333,9 +1262,12 @@ class CPUClocked:
             # write back stage
             case CPUStates.WB:
                 # write back to registers if applicable and update pc
+                if self._trace is not None:
+                    self._record_trace()
+                if self._profiler is not None:
+                    self._profile()
                 if (self._rd_addr == PC_REGISTER) & ((self._flags & Flags.REG_WRITE_FLAG.value) > 0):
                     write_value = self._bus_out if self._flags & Flags.MEM_READ_FLAG.value > 0 else self._alu_out
-                    print(f'write to reg {self._rd_addr}: {write_value}')
                     self._pc.write_next_instruction(write_value)
                 elif ((self._flags & Flags.JAL_FLAG.value) > 0):
                     self._reg_file.write_register(RETURN_ADDRESS_REGITSTER, self._pc.next_instruction + 1)
@@ -343,8 +1275,73 @@ class CPUClocked:
                 else:
                     self._reg_file.update_register(self._rd_addr, self._alu_out, self._bus_out, self._flags)
                     self._pc.set_next_instruction(self._alu_out, self._imm, self._flags)
-                print('next instruction', self._pc.next_instruction)
                 self._state = CPUStates.FETCH
             case _:
                 return CPUStates.STOPPED.value
         return cur_state.value
+
+    def run(self, max_instructions: int | None = None, max_cycles: int | None = None) -> RunResult:
+        """Runs until the end of the program or until a budget runs out.
+
+        Whole instructions run in a tight loop that accounts the same cycles as stepping the state machine,
+        cycle() is only used to finish a partly executed instruction or to spend a cycle budget that ends
+        part way through one.
+        """
+        if self._trace is not None or self._profiler is not None:
+            result, _, _ = step_cycles(self, 0, 0, max_instructions, max_cycles)
+            return result
+
+        # finish an instruction left part way through by earlier cycle() calls
+        result, instructions, cycles = step_cycles(self, 0, 0, max_instructions, max_cycles, to_boundary=True)
+        if result is not None:
+            return result
+
+        regs = self._reg_file.registers
+        cached = self._decode_cache.lookup
+        bus = self._bus
+        cache = self._decode_cache
+        bus_read = bus.read_addr
+        bus_write = bus.write_addr
+        pc = self._pc.next_instruction
+        try:
+            while True:
+                reason = limit_reached(instructions, cycles, max_instructions, max_cycles)
+                if reason is not None:
+                    return RunResult(reason, instructions, cycles)
+                if max_cycles is not None and max_cycles - cycles < CYCLES_PER_INSTRUCTION:
+                    # the budget ends inside the next instruction
+                    break
+                entry = cached(pc) or fetch_decode(bus, cache, pc)
+                _, flags, rd_addr, rs1_addr, rs2_addr, imm = entry
+                if flags == 0:
+                    # leave the state machine where cycle() stops: decoded the NO_OP
+                    self._decoded = entry
+                    self._instr, self._flags, self._rd_addr, self._rs1_addr, self._rs2_addr, self._imm = entry
+                    self._state = CPUStates.DECODE
+                    return RunResult(HaltReason.HALTED, instructions, cycles + CYCLES_TO_HALT)
+                rs2 = regs[rs2_addr]
+                alu_out = alu(flags, regs[rs1_addr], rs2, imm)
+                bus_out = 0
+                if flags & MEM_READ_FLAG:
+                    bus_out = bus_read(alu_out)
+                elif flags & MEM_WRITE_FLAG:
+                    bus_write(alu_out, rs2, flags)
+                if rd_addr == PC_REGISTER and flags & REG_WRITE_FLAG:
+                    pc = bus_out if flags & MEM_READ_FLAG else alu_out
+                else:
+                    if flags & JAL_FLAG:
+                        regs[RETURN_ADDRESS_REGITSTER] = pc + 1
+                    elif flags & REG_WRITE_FLAG and rd_addr != 0:
+                        regs[rd_addr] = bus_out if flags & MEM_READ_FLAG else alu_out
+                    if flags & BRANCH_FLAG and alu_out > 0:
+                        pc += imm
+                    else:
+                        pc += 1
+                instructions += 1
+                cycles += CYCLES_PER_INSTRUCTION
+        finally:
+            self._pc.write_next_instruction(pc)
+
+        # spend the rest of the cycle budget one stage at a time
+        result, _, _ = step_cycles(self, instructions, cycles, max_instructions, max_cycles)
+        return result
@@ -0,0 +1,52 @@
+# guest programs and a machine builder shared by the tests
+from cpu import Bus, Memory, RAM
+from instructions import Instructions, r_type, i_type, b_type, lw, sw, jal
+
+
+def fib_program(count: int) -> list[int]:
+    # Fibsq.asm: t1 ends as fib(count + 1)
+    return [
+        r_type(Instructions.ADD, 5, 0, 0), # t0 = 0
+        i_type(Instructions.ADDI, 6, 0, 1), # t1 = 1
+        i_type(Instructions.ADDI, 7, 0, count), # t2 = count
+        r_type(Instructions.ADD, 28, 5, 6), # t3 = t0 + t1
+        r_type(Instructions.ADD, 5, 6, 0), # t0 = t1
+        r_type(Instructions.ADD, 6, 28, 0), # t1 = t3
+        i_type(Instructions.ADDI, 7, 7, -1), # t2 -= 1
+        b_type(Instructions.BNE, 7, 0, -4), # loop while t2 != 0
+        0,
+    ]
+
+
+def fact_program(n: int) -> list[int]:
+    # fact.asm: r2 ends as n!
+    return [
+        i_type(Instructions.ADDI, 1, 0, n),
+        jal(4),
+        lw(1, 30, 1),
+        lw(31, 30, 0),
+        b_type(Instructions.BEQ, 0, 0, 13),
+        i_type(Instructions.ADDI, 2, 0, 1),
+        b_type(Instructions.BEQ, 1, 2, 10),
+        sw(30, 31, 0),
+        sw(30, 1, 1),
+        i_type(Instructions.ADDI, 30, 30, 2),
+        i_type(Instructions.ADDI, 1, 1, -1),
+        jal(-6),
+        i_type(Instructions.ADDI, 30, 30, -2),
+        lw(1, 30, 1),
+        lw(31, 30, 0),
+        r_type(Instructions.MUL, 2, 1, 2),
+        r_type(Instructions.ADD, 29, 0, 31),
+        0,
+    ]
+
+
+def build(cpu_class, program: list[int], ram_size: int = 100, ram: RAM | None = None, mmio: Memory | None = None, **kwargs):
+    # program is written from address 0 of ram (a new RAM(ram_size) unless given), mmio is mapped right after ram
+    if ram is None:
+        ram = RAM(ram_size)
+    for i, instr in enumerate(program):
+        ram.write_addr(i, instr)
+    bus = Bus(ram, ram.size if mmio is not None else None, mmio)
+    return cpu_class(num_registers=32, bus=bus, **kwargs)
@@ -0,0 +1,101 @@
+import math
+import sys
+from typing import Callable
+
+from cpu import Memory, RAM, STDOut
+
+# register convention, r1 is the argument and the return value, r2 and r3 are extra arguments
+ARG_REGISTER = 1
+ARG2_REGISTER = 2
+ARG3_REGISTER = 3
+
+# standard host calls
+HOSTCALL_MEMCPY = 1
+HOSTCALL_MEMSET = 2
+HOSTCALL_PRINT_INT = 3
+HOSTCALL_FACTORIAL = 4
+
+
+class HostCallPort(Memory):
+    """Class imitating a mmio "syscall" port that runs registered python functions for the guest.
+
+    Writing a call number to address 0 calls its handler with the port and the values of r1, r2 and r3.
+    If the handler returns a value it is written back to r1. Reading address 0 returns the number of
+    host calls made so far. The port reads and writes registers through the cpu given to attach().
+    """
+    def __init__(self, ram: RAM, out: STDOut | None = None, standard: bool = True):
+        self._ram: RAM = ram
+        self._out: STDOut | None = out
+        self._cpu = None
+        self._handlers: dict[int, Callable[["HostCallPort", int, int, int], int | None]] = {}
+        self._calls: int = 0
+        if standard:
+            self.register(HOSTCALL_MEMCPY, host_memcpy)
+            self.register(HOSTCALL_MEMSET, host_memset)
+            self.register(HOSTCALL_PRINT_INT, host_print_int)
+            self.register(HOSTCALL_FACTORIAL, host_factorial)
+
+    @property
+    def ram(self) -> RAM:
+        return self._ram
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    def attach(self, cpu) -> None:
+        # any cpu with read_register and set_register
+        self._cpu = cpu
+
+    def register(self, number: int, handler: Callable[["HostCallPort", int, int, int], int | None]) -> None:
+        self._handlers[number] = handler
+
+    def read_addr(self, addr: int) -> int:
+        return self._calls if addr == 0 else 0
+
+    def write_addr(self, addr: int, value: int) -> None:
+        if addr != 0:
+            return
+        handler = self._handlers.get(value)
+        if handler is None:
+            raise ValueError(f"unknown host call {value}")
+        if self._cpu is None:
+            raise ValueError("host call port is not attached to a cpu")
+        cpu = self._cpu
+        result = handler(self, cpu.read_register(ARG_REGISTER), cpu.read_register(ARG2_REGISTER), cpu.read_register(ARG3_REGISTER))
+        if result is not None:
+            cpu.set_register(ARG_REGISTER, result)
+        self._calls += 1
+
+    def snapshot_state(self) -> int:
+        return self._calls
+
+    def restore_state(self, state: int) -> None:
+        self._calls = state
+
+    def write_output(self, data: bytes) -> None:
+        # output goes to the STDOut device when there is one so it shares its buffering and capture
+        if self._out is None:
+            sys.stdout.write(data.decode(errors="replace"))
+            return
+        for byte in data:
+            self._out.write_addr(0, byte)
+
+
+def host_memcpy(port: HostCallPort, dst: int, src: int, count: int) -> None:
+    # r1 = dst, r2 = src, r3 = number of words
+    port.ram.copy_words(src, dst, count)
+
+
+def host_memset(port: HostCallPort, dst: int, value: int, count: int) -> None:
+    # r1 = dst, r2 = value, r3 = number of words
+    port.ram.write_words(dst, [value] * count)
+
+
+def host_print_int(port: HostCallPort, value: int, _: int, __: int) -> None:
+    port.write_output(str(value).encode())
+
+
+def host_factorial(port: HostCallPort, n: int, _: int, __: int) -> int:
+    # r1 = n!
+    return math.factorial(n)
@@ -0,0 +1,160 @@
+import struct
+import sys
+from array import array
+
+# first word of a sectioned image, its opcode bits are not a valid instruction so a flat image
+#   (which starts with the instruction at address 0) can never be mistaken for one
+IMAGE_MAGIC = b"\x7fCPU"
+IMAGE_VERSION = 1
+
+# magic, version, number of sections, entry point (NO_ENTRY for none), number of symbols
+IMAGE_HEADER = struct.Struct(">4sHHiI")
+# name, base address, length in words
+SECTION_NAME_BYTES = 8
+SECTION_HEADER = struct.Struct(f">{SECTION_NAME_BYTES}sII")
+# address, length of the utf-8 name that follows
+SYMBOL_HEADER = struct.Struct(">IH")
+NO_ENTRY = -1
+
+WORD_TYPECODE = "i"
+WORD_BYTES = 4
+WORD_MASK = 0xFFFFFFFF
+WORD_SIGN_BIT = 0x80000000
+
+
+def to_words(values) -> array:
+    # signed 32 bit words, values are wrapped like ram does on write
+    if isinstance(values, array) and values.typecode == WORD_TYPECODE:
+        return values
+    return array(WORD_TYPECODE, [((value + WORD_SIGN_BIT) & WORD_MASK) - WORD_SIGN_BIT for value in values])
+
+
+def words_to_bytes(words: array) -> bytes:
+    # big endian, like every word stored in a file
+    if sys.byteorder == "little":
+        words = array(WORD_TYPECODE, words)
+        words.byteswap()
+    return words.tobytes()
+
+
+def words_from_bytes(data: bytes) -> array:
+    words = array(WORD_TYPECODE)
+    words.frombytes(data)
+    if sys.byteorder == "little":
+        words.byteswap()
+    return words
+
+
+class Section:
+    """Class representing a run of words placed at a base address when the image is loaded"""
+    def __init__(self, name: str, base: int, words):
+        if len(name.encode()) > SECTION_NAME_BYTES:
+            raise ValueError(f"section name {name!r} is longer than {SECTION_NAME_BYTES} bytes")
+        self.name: str = name
+        self.base: int = base
+        self.words: array = to_words(words)
+
+    @property
+    def end(self) -> int:
+        return self.base + len(self.words)
+
+    def __repr__(self) -> str:
+        return f"Section({self.name!r}, base={self.base}, length={len(self.words)})"
+
+
+class Image:
+    """Class representing a program image split into sections.
+
+    The file holds a header, the section table, the symbol table and then the words of each section,
+    all big endian. Sections are stored without padding and loaded at their base address, entry is
+    the address execution starts at (None to start at 0) and symbols maps label names to addresses.
+    """
+    def __init__(self, sections: list[Section], entry: int | None = None, symbols: dict[str, int] | None = None):
+        self.sections: list[Section] = sections
+        self.entry: int | None = entry
+        self.symbols: dict[str, int] = symbols or {}
+
+    def section(self, name: str) -> Section:
+        for section in self.sections:
+            if section.name == name:
+                return section
+        raise ValueError(f"image has no {name} section")
+
+    @property
+    def end(self) -> int:
+        # first address past every section
+        return max((section.end for section in self.sections), default=0)
+
+    def to_bytes(self) -> bytes:
+        entry = NO_ENTRY if self.entry is None else self.entry
+        parts = [IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, len(self.sections), entry, len(self.symbols))]
+        for section in self.sections:
+            parts.append(SECTION_HEADER.pack(section.name.encode(), section.base, len(section.words)))
+        for name, address in self.symbols.items():
+            encoded = name.encode()
+            parts.append(SYMBOL_HEADER.pack(address, len(encoded)))
+            parts.append(encoded)
+        parts.extend(words_to_bytes(section.words) for section in self.sections)
+        return b"".join(parts)
+
+    def to_flat_bytes(self) -> bytes:
+        # every section at its base address in one run of words starting at 0, gaps are zero
+        words = array(WORD_TYPECODE, bytes(self.end * WORD_BYTES))
+        for section in self.sections:
+            words[section.base:section.end] = section.words
+        return words_to_bytes(words)
+
+    def save(self, file_path: str, flat: bool = False):
+        with open(file_path, "wb") as f:
+            f.write(self.to_flat_bytes() if flat else self.to_bytes())
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "Image":
+        if len(data) < IMAGE_HEADER.size:
+            raise ValueError("image is shorter than its header")
+        magic, version, num_sections, entry, num_symbols = IMAGE_HEADER.unpack_from(data)
+        if magic != IMAGE_MAGIC:
+            raise ValueError("not a sectioned image")
+        if version != IMAGE_VERSION:
+            raise ValueError(f"unsupported image version {version}")
+        offset = IMAGE_HEADER.size
+        # a truncated file (e.g. a cache entry cut short) must fail with ValueError, never struct.error
+        if offset + num_sections * SECTION_HEADER.size > len(data):
+            raise ValueError("section table runs past the end of the image")
+
+        headers = []
+        for _ in range(num_sections):
+            name, base, length = SECTION_HEADER.unpack_from(data, offset)
+            headers.append((name.rstrip(b"\0").decode(), base, length))
+            offset += SECTION_HEADER.size
+
+        symbols = {}
+        for _ in range(num_symbols):
+            if offset + SYMBOL_HEADER.size > len(data):
+                raise ValueError("symbol table runs past the end of the image")
+            address, name_length = SYMBOL_HEADER.unpack_from(data, offset)
+            offset += SYMBOL_HEADER.size
+            if offset + name_length > len(data):
+                raise ValueError("symbol table runs past the end of the image")
+            symbols[data[offset:offset + name_length].decode()] = address
+            offset += name_length
+
+        sections = []
+        for name, base, length in headers:
+            end = offset + length * WORD_BYTES
+            if end > len(data):
+                raise ValueError(f"section {name} runs past the end of the image")
+            sections.append(Section(name, base, words_from_bytes(data[offset:end])))
+            offset = end
+        return Image(sections, None if entry == NO_ENTRY else entry, symbols)
+
+    @staticmethod
+    def load(file_path: str) -> "Image":
+        with open(file_path, "rb") as f:
+            return Image.from_bytes(f.read())
+
+
+def is_image(file_path: str) -> bool:
+    """Whether the file is a sectioned image rather than a flat one"""
+    with open(file_path, "rb") as f:
+        return f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
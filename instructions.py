@@ -1,4 +1,5 @@
 from enum import Enum, unique
+from typing import Callable
 
 @unique
 class Instructions(Enum):
@@ -115,7 +116,10 @@ JAL_IMM_MASK = 0b_0111_1111_1111_1111_1111_1111_1
 
 
 def decode_instruction(instruction: int) -> tuple[int, int, int, int, int]:
-    """Decodes raw instruction bits into the flags, registers and intermediates needed to execute the instruction"""
+    """Decodes raw instruction bits into the flags, registers and intermediates needed to execute the instruction
+
+    Reference implementation, the CPUs decode through decode_instruction_table.
+    """
 
     # decode opcode, and register addresses
     opcode = (instruction >> OPCODE_OFFSET) & OPCODE_MASK
@@ -195,7 +199,6 @@ def decode_instruction(instruction: int) -> tuple[int, int, int, int, int]:
             flags = 0
 
     no_rd_instructions = [Instructions.SW, Instructions.BEQ, Instructions.BNE, Instructions.BGE, Instructions.BLT]
-    print(Instructions(opcode))
     if Instructions(opcode) in no_rd_instructions:
             # if an instruction has no destination register, then rs1 is where rd should be, and rs2 is where rs1 should be 
             # rs2 is where rs1 is normally
@@ -204,35 +207,144 @@ def decode_instruction(instruction: int) -> tuple[int, int, int, int, int]:
             rs1_addr = rd_addr
     return flags, rd_addr, rs1_addr, rs2_addr, imm
 
+# operand rules for the decode table
+OPERANDS_RD_RS1_RS2 = 0 # fields are used as encoded
+OPERANDS_SWAPPED = 1 # no rd: rs1 is encoded where rd is, rs2 where rs1 is (SW and branches)
+OPERANDS_NONE = 2 # no register operands (JAL)
+OPERANDS_RD_RS1_IMM = 3 # decoded like OPERANDS_RD_RS1_RS2, but the rs2 field holds immediate bits and is not read
+
+
+def imm_i_type(instruction: int) -> int:
+    # 11 bit signed immediate used by alu, memory and branch instructions
+    imm = (instruction >> IMM_OFFSET) & IMM_MASK
+    return imm - (IMM_SIGN_BIT_MASK & (instruction >> IMM_OFFSET))
+
+
+def imm_jal(instruction: int) -> int:
+    # 24 bit signed immediate used by JAL
+    imm = (instruction >> JAL_IMM_OFFSET) & JAL_IMM_MASK
+    return imm - (JAL_IMM_SIGN_BIT_MASK & (instruction >> (JAL_IMM_OFFSET - 1)))
+
+
+def _build_decode_table() -> list[tuple[int, int, Callable[[int], int]] | None]:
+    # one entry per possible opcode: (flags, operand rule, immediate extractor), None if the opcode is invalid
+    table: list[tuple[int, int, Callable[[int], int]] | None] = [None] * (OPCODE_MASK + 1)
+    entries = {
+        Instructions.NO_OP: (0, OPERANDS_RD_RS1_RS2, imm_i_type),
+
+        Instructions.ADD: (ALUOP_ADD_FLAG | REG_WRITE_FLAG, OPERANDS_RD_RS1_RS2, imm_i_type),
+        Instructions.SUB: (ALUOP_SUB_FLAG | REG_WRITE_FLAG, OPERANDS_RD_RS1_RS2, imm_i_type),
+        Instructions.MUL: (ALUOP_MUL_FLAG | REG_WRITE_FLAG, OPERANDS_RD_RS1_RS2, imm_i_type),
+        Instructions.SHL: (ALUOP_SHL_FLAG | REG_WRITE_FLAG, OPERANDS_RD_RS1_RS2, imm_i_type),
+        Instructions.SHR: (ALUOP_SHR_FLAG | REG_WRITE_FLAG, OPERANDS_RD_RS1_RS2, imm_i_type),
+        Instructions.SLT: (ALUOP_SLT_FLAG | REG_WRITE_FLAG, OPERANDS_RD_RS1_RS2, imm_i_type),
+
+        Instructions.ADDI: (ALUOP_ADD_FLAG | REG_WRITE_FLAG | USE_IMM_FLAG, OPERANDS_RD_RS1_IMM, imm_i_type),
+        Instructions.SUBI: (ALUOP_SUB_FLAG | REG_WRITE_FLAG | USE_IMM_FLAG, OPERANDS_RD_RS1_IMM, imm_i_type),
+        Instructions.MULI: (ALUOP_MUL_FLAG | REG_WRITE_FLAG | USE_IMM_FLAG, OPERANDS_RD_RS1_IMM, imm_i_type),
+        Instructions.SHLI: (ALUOP_SHL_FLAG | REG_WRITE_FLAG | USE_IMM_FLAG, OPERANDS_RD_RS1_IMM, imm_i_type),
+        Instructions.SHRI: (ALUOP_SHR_FLAG | REG_WRITE_FLAG | USE_IMM_FLAG, OPERANDS_RD_RS1_IMM, imm_i_type),
+        Instructions.SLTI: (ALUOP_SLT_FLAG | REG_WRITE_FLAG | USE_IMM_FLAG, OPERANDS_RD_RS1_IMM, imm_i_type),
+
+        Instructions.LW: (REG_WRITE_FLAG | ALUOP_ADD_FLAG | USE_IMM_FLAG | MEM_READ_FLAG, OPERANDS_RD_RS1_IMM, imm_i_type),
+        Instructions.SW: (MEM_WRITE_FLAG | ALUOP_ADD_FLAG | USE_IMM_FLAG, OPERANDS_SWAPPED, imm_i_type),
+
+        Instructions.BEQ: (BRANCH_FLAG | ALUOP_SEQ_FLAG, OPERANDS_SWAPPED, imm_i_type),
+        Instructions.BNE: (BRANCH_FLAG | ALUOP_SNE_FLAG, OPERANDS_SWAPPED, imm_i_type),
+        Instructions.BGE: (BRANCH_FLAG | ALUOP_SGE_FLAG, OPERANDS_SWAPPED, imm_i_type),
+        Instructions.BLT: (BRANCH_FLAG | ALUOP_SLT_FLAG, OPERANDS_SWAPPED, imm_i_type),
+
+        Instructions.JAL: (BRANCH_FLAG | ALUOP_SEQ_FLAG | JAL_FLAG, OPERANDS_NONE, imm_jal),
+    }
+    for instr, entry in entries.items():
+        table[instr.value] = entry
+    return table
+
+
+DECODE_TABLE = _build_decode_table()
+
+
+def decode_instruction_table(instruction: int) -> tuple[int, int, int, int, int]:
+    """Table driven equivalent of decode_instruction, a single lookup replaces the opcode match"""
+    entry = DECODE_TABLE[instruction & OPCODE_MASK]
+    if entry is None:
+        raise ValueError(f"{instruction & OPCODE_MASK} is not a valid Instructions")
+    flags, operands, imm_extractor = entry
+
+    rd_addr = (instruction >> RD_OFFSET) & REGISTER_MASK
+    if operands == OPERANDS_RD_RS1_RS2 or operands == OPERANDS_RD_RS1_IMM:
+        rs1_addr = (instruction >> RS1_OFFSET) & REGISTER_MASK
+        rs2_addr = (instruction >> RS2_OFFSET) & REGISTER_MASK
+    elif operands == OPERANDS_SWAPPED:
+        rs1_addr = rd_addr
+        rs2_addr = (instruction >> RS1_OFFSET) & REGISTER_MASK
+    else:
+        rs1_addr = 0
+        rs2_addr = 0
+    return flags, rd_addr, rs1_addr, rs2_addr, imm_extractor(instruction)
+
+
+def reads_rs2(instruction: int) -> bool:
+    # whether rs2 is a register the instruction reads, I-type immediates overlap the rs2 field
+    entry = DECODE_TABLE[instruction & OPCODE_MASK]
+    return entry is not None and (entry[1] == OPERANDS_RD_RS1_RS2 or entry[1] == OPERANDS_SWAPPED)
+
+
+# immediates are stored as two's complement in their field
+IMM_FIELD_MASK = IMM_MASK | IMM_SIGN_BIT_MASK
+JAL_IMM_FIELD_MASK = JAL_IMM_MASK | JAL_IMM_SIGN_BIT_MASK
+IMM_MIN, IMM_MAX = -IMM_SIGN_BIT_MASK, IMM_SIGN_BIT_MASK - 1
+JAL_IMM_MIN, JAL_IMM_MAX = -(JAL_IMM_SIGN_BIT_MASK >> 1), (JAL_IMM_SIGN_BIT_MASK >> 1) - 1
+
+
+def _check_register(reg: int) -> int:
+    if not 0 <= reg <= REGISTER_MASK:
+        raise ValueError(f"register {reg} is out of range")
+    return reg
+
+
+def _check_imm(imm: int, low: int, high: int) -> int:
+    if not low <= imm <= high:
+        raise ValueError(f"immediate {imm} does not fit in [{low}, {high}]")
+    return imm
+
+
+# integer encoders shared by the builders below and the assembler
+# a, b and c are the fields at RD_OFFSET, RS1_OFFSET and RS2_OFFSET (IMM_OFFSET), the meaning of each depends on the opcode
+def encode_r(opcode: int, a: int, b: int, c: int) -> int:
+    return (opcode
+            | _check_register(a) << RD_OFFSET
+            | _check_register(b) << RS1_OFFSET
+            | _check_register(c) << RS2_OFFSET)
+
+
+def encode_i(opcode: int, a: int, b: int, imm: int) -> int:
+    return (opcode
+            | _check_register(a) << RD_OFFSET
+            | _check_register(b) << RS1_OFFSET
+            | (_check_imm(imm, IMM_MIN, IMM_MAX) & IMM_FIELD_MASK) << IMM_OFFSET)
+
+
+def encode_jal(opcode: int, imm: int) -> int:
+    return opcode | (_check_imm(imm, JAL_IMM_MIN, JAL_IMM_MAX) & JAL_IMM_FIELD_MASK) << JAL_IMM_OFFSET
+
+
 # functions for construction instructions as 32bit integers
 def r_type(instr_: Instructions, rd:int, rs1: int, rs2: int) -> int:
-    opcode: int = instr_.value
-    instr = int(f"{rs2:06b}{rs1:06b}{rd:06b}{opcode:07b}".replace('_', ''), 2)
-    return instr
+    return encode_r(instr_.value, rd, rs1, rs2)
 
 
 def i_type(instr_: Instructions, rd:int, rs1: int, imm:int) -> int: # increment r1
-    opcode: int = instr_.value
-    instr = int(f"{imm & 0x7FF:11b}{rs1:06b}{rd:06b}{opcode:07b}".replace('_', ''), 2)
-    return instr
+    return encode_i(instr_.value, rd, rs1, imm)
 
 def b_type(instr_: Instructions, rs1: int, rs2: int, imm: int) -> int:
-    opcode = instr_.value
-    instr = int(f"{imm & 0x7FF:11b}{rs2:06b}{rs1:06b}{opcode:07b}".replace('_', ''), 2)
-    return instr
+    return encode_i(instr_.value, rs1, rs2, imm)
 
 def sw(rs1: int, rs2: int, imm: int) -> int:
-    opcode = Instructions.SW.value
-    instr = int(f"{imm & 0x7FF:11b}{rs2:06b}{rs1:06b}{opcode:07b}".replace('_', ''), 2)
-    return instr
+    return encode_i(Instructions.SW.value, rs1, rs2, imm)
 
 def lw(rd: int, rs1: int, imm: int) -> int:
-    opcode = Instructions.LW.value
-    instr = int(f"{imm & 0x7FF:11b}{rs1:06b}{rd:06b}{opcode:07b}".replace('_', ''), 2)
-    return instr
+    return encode_i(Instructions.LW.value, rd, rs1, imm)
 
 def jal(imm: int) -> int:
-    opcode = Instructions.JAL.value
-    instr = int(f"{imm & 0xFFFFFF:24b}{opcode:07b}".replace('_', ''), 2)
-    return instr
-
+    return encode_jal(Instructions.JAL.value, imm)
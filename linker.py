@@ -0,0 +1,268 @@
+import struct
+import sys
+
+from image import Image, Section, to_words, words_to_bytes, words_from_bytes, WORD_BYTES, WORD_MASK, WORD_SIGN_BIT
+from instructions import (encode_i, encode_jal, imm_i_type, IMM_FIELD_MASK, IMM_OFFSET, JAL_IMM_FIELD_MASK,
+                          JAL_IMM_OFFSET)
+
+OBJECT_MAGIC = b"\x7fOBJ"
+OBJECT_VERSION = 1
+
+# magic, version, .text length, .data length, number of symbols, number of relocations
+OBJECT_HEADER = struct.Struct(">4sHIIII")
+# section, exported, offset, length of the utf-8 name that follows
+OBJECT_SYMBOL = struct.Struct(">BBIH")
+# kind, offset in .text, length of the utf-8 symbol name that follows (0 for the module's own .data)
+OBJECT_RELOCATION = struct.Struct(">BIH")
+# length of a utf-8 string that follows, used for the module name and entry label
+OBJECT_STRING = struct.Struct(">H")
+
+SECTION_NAMES = (".text", ".data")
+
+# pc relative immediate of a branch to an imported symbol
+RELOC_BRANCH = 1
+# pc relative immediate of a JAL to an imported symbol
+RELOC_JAL = 2
+# absolute address in an I-type immediate, of an imported symbol or, without a symbol, of the
+#   module's own .data plus the offset already held in the immediate
+RELOC_DATA = 3
+
+IMM_FIELD = IMM_FIELD_MASK << IMM_OFFSET
+JAL_IMM_FIELD = JAL_IMM_FIELD_MASK << JAL_IMM_OFFSET
+
+
+class Relocation:
+    """Class representing a .text word the linker patches once final addresses are known"""
+    def __init__(self, kind: int, offset: int, symbol: str | None = None):
+        self.kind: int = kind
+        self.offset: int = offset
+        self.symbol: str | None = symbol
+
+    def __repr__(self) -> str:
+        return f"Relocation({self.kind}, {self.offset}, {self.symbol!r})"
+
+
+def _pack_string(value: str | None) -> bytes:
+    encoded = (value or "").encode()
+    return OBJECT_STRING.pack(len(encoded)) + encoded
+
+
+def _unpack_string(data: bytes, offset: int) -> tuple[str | None, int]:
+    _check_length(data, offset + OBJECT_STRING.size)
+    (length,) = OBJECT_STRING.unpack_from(data, offset)
+    offset += OBJECT_STRING.size
+    _check_length(data, offset + length)
+    return data[offset:offset + length].decode() or None, offset + length
+
+
+def _check_length(data: bytes, end: int):
+    # a truncated file (e.g. a cache entry cut short) must fail with ValueError, never struct.error
+    if end > len(data):
+        raise ValueError("object file is truncated")
+
+
+class ObjectFile:
+    """Class representing one separately assembled module before it is linked.
+
+    .text and .data both start at 0 within the module. symbols maps every label to its section and
+    offset, exports names the labels other modules may reference, and relocations list the words
+    that depend on where the linker places the module or on symbols imported from other modules.
+    entry is the label execution starts at, if the module sets one.
+    """
+    def __init__(self, text, data, symbols: dict[str, tuple[str, int]], exports: set[str],
+                 relocations: list[Relocation], entry: str | None = None, name: str | None = None):
+        self.text = to_words(text)
+        self.data = to_words(data)
+        self.symbols: dict[str, tuple[str, int]] = symbols
+        self.exports: set[str] = exports
+        self.relocations: list[Relocation] = relocations
+        self.entry: str | None = entry
+        self.name: str | None = name
+
+    @property
+    def imports(self) -> set[str]:
+        return {reloc.symbol for reloc in self.relocations if reloc.symbol is not None}
+
+    def to_bytes(self) -> bytes:
+        parts = [OBJECT_HEADER.pack(OBJECT_MAGIC, OBJECT_VERSION, len(self.text), len(self.data),
+                                    len(self.symbols), len(self.relocations)),
+                 _pack_string(self.name), _pack_string(self.entry)]
+        for label, (section, offset) in self.symbols.items():
+            encoded = label.encode()
+            parts.append(OBJECT_SYMBOL.pack(SECTION_NAMES.index(section), label in self.exports, offset, len(encoded)))
+            parts.append(encoded)
+        for reloc in self.relocations:
+            encoded = (reloc.symbol or "").encode()
+            parts.append(OBJECT_RELOCATION.pack(reloc.kind, reloc.offset, len(encoded)))
+            parts.append(encoded)
+        parts.append(words_to_bytes(self.text))
+        parts.append(words_to_bytes(self.data))
+        return b"".join(parts)
+
+    def save(self, file_path: str):
+        with open(file_path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "ObjectFile":
+        if len(data) < OBJECT_HEADER.size or data[:len(OBJECT_MAGIC)] != OBJECT_MAGIC:
+            raise ValueError("not an object file")
+        _, version, text_length, data_length, num_symbols, num_relocations = OBJECT_HEADER.unpack_from(data)
+        if version != OBJECT_VERSION:
+            raise ValueError(f"unsupported object version {version}")
+        offset = OBJECT_HEADER.size
+        name, offset = _unpack_string(data, offset)
+        entry, offset = _unpack_string(data, offset)
+
+        symbols: dict[str, tuple[str, int]] = {}
+        exports: set[str] = set()
+        for _ in range(num_symbols):
+            _check_length(data, offset + OBJECT_SYMBOL.size)
+            section, exported, symbol_offset, length = OBJECT_SYMBOL.unpack_from(data, offset)
+            offset += OBJECT_SYMBOL.size
+            _check_length(data, offset + length)
+            if section >= len(SECTION_NAMES):
+                raise ValueError(f"unknown section {section} in object file")
+            label = data[offset:offset + length].decode()
+            offset += length
+            symbols[label] = (SECTION_NAMES[section], symbol_offset)
+            if exported:
+                exports.add(label)
+
+        relocations = []
+        for _ in range(num_relocations):
+            _check_length(data, offset + OBJECT_RELOCATION.size)
+            kind, reloc_offset, length = OBJECT_RELOCATION.unpack_from(data, offset)
+            offset += OBJECT_RELOCATION.size
+            _check_length(data, offset + length)
+            relocations.append(Relocation(kind, reloc_offset, data[offset:offset + length].decode() or None))
+            offset += length
+
+        text_end = offset + text_length * WORD_BYTES
+        data_end = text_end + data_length * WORD_BYTES
+        _check_length(data, data_end)
+        return ObjectFile(words_from_bytes(data[offset:text_end]), words_from_bytes(data[text_end:data_end]),
+                          symbols, exports, relocations, entry, name)
+
+    @staticmethod
+    def load(file_path: str) -> "ObjectFile":
+        with open(file_path, "rb") as f:
+            return ObjectFile.from_bytes(f.read())
+
+
+def _patch(word: int, field: int, value: int) -> int:
+    # replaces one immediate field of a word, value is already encoded in place
+    word = (word & WORD_MASK & ~field) | value
+    return ((word + WORD_SIGN_BIT) & WORD_MASK) - WORD_SIGN_BIT
+
+
+def link(objects: list[ObjectFile], data_base: int | None = None, entry: str | None = None) -> Image:
+    """Merges modules into one image and applies their relocations.
+
+    The .text of each module follows the one before it starting at 0, .data is laid out the same way
+    right after all of .text unless data_base is given. Exported symbols keep their names in the image
+    symbol table, the other labels of a named module are prefixed with "<name>.". entry names an
+    exported symbol to start at, by default it is the entry label of the one module that sets one.
+    """
+    text_bases = []
+    text_end = 0
+    for obj in objects:
+        text_bases.append(text_end)
+        text_end += len(obj.text)
+    if data_base is None:
+        data_base = text_end
+    elif text_end > data_base:
+        raise ValueError(f".text has {text_end} words, at most {data_base} fit before .data")
+    data_bases = []
+    data_end = data_base
+    for obj in objects:
+        data_bases.append(data_end)
+        data_end += len(obj.data)
+
+    def address(index: int, label: str) -> int:
+        section, offset = objects[index].symbols[label]
+        return (text_bases[index] if section == ".text" else data_bases[index]) + offset
+
+    exported: dict[str, int] = {}
+    symbols: dict[str, int] = {}
+    for index, obj in enumerate(objects):
+        for label in obj.symbols:
+            if label in obj.exports:
+                if label in exported:
+                    raise ValueError(f"symbol {label} is exported by more than one module")
+                exported[label] = address(index, label)
+            else:
+                symbols[label if obj.name is None else f"{obj.name}.{label}"] = address(index, label)
+    symbols.update(exported)
+
+    text = []
+    for index, obj in enumerate(objects):
+        words = list(obj.text)
+        for reloc in obj.relocations:
+            pc = text_bases[index] + reloc.offset
+            word = words[reloc.offset]
+            if reloc.symbol is None:
+                target = data_bases[index] + imm_i_type(word & WORD_MASK)
+            elif reloc.symbol in exported:
+                target = exported[reloc.symbol]
+            else:
+                raise ValueError(f"undefined symbol {reloc.symbol} in module {obj.name or index}")
+            if reloc.kind == RELOC_JAL:
+                words[reloc.offset] = _patch(word, JAL_IMM_FIELD, encode_jal(0, target - pc))
+            elif reloc.kind == RELOC_BRANCH:
+                words[reloc.offset] = _patch(word, IMM_FIELD, encode_i(0, 0, 0, target - pc))
+            else:
+                words[reloc.offset] = _patch(word, IMM_FIELD, encode_i(0, 0, 0, target))
+        text.extend(words)
+
+    entry_address = None
+    if entry is not None:
+        if entry not in exported:
+            raise ValueError(f"entry symbol {entry} is not exported by any module")
+        entry_address = exported[entry]
+    else:
+        entries = [(index, obj.entry) for index, obj in enumerate(objects) if obj.entry is not None]
+        if len(entries) > 1:
+            raise ValueError("more than one module sets an entry point")
+        if entries:
+            entry_address = address(*entries[0])
+
+    data = []
+    for obj in objects:
+        data.extend(obj.data)
+    return Image([Section(".text", 0, text), Section(".data", data_base, data)], entry_address, symbols)
+
+
+# =====================================================================================
+# USAGE: python linker.py [--flat] [--no-cache] [--entry SYMBOL] <destination binary filename> <module> ...
+# modules are object files written by "python assembler.py --object" or .asm sources, which are
+#   assembled through the assembler cache so only sources that changed are parsed again
+# (--flat writes the headerless layout with .data at FLAT_DATA_BASE instead of a sectioned image)
+# =====================================================================================
+if __name__ == "__main__":
+    from assembler import assembler_assemble_object_file, FLAT_DATA_BASE
+
+    args = sys.argv[1:]
+    flat = "--flat" in args
+    if flat:
+        args.remove("--flat")
+    use_cache = "--no-cache" not in args
+    if not use_cache:
+        args.remove("--no-cache")
+    entry_symbol = None
+    if "--entry" in args:
+        index = args.index("--entry")
+        entry_symbol = args[index + 1].upper()
+        del args[index:index + 2]
+    dest_filename, *module_filenames = args
+
+    objects = []
+    for filename in module_filenames:
+        if filename.endswith(".asm"):
+            objects.append(assembler_assemble_object_file(filename, use_cache))
+        else:
+            objects.append(ObjectFile.load(filename))
+    image = link(objects, FLAT_DATA_BASE if flat else None, entry_symbol)
+    image.save(dest_filename, flat)
+    print(f"linked {len(objects)} modules: {len(image.section('.text').words)} .text words, "
+          f"{len(image.section('.data').words)} .data words")
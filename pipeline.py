@@ -0,0 +1,244 @@
+from cpu import (Bus, CPUStates, DecodeCache, ProgramCounter, RegisterFile, RunResult, alu, fetch_decode, step_cycles,
+                 PC_REGISTER, RETURN_ADDRESS_REGITSTER)
+from instructions import Flags, reads_rs2
+
+REG_WRITE_FLAG = Flags.REG_WRITE_FLAG.value
+MEM_READ_FLAG = Flags.MEM_READ_FLAG.value
+MEM_WRITE_FLAG = Flags.MEM_WRITE_FLAG.value
+BRANCH_FLAG = Flags.BRANCH_FLAG.value
+JAL_FLAG = Flags.JAL_FLAG.value
+
+
+class _Slot:
+    """Class holding one instruction as it moves through the pipeline latches"""
+    __slots__ = ("pc", "instr", "flags", "rd_addr", "rs1_addr", "rs2_addr", "reads_rs2", "imm", "rs1", "rs2", "alu_out", "dest", "value", "fault")
+
+    def __init__(self, pc: int):
+        self.pc: int = pc
+        self.instr: int = 0
+        self.flags: int = 0
+        self.rd_addr: int = 0
+        self.rs1_addr: int = 0
+        self.rs2_addr: int = 0
+        # false when the rs2 field holds immediate bits, so it can not cause a load-use stall
+        self.reads_rs2: bool = False
+        self.imm: int = 0
+        self.rs1: int = 0
+        self.rs2: int = 0
+        self.alu_out: int = 0
+        # register the instruction writes (0 for none) and the value it writes, known after EX (MEM for loads)
+        self.dest: int = 0
+        self.value: int = 0
+        # error raised while fetching or decoding, only raised if the instruction is not flushed
+        self.fault: Exception | None = None
+
+    @property
+    def halts(self) -> bool:
+        return self.fault is None and self.flags == 0
+
+
+def _destination(flags: int, rd_addr: int) -> int:
+    if flags & JAL_FLAG:
+        return RETURN_ADDRESS_REGITSTER
+    if flags & REG_WRITE_FLAG and rd_addr != PC_REGISTER:
+        return rd_addr
+    return 0
+
+
+class CPUPipelined:
+    """CPU class with a five stage pipeline, one instruction can retire every cycle.
+
+    The IF/ID, ID/EX, EX/MEM and MEM/WB latches advance every cycle. Results are forwarded from the
+    EX/MEM and MEM/WB latches to EX, an instruction using the result of a load right before it stalls
+    for one cycle. Fetch predicts not taken: taken branches and JAL are resolved in EX and flush the two
+    younger instructions, writes to the PC register flush from EX (alu results) or MEM (loads), as do
+    stores into an instruction already fetched and stores to devices, which may write registers. Registers are written in the first half of a cycle,
+    so ID reads see the value being written back. The program ends when its NO_OP reaches WB.
+    Follows the same instruction semantics as CPUClocked.
+    """
+    def __init__(self, num_registers: int, bus: Bus):
+        self._reg_file: RegisterFile = RegisterFile(num_registers)
+        self._pc: ProgramCounter = ProgramCounter(0)
+        self._bus: Bus = bus
+        self._decode_cache: DecodeCache = DecodeCache()
+        bus.attach_decode_cache(self._decode_cache)
+        self._if_id: _Slot | None = None
+        self._id_ex: _Slot | None = None
+        self._ex_mem: _Slot | None = None
+        self._mem_wb: _Slot | None = None
+        # set once a NO_OP has been fetched, fetching resumes if it is flushed
+        self._fetch_stopped: bool = False
+        self._halted: bool = False
+        self._cycles: int = 0
+        self._retired: int = 0
+        self._stalls: int = 0
+        self._flushes: int = 0
+
+    def dump_regs(self) -> list[int]:
+        return self._reg_file.dump_regs()
+
+    def set_register(self, register_number: int, value: int):
+        self._reg_file.write_register(register_number, value)
+
+    def read_register(self, register_number: int):
+        return self._reg_file.read_register(register_number)
+
+    @property
+    def next_instruction(self) -> int:
+        # address of the oldest instruction that has not retired
+        for slot in (self._mem_wb, self._ex_mem, self._id_ex, self._if_id):
+            if slot is not None:
+                return slot.pc
+        return self._pc.next_instruction
+
+    @next_instruction.setter
+    def next_instruction(self, addr: int):
+        # drops whatever is in flight and fetches from addr next
+        self._if_id = self._id_ex = self._ex_mem = self._mem_wb = None
+        self._fetch_stopped = False
+        self._pc.write_next_instruction(addr)
+
+    @property
+    def cycles(self) -> int:
+        return self._cycles
+
+    @property
+    def retired(self) -> int:
+        return self._retired
+
+    @property
+    def stalls(self) -> int:
+        # cycles lost to load-use hazards
+        return self._stalls
+
+    @property
+    def flushes(self) -> int:
+        # number of times younger instructions were thrown away
+        return self._flushes
+
+    @property
+    def cpi(self) -> float:
+        # cycles per retired instruction
+        return self._cycles / self._retired if self._retired else 0.0
+
+    def _forward(self, addr: int, value: int) -> int:
+        # newest result for register addr from the instructions ahead in EX/MEM and MEM/WB
+        if addr == 0:
+            return value
+        ex_mem = self._ex_mem
+        if ex_mem is not None and ex_mem.dest == addr:
+            return ex_mem.value
+        mem_wb = self._mem_wb
+        if mem_wb is not None and mem_wb.dest == addr:
+            return mem_wb.value
+        return value
+
+    def cycle(self) -> int:
+        if self._halted:
+            return CPUStates.STOPPED.value
+        self._cycles += 1
+        redirect: int | None = None
+        flush_ex = False
+
+        # write back stage
+        wb = self._mem_wb
+        if wb is not None:
+            if wb.halts:
+                self._halted = True
+                self._pc.write_next_instruction(wb.pc)
+                self._mem_wb = self._ex_mem = self._id_ex = self._if_id = None
+                return CPUStates.STOPPED.value
+            if wb.dest != 0:
+                self._reg_file.write_register(wb.dest, wb.value)
+            self._retired += 1
+
+        # memory stage
+        mem = self._ex_mem
+        if mem is not None and not mem.halts:
+            if mem.fault is not None:
+                raise mem.fault
+            if mem.flags & MEM_READ_FLAG:
+                loaded = self._bus.read_addr(mem.alu_out)
+                if mem.flags & REG_WRITE_FLAG and mem.rd_addr == PC_REGISTER:
+                    redirect, flush_ex = loaded, True
+                else:
+                    mem.value = loaded
+            elif mem.flags & MEM_WRITE_FLAG:
+                self._bus.write_addr(mem.alu_out, mem.rs2, mem.flags)
+                if not self._bus.is_ram_addr(mem.alu_out):
+                    # a device may write registers (e.g. a host call), the younger instructions already read theirs
+                    redirect, flush_ex = mem.pc + 1, True
+                else:
+                    # a store into code that is already in flight refetches it
+                    for younger in (self._id_ex, self._if_id):
+                        if younger is not None and younger.pc == mem.alu_out:
+                            redirect, flush_ex = mem.pc + 1, True
+
+        # execute stage
+        ex = self._id_ex
+        if ex is not None and not ex.halts and ex.fault is None:
+            ex.rs1 = self._forward(ex.rs1_addr, ex.rs1)
+            ex.rs2 = self._forward(ex.rs2_addr, ex.rs2)
+            ex.alu_out = alu(ex.flags, ex.rs1, ex.rs2, ex.imm)
+            flags = ex.flags
+            if flags & JAL_FLAG:
+                ex.value = ex.pc + 1
+            elif not flags & MEM_READ_FLAG:
+                ex.value = ex.alu_out
+            if redirect is None:
+                if flags & REG_WRITE_FLAG and ex.rd_addr == PC_REGISTER and not flags & MEM_READ_FLAG:
+                    redirect = ex.alu_out
+                elif flags & BRANCH_FLAG and ex.alu_out > 0:
+                    redirect = ex.pc + ex.imm
+
+        # decode stage
+        id_slot = self._if_id
+        stall = False
+        if id_slot is not None and id_slot.fault is None and not id_slot.halts:
+            load = self._id_ex
+            if (load is not None and load.flags & MEM_READ_FLAG and load.dest != 0
+                    and (load.dest == id_slot.rs1_addr or (id_slot.reads_rs2 and load.dest == id_slot.rs2_addr))):
+                # the loaded value is not ready until the load leaves MEM
+                stall = True
+            else:
+                id_slot.rs1, id_slot.rs2 = self._reg_file.read_registers(id_slot.rs1_addr, id_slot.rs2_addr)
+
+        # advance the latches
+        self._mem_wb = mem
+        self._ex_mem = None if flush_ex else ex
+        if redirect is not None:
+            self._flushes += 1
+            self._id_ex = None
+            self._if_id = None
+            self._fetch_stopped = False
+            self._pc.write_next_instruction(redirect)
+        elif stall:
+            self._stalls += 1
+            self._id_ex = None
+        else:
+            self._id_ex = id_slot
+            self._if_id = self._fetch()
+        return CPUStates.WB.value if wb is not None else CPUStates.FETCH.value
+
+    def _fetch(self) -> _Slot | None:
+        # fetch stage, the word is decoded here too since the decode cache holds both
+        if self._fetch_stopped:
+            return None
+        pc = self._pc.next_instruction
+        slot = _Slot(pc)
+        try:
+            slot.instr, slot.flags, slot.rd_addr, slot.rs1_addr, slot.rs2_addr, slot.imm = fetch_decode(self._bus, self._decode_cache, pc)
+        except Exception as e:
+            slot.fault = e
+        if slot.halts:
+            # nothing after the end of the program is fetched unless this NO_OP is flushed
+            self._fetch_stopped = True
+        slot.dest = _destination(slot.flags, slot.rd_addr)
+        slot.reads_rs2 = reads_rs2(slot.instr)
+        self._pc.write_next_instruction(pc + 1)
+        return slot
+
+    def run(self, max_instructions: int | None = None, max_cycles: int | None = None) -> RunResult:
+        """Runs until the NO_OP at the end of the program reaches WB or until a budget runs out"""
+        result, _, _ = step_cycles(self, 0, 0, max_instructions, max_cycles)
+        return result
@@ -0,0 +1,129 @@
+from array import array
+
+from instructions import Instructions
+
+# memory accesses are counted per region of 2^PROFILE_REGION_SHIFT words
+PROFILE_REGION_SHIFT = 6
+# names of the CPUStates stages, indexed by their value
+STAGE_NAMES = ("FETCH", "DECODE", "EXECUTE", "MEM", "WB")
+NUM_STAGES = len(STAGE_NAMES)
+OPCODE_MASK = 0b111111
+NUM_OPCODES = OPCODE_MASK + 1
+
+OPCODE_NAMES = {instr.value: instr.name for instr in Instructions}
+
+
+def _counters(size: int) -> array:
+    return array("Q", bytes(8 * size))
+
+
+class Profiler:
+    """Class collecting where a guest program spends its time, in flat arrays of counters.
+
+    Per pc it counts retired instructions, their cycles and how often a branch there was taken or not.
+    It also counts cycles per CPUStates stage (only the clocked cpu has stages), cycles per opcode and
+    memory reads and writes per region of addresses. Arrays grow when a pc or address past their
+    end shows up, size only sets their starting length.
+    """
+    def __init__(self, size: int = 0, region_shift: int = PROFILE_REGION_SHIFT):
+        self.region_shift: int = region_shift
+        self.counts: array = _counters(size)
+        self.cycles: array = _counters(size)
+        self.taken: array = _counters(size)
+        self.not_taken: array = _counters(size)
+        self.stage_cycles: array = _counters(NUM_STAGES)
+        self.opcode_counts: array = _counters(NUM_OPCODES)
+        self.opcode_cycles: array = _counters(NUM_OPCODES)
+        num_regions = (size >> region_shift) + 1
+        self.reads: array = _counters(num_regions)
+        self.writes: array = _counters(num_regions)
+
+    @staticmethod
+    def _grow(counters: array, index: int) -> None:
+        counters.extend(_counters(max(index + 1, 2 * len(counters)) - len(counters)))
+
+    def stage(self, state: int) -> None:
+        # one cycle spent in a CPUStates stage
+        self.stage_cycles[state] += 1
+
+    def retire(self, pc: int, instr: int, cycles: int, taken: bool | None = None) -> None:
+        # taken is None for instructions that are not branches
+        if pc >= len(self.counts):
+            for counters in (self.counts, self.cycles, self.taken, self.not_taken):
+                self._grow(counters, pc)
+        self.counts[pc] += 1
+        self.cycles[pc] += cycles
+        opcode = instr & OPCODE_MASK
+        self.opcode_counts[opcode] += 1
+        self.opcode_cycles[opcode] += cycles
+        if taken is not None:
+            if taken:
+                self.taken[pc] += 1
+            else:
+                self.not_taken[pc] += 1
+
+    def mem_read(self, addr: int) -> None:
+        region = addr >> self.region_shift
+        if region >= len(self.reads):
+            self._grow(self.reads, region)
+            self._grow(self.writes, region)
+        self.reads[region] += 1
+
+    def mem_write(self, addr: int) -> None:
+        region = addr >> self.region_shift
+        if region >= len(self.writes):
+            self._grow(self.reads, region)
+            self._grow(self.writes, region)
+        self.writes[region] += 1
+
+    @property
+    def instructions(self) -> int:
+        return sum(self.counts)
+
+    def hot_spots(self, top: int = 20) -> list[int]:
+        # pcs with the most cycles, most expensive first
+        pcs = [pc for pc, cycles in enumerate(self.cycles) if cycles]
+        pcs.sort(key=lambda pc: self.cycles[pc], reverse=True)
+        return pcs[:top]
+
+    def report(self, source: list[tuple[int, str]] | None = None, labels: dict[str, int] | None = None, top: int = 20) -> str:
+        """Formats the counters as text.
+
+        source and labels come from assembler.assembler_source_map, they map each pc to its
+        source line and name the labels that point at it.
+        """
+        names: dict[int, list[str]] = {}
+        for label, pc in (labels or {}).items():
+            names.setdefault(pc, []).append(label)
+        total_cycles = sum(self.cycles)
+        lines = [f"instructions: {self.instructions}, cycles: {total_cycles}"]
+
+        if any(self.stage_cycles):
+            lines.append("stage cycles: " + ", ".join(f"{name}={cycles}" for name, cycles in zip(STAGE_NAMES, self.stage_cycles)))
+
+        lines.append("hot spots:")
+        lines.append(f"{'pc':>6} {'count':>10} {'cycles':>10} {'%':>6} {'taken':>8} {'not':>8}  source")
+        for pc in self.hot_spots(top):
+            share = 100 * self.cycles[pc] / total_cycles
+            text = ""
+            if source is not None and pc < len(source):
+                number, line = source[pc]
+                text = f"{number}: {line}"
+            if pc in names:
+                text = f"[{', '.join(names[pc])}] {text}"
+            branches = f"{self.taken[pc]:>8} {self.not_taken[pc]:>8}" if self.taken[pc] or self.not_taken[pc] else f"{'':>8} {'':>8}"
+            lines.append(f"{pc:>6} {self.counts[pc]:>10} {self.cycles[pc]:>10} {share:>6.1f} {branches}  {text}")
+
+        lines.append("opcodes:")
+        for opcode in sorted(range(NUM_OPCODES), key=lambda opcode: self.opcode_cycles[opcode], reverse=True):
+            if self.opcode_counts[opcode]:
+                name = OPCODE_NAMES.get(opcode, f"0b{opcode:06b}")
+                lines.append(f"{name:>8} {self.opcode_counts[opcode]:>10} {self.opcode_cycles[opcode]:>10}")
+
+        lines.append("memory regions:")
+        for region in range(len(self.reads)):
+            if self.reads[region] or self.writes[region]:
+                start = region << self.region_shift
+                end = start + (1 << self.region_shift) - 1
+                lines.append(f"{f'{start}-{end}':>12} reads {self.reads[region]:>10} writes {self.writes[region]:>10}")
+        return "\n".join(lines)
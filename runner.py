@@ -0,0 +1,99 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator
+
+from cpu import RAM, Bus, CPU, CPUClocked, STDOut
+from translator import CPUTranslated
+
+NUM_REGISTERS = 32
+DEFAULT_RAM_SIZE = 4096
+
+# execution engines a job can ask for
+ENGINES = {
+    "cpu": CPU,
+    "clocked": CPUClocked,
+    "translated": CPUTranslated,
+}
+
+
+class Job:
+    """A guest program to run: its image, initial registers, ram size and where the STDOut device is mapped"""
+    def __init__(self, image_path: str, registers: dict[int, int] | None = None, ram_size: int = DEFAULT_RAM_SIZE,
+                 mmio_base: int | None = None, engine: str = "clocked", max_instructions: int | None = None, name: str | None = None):
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine {engine}, expected one of {list(ENGINES)}")
+        self.image_path: str = image_path
+        self.registers: dict[int, int] = registers if registers is not None else {}
+        self.ram_size: int = ram_size
+        self.mmio_base: int | None = mmio_base
+        self.engine: str = engine
+        self.max_instructions: int | None = max_instructions
+        self.name: str = name if name is not None else image_path
+
+
+class JobResult:
+    """Final state of a job, or the error that stopped it"""
+    def __init__(self, index: int, name: str, registers: list[int] | None, stdout: str, reason: str | None,
+                 instructions: int, cycles: int, error: str | None = None):
+        self.index: int = index
+        self.name: str = name
+        self.registers: list[int] | None = registers
+        self.stdout: str = stdout
+        self.reason: str | None = reason
+        self.instructions: int = instructions
+        self.cycles: int = cycles
+        self.error: str | None = error
+
+    def __repr__(self) -> str:
+        return f"JobResult(name={self.name!r}, reason={self.reason}, instructions={self.instructions}, error={self.error!r})"
+
+
+def captured_output(std_out: STDOut) -> str:
+    return std_out.getvalue().decode(errors="replace")
+
+
+def run_job(index: int, job: Job) -> JobResult:
+    """Builds a fresh machine for the job and runs it to the end, capturing what the guest printed"""
+    std_out = STDOut(capture=True)
+    try:
+        ram = RAM(job.ram_size)
+        image = ram.load_file(job.image_path)
+        if job.mmio_base is None:
+            bus = Bus(ram)
+        else:
+            bus = Bus(ram, job.mmio_base, std_out)
+        cpu = ENGINES[job.engine](num_registers=NUM_REGISTERS, bus=bus)
+        if image is not None and image.entry is not None:
+            cpu.next_instruction = image.entry
+        for register, value in job.registers.items():
+            cpu.set_register(register, value)
+        result = cpu.run(max_instructions=job.max_instructions)
+    except Exception as e:
+        return JobResult(index, job.name, None, captured_output(std_out), None, 0, 0, error=f"{type(e).__name__}: {e}")
+    return JobResult(index, job.name, cpu.dump_regs(), captured_output(std_out), result.reason.name, result.instructions, result.cycles)
+
+
+def run_jobs(jobs: Iterable[Job], max_workers: int | None = None) -> Iterator[JobResult]:
+    """Runs jobs across a pool of worker processes, yielding each result as soon as it finishes.
+
+    Results carry the index of their job, they arrive in completion order.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_job, index, job) for index, job in enumerate(jobs)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# ======================================================================
+# USAGE: python runner.py <binary> [<binary> ...]
+# runs every image with the default ram size and prints its registers
+# ======================================================================
+if __name__ == "__main__":
+    for result in run_jobs(Job(path) for path in sys.argv[1:]):
+        if result.error is not None:
+            print(f"{result.name}: {result.error}")
+            continue
+        print(f"{result.name}: {result.reason} after {result.instructions} instructions")
+        print(f"\tregs: {result.registers}")
+        if result.stdout:
+            print(f"\tstdout: {result.stdout!r}")
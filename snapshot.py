@@ -0,0 +1,264 @@
+import struct
+from array import array
+
+from image import words_to_bytes, words_from_bytes, WORD_BYTES, WORD_TYPECODE
+
+# words per snapshot page are 2^SNAPSHOT_PAGE_SHIFT
+SNAPSHOT_PAGE_SHIFT = 8
+
+SNAPSHOT_MAGIC = b"\x7fSNP"
+SNAPSHOT_VERSION = 1
+
+# magic, version, page shift, words of ram, number of cpu fields, number of devices, number of stored pages
+SNAPSHOT_HEADER = struct.Struct(">4sHBQHHI")
+# length of the utf-8 name of a cpu field that follows, its value comes after the name
+FIELD_NAME = struct.Struct(">H")
+# base address of a device, its state comes after it
+DEVICE_BASE = struct.Struct(">Q")
+# index, kind, number of words of a page that is not all zero
+PAGE_HEADER = struct.Struct(">IBI")
+# tag, then the number of bytes (ints and bytes) or items (tuples) that follow
+VALUE_HEADER = struct.Struct(">BI")
+
+# pages whose words all fit in 32 bits are stored as big endian words, others as int values
+PAGE_WORDS = 0
+PAGE_VALUES = 1
+
+VALUE_NONE = 0
+VALUE_INT = 1
+VALUE_BYTES = 2
+VALUE_TUPLE = 3
+
+
+def _pack_value(value) -> bytes:
+    # cpu fields and device states are None, ints (of any size), bytes or tuples and lists of those
+    if value is None:
+        return VALUE_HEADER.pack(VALUE_NONE, 0)
+    if isinstance(value, int):
+        encoded = value.to_bytes((value.bit_length() + 8) // 8, "big", signed=True)
+        return VALUE_HEADER.pack(VALUE_INT, len(encoded)) + encoded
+    if isinstance(value, (bytes, bytearray)):
+        return VALUE_HEADER.pack(VALUE_BYTES, len(value)) + bytes(value)
+    if isinstance(value, (tuple, list)):
+        return VALUE_HEADER.pack(VALUE_TUPLE, len(value)) + b"".join(_pack_value(item) for item in value)
+    raise ValueError(f"can not save a {type(value).__name__} in a snapshot")
+
+
+def _unpack_value(data: bytes, offset: int) -> tuple[object, int]:
+    _check_length(data, offset + VALUE_HEADER.size)
+    tag, length = VALUE_HEADER.unpack_from(data, offset)
+    offset += VALUE_HEADER.size
+    if tag == VALUE_NONE:
+        return None, offset
+    if tag == VALUE_TUPLE:
+        items = []
+        for _ in range(length):
+            item, offset = _unpack_value(data, offset)
+            items.append(item)
+        return tuple(items), offset
+    _check_length(data, offset + length)
+    if tag == VALUE_INT:
+        return int.from_bytes(data[offset:offset + length], "big", signed=True), offset + length
+    if tag == VALUE_BYTES:
+        return data[offset:offset + length], offset + length
+    raise ValueError(f"unknown value tag {tag} in snapshot")
+
+
+def _check_length(data: bytes, end: int):
+    # a truncated file must fail with ValueError, never struct.error
+    if end > len(data):
+        raise ValueError("snapshot is truncated")
+
+
+class Snapshot:
+    """Class holding the full state of a machine at one point in time.
+
+    cpu is the cpu's own state (registers, pc, latches), pages holds ram as a tuple of word tuples and
+    devices maps each device's base address to the state it reported. Pages that did not change
+    between two snapshots are the same objects in both, and every all zero page is one shared tuple,
+    so a snapshot only costs the pages written since the previous one and the pages in use.
+
+    The file holds a header, the cpu fields, the device states and then only the pages that are not
+    all zero, all big endian like a program image. Values are tagged, so loading a file never runs code.
+    """
+    def __init__(self, cpu: dict, pages: tuple[tuple[int, ...], ...], page_shift: int, devices: dict[int, object]):
+        self.cpu: dict = cpu
+        self.pages: tuple[tuple[int, ...], ...] = pages
+        self.page_shift: int = page_shift
+        self.devices: dict[int, object] = devices
+
+    def to_bytes(self) -> bytes:
+        stored = [(index, page) for index, page in enumerate(self.pages) if any(page)]
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.page_shift, sum(map(len, self.pages)),
+                                      len(self.cpu), len(self.devices), len(stored))]
+        for name, value in self.cpu.items():
+            encoded = name.encode()
+            parts.append(FIELD_NAME.pack(len(encoded)))
+            parts.append(encoded)
+            parts.append(_pack_value(value))
+        for base, state in self.devices.items():
+            parts.append(DEVICE_BASE.pack(base))
+            parts.append(_pack_value(state))
+        for index, page in stored:
+            try:
+                words = array(WORD_TYPECODE, page)
+            except OverflowError:
+                # plain RAM holds unbounded python ints
+                parts.append(PAGE_HEADER.pack(index, PAGE_VALUES, len(page)))
+                parts.append(_pack_value(page))
+            else:
+                parts.append(PAGE_HEADER.pack(index, PAGE_WORDS, len(page)))
+                parts.append(words_to_bytes(words))
+        return b"".join(parts)
+
+    def save(self, file_path: str):
+        with open(file_path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "Snapshot":
+        if len(data) < SNAPSHOT_HEADER.size or data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError("not a snapshot")
+        _, version, page_shift, num_words, num_fields, num_devices, num_stored = SNAPSHOT_HEADER.unpack_from(data)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {version}")
+        offset = SNAPSHOT_HEADER.size
+
+        cpu = {}
+        for _ in range(num_fields):
+            _check_length(data, offset + FIELD_NAME.size)
+            (length,) = FIELD_NAME.unpack_from(data, offset)
+            offset += FIELD_NAME.size
+            _check_length(data, offset + length)
+            name = data[offset:offset + length].decode()
+            cpu[name], offset = _unpack_value(data, offset + length)
+
+        devices = {}
+        for _ in range(num_devices):
+            _check_length(data, offset + DEVICE_BASE.size)
+            (base,) = DEVICE_BASE.unpack_from(data, offset)
+            devices[base], offset = _unpack_value(data, offset + DEVICE_BASE.size)
+
+        # pages that were not stored are all zero and share one tuple per length
+        page_size = 1 << page_shift
+        num_pages = (num_words + page_size - 1) >> page_shift
+        pages = [(0,) * page_size] * num_pages
+        if num_pages and num_words & (page_size - 1):
+            pages[-1] = (0,) * (num_words & (page_size - 1))
+        for _ in range(num_stored):
+            _check_length(data, offset + PAGE_HEADER.size)
+            index, kind, length = PAGE_HEADER.unpack_from(data, offset)
+            offset += PAGE_HEADER.size
+            if index >= num_pages or length != len(pages[index]):
+                raise ValueError(f"page {index} does not fit in the snapshot's ram")
+            if kind == PAGE_WORDS:
+                _check_length(data, offset + length * WORD_BYTES)
+                pages[index] = tuple(words_from_bytes(data[offset:offset + length * WORD_BYTES]))
+                offset += length * WORD_BYTES
+            elif kind == PAGE_VALUES:
+                page, offset = _unpack_value(data, offset)
+                if not isinstance(page, tuple) or len(page) != length or not all(isinstance(word, int) for word in page):
+                    raise ValueError(f"page {index} does not hold {length} words")
+                pages[index] = page
+            else:
+                raise ValueError(f"unknown page kind {kind} in snapshot")
+        return Snapshot(cpu, tuple(pages), page_shift, devices)
+
+    @staticmethod
+    def load(file_path: str) -> "Snapshot":
+        with open(file_path, "rb") as f:
+            data = f.read()
+        try:
+            return Snapshot.from_bytes(data)
+        except ValueError as e:
+            raise ValueError(f"{file_path} does not hold a snapshot: {e}") from e
+
+
+class PageTracker:
+    """Class tracking which pages of ram were written since the last snapshot or restore.
+
+    It attaches to the ram like a decode cache, so every write marks its page dirty. Capturing only
+    reads the dirty pages and reuses the rest from the previous capture, restoring only writes the
+    pages that differ from what ram currently holds. Pages a sparse ram (one with an untouched method,
+    like PagedRAM) never allocated are neither read nor written.
+    """
+    def __init__(self, ram, page_shift: int = SNAPSHOT_PAGE_SHIFT):
+        self._ram = ram
+        self._page_shift: int = page_shift
+        self._num_pages: int = (ram.size + (1 << page_shift) - 1) >> page_shift
+        # pages ram held at the last capture or restore, None when they are unknown
+        self._pages: tuple[tuple[int, ...], ...] | None = None
+        self._dirty: set[int] = set()
+        # shared all zero page by length, only the last page can be shorter
+        self._zero_pages: dict[int, tuple[int, ...]] = {}
+        ram.attach_decode_cache(self)
+
+    @property
+    def page_shift(self) -> int:
+        return self._page_shift
+
+    def invalidate(self, addr: int) -> None:
+        self._dirty.add(addr >> self._page_shift)
+
+    def invalidate_range(self, start: int, stop: int) -> None:
+        if stop > start:
+            self._dirty.update(range(start >> self._page_shift, ((stop - 1) >> self._page_shift) + 1))
+
+    def clear(self) -> None:
+        # the whole of ram was replaced
+        self._pages = None
+
+    def _read_page(self, index: int) -> tuple[int, ...]:
+        start = index << self._page_shift
+        count = min(1 << self._page_shift, self._ram.size - start)
+        if hasattr(self._ram, "untouched") and self._ram.untouched(start, count):
+            # sparse ram knows the page was never written without reading it
+            return self._zero_pages.setdefault(count, (0,) * count)
+        words = self._ram.read_words(start, count)
+        if not any(words):
+            # every zero page of a snapshot is the same tuple, so a snapshot of sparse ram stays small
+            return self._zero_pages.setdefault(len(words), tuple(words))
+        return tuple(words)
+
+    def capture(self) -> tuple[tuple[int, ...], ...]:
+        if self._pages is None:
+            pages = tuple(self._read_page(index) for index in range(self._num_pages))
+        else:
+            changed = list(self._pages)
+            for index in self._dirty:
+                changed[index] = self._read_page(index)
+            pages = tuple(changed)
+        self._pages = pages
+        self._dirty.clear()
+        return pages
+
+    def restore(self, pages: tuple[tuple[int, ...], ...], page_shift: int) -> None:
+        if page_shift != self._page_shift or len(pages) != self._num_pages:
+            raise ValueError(f"snapshot does not match ram (pages = {len(pages)}, ram pages = {self._num_pages})")
+        current = self._pages
+        sparse = hasattr(self._ram, "untouched")
+        for index, page in enumerate(pages):
+            if current is not None and index not in self._dirty and current[index] is page:
+                continue
+            start = index << self._page_shift
+            if sparse and not any(page) and self._ram.untouched(start, len(page)):
+                continue
+            self._ram.write_words(start, page)
+        self._pages = pages
+        self._dirty.clear()
+
+
+def snapshot_machine(cpu_state: dict, tracker: PageTracker, bus) -> Snapshot:
+    # devices other than ram are saved if they implement snapshot_state
+    devices = {}
+    for base, _, device in bus.devices:
+        if device is not bus.ram and hasattr(device, "snapshot_state"):
+            devices[base] = device.snapshot_state()
+    return Snapshot(cpu_state, tracker.capture(), tracker.page_shift, devices)
+
+
+def restore_machine(snapshot: Snapshot, tracker: PageTracker, bus) -> None:
+    tracker.restore(snapshot.pages, snapshot.page_shift)
+    for base, _, device in bus.devices:
+        if base in snapshot.devices:
+            device.restore_state(snapshot.devices[base])
@@ -0,0 +1,152 @@
+import os
+
+import pytest
+
+import assembler
+from assembler import (assemble, assembler_assemble, assembler_assemble_file, assembler_cache_key, assembler_parse_line,
+                       assembler_tokenize, FLAT_DATA_BASE)
+from image import IMAGE_HEADER, IMAGE_MAGIC, IMAGE_VERSION
+from instructions import Instructions, r_type, i_type, b_type, lw, sw, jal, decode_instruction
+
+
+def test_tokenize():
+    assert list(assembler_tokenize("LW ra, -1(sp)  ")) == ["LW", "ra", "-1", "sp"]
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("ADD r3, r1, r2", r_type(Instructions.ADD, 3, 1, 2)),
+    ("ADDI sp, zero, -1024", i_type(Instructions.ADDI, 2, 0, -1024)),
+    ("LW ra, 1(sp)", lw(1, 2, 1)),
+    ("SW sp, -3(t0)", sw(2, 5, -3)),
+    ("BNE t6, r1, LOOP", b_type(Instructions.BNE, 31, 1, -2)),
+    ("JAL LOOP", jal(-2)),
+    ("NO_OP", 0),
+])
+def test_parse_line_matches_builders(line, expected):
+    assert assembler_parse_line(2, line, {"LOOP": 0}, {}) == expected
+
+
+def test_parse_line_data_label():
+    code = assembler_parse_line(0, "ADDI r1, zero, value", {}, {"VALUE": 1003})
+    _, _, _, _, imm = decode_instruction(code)
+    assert imm == 1003
+
+
+@pytest.mark.parametrize("line", ["ADDI r1, zero, 1024", "LW r1, -1025(r2)"])
+def test_parse_line_imm_out_of_range(line):
+    with pytest.raises(ValueError):
+        assembler_parse_line(0, line, {}, {})
+
+
+def test_assemble_backpatches_forward_references():
+    source = iter([
+        "START: JAL FUNC  # forward jump\n",
+        "  ADDI r1, zero, value\n",
+        "  BEQ zero, zero, END\n",
+        "FUNC:\n",
+        "  ADD r29, zero, ra\n",
+        ".data\n",
+        "pad: 0 0\n",
+        "value: 7\n",
+        ".text\n",
+        "  BNE r1, zero, START\n",
+        "END:\n",
+    ])
+    image = assembler_assemble(source)
+    text, data = image.sections
+    assert (text.name, text.base, data.name, data.base) == (".text", 0, ".data", 6)
+    assert list(text.words) == [
+        jal(3),
+        i_type(Instructions.ADDI, 1, 0, 6 + 2),
+        b_type(Instructions.BEQ, 0, 0, 3),
+        r_type(Instructions.ADD, 29, 0, 1),
+        b_type(Instructions.BNE, 1, 0, -4),
+        0,
+    ]
+    assert list(data.words) == [0, 0, 7]
+    assert image.symbols == {"START": 0, "FUNC": 3, "END": 5, "PAD": 6, "VALUE": 8}
+    assert image.entry is None
+
+
+def test_assemble_entry_and_data_base():
+    image = assembler_assemble([".entry MAIN", "NO_OP", "MAIN: LW r1, x(zero)", ".data", "x: 5"], FLAT_DATA_BASE)
+    assert image.entry == 1
+    assert image.section(".data").base == FLAT_DATA_BASE
+    assert image.section(".text").words[1] == lw(1, 0, FLAT_DATA_BASE)
+
+
+def test_assemble_matches_repo_programs():
+    with open("fact.asm") as f:
+        image = assembler_assemble(f)
+    text = image.section(".text").words
+    # 18 instructions and the NO_OP added at the end
+    assert len(text) == 19 and len(image.section(".data").words) == 0
+    assert text[1] == jal(4)
+
+
+@pytest.mark.parametrize("lines", [["BEQ zero, zero, MISSING"], ["ADDI r1, zero, missing"], [".entry MISSING", "NO_OP"]])
+def test_assemble_undefined_label(lines):
+    with pytest.raises(ValueError):
+        assembler_assemble(lines)
+
+
+def test_assemble_text_overlapping_data_base():
+    with pytest.raises(ValueError):
+        assembler_assemble(["NO_OP"] * 4, 2)
+
+
+def test_file_cache_skips_parsing(tmp_path, monkeypatch):
+    source = tmp_path / "fib.asm"
+    with open("Fibsq.asm") as f:
+        source.write_text(f.read())
+    cache_dir = tmp_path / "cache"
+    first = assembler_assemble_file(str(source), cache_dir=str(cache_dir))
+    assert len(os.listdir(cache_dir)) == 1
+
+    def fail(*args):
+        raise AssertionError("cached source was parsed again")
+    monkeypatch.setattr(assembler, "assembler_assemble", fail)
+    second = assembler_assemble_file(str(source), cache_dir=str(cache_dir))
+    assert second.to_bytes() == first.to_bytes()
+    assert second.symbols["LOOP"] == first.symbols["LOOP"]
+
+    # a changed source or a corrupt entry is assembled again
+    monkeypatch.undo()
+    source.write_text(source.read_text() + "\nNO_OP\n")
+    assembler_assemble_file(str(source), cache_dir=str(cache_dir))
+    assert len(os.listdir(cache_dir)) == 2
+    for name in os.listdir(cache_dir):
+        (cache_dir / name).write_bytes(b"junk")
+    assert assembler_assemble_file(str(source), cache_dir=str(cache_dir)).entry is None
+
+
+def test_file_cache_rebuilds_truncated_entry(tmp_path):
+    source = tmp_path / "fib.asm"
+    with open("Fibsq.asm") as f:
+        source.write_text(f.read())
+    cache_dir = tmp_path / "cache"
+    expected = assembler_assemble_file(str(source), cache_dir=str(cache_dir)).to_bytes()
+    (entry,) = os.listdir(cache_dir)
+    # a header claiming 2 sections with no section table after it
+    (cache_dir / entry).write_bytes(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 2, 0, 0))
+
+    assert assembler_assemble_file(str(source), cache_dir=str(cache_dir)).to_bytes() == expected
+    assert (cache_dir / entry).read_bytes() == expected
+
+
+def test_cache_key(monkeypatch):
+    key = assembler_cache_key([b"NO_OP\n"])
+    assert key == assembler_cache_key([b"NO_", b"OP\n"])
+    assert key != assembler_cache_key([b"NO_OP\n"], FLAT_DATA_BASE)
+    monkeypatch.setattr(assembler, "ASSEMBLER_VERSION", "next")
+    assert key != assembler_cache_key([b"NO_OP\n"])
+
+
+def test_assemble_memo():
+    source = "LOOP: ADDI r1, r1, 1\nBNE r1, zero, LOOP\n"
+    first = assemble(source)
+    hits = assembler._assemble_bytes.cache_info().hits
+    second = assemble(source)
+    assert assembler._assemble_bytes.cache_info().hits == hits + 1
+    assert first is not second and first.to_bytes() == second.to_bytes()
+    assert first.symbols == {"LOOP": 0}
@@ -0,0 +1,91 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from assembler import assembler_assemble_file
+from cpu import Bus, RAM, CPUClocked, HaltReason
+from instructions import Instructions, r_type
+from batch import CPUBatch
+from fixtures import fib_program, fact_program
+
+STACK_ADDR = 50
+
+
+def run_clocked(program: list[int], registers: dict[int, int]) -> CPUClocked:
+    ram = RAM(100)
+    for i, instr in enumerate(program):
+        ram.write_addr(i, instr)
+    cpu = CPUClocked(num_registers=32, bus=Bus(ram, None, None))
+    for register, value in registers.items():
+        cpu.set_register(register, value)
+    cpu.run()
+    return cpu
+
+
+def test_fact_lanes_match_clocked():
+    # take the argument from r1 instead of loading 5 into it
+    program = fact_program(5)
+    program[0] = r_type(Instructions.ADD, 1, 1, 0)
+    inputs = np.arange(1, 9)
+
+    batch = CPUBatch(lanes=len(inputs), num_registers=32, ram_size=100)
+    batch.load_program(program)
+    batch.set_register(1, inputs)
+    batch.set_register(30, STACK_ADDR)
+    result = batch.run()
+
+    assert result.reason == HaltReason.HALTED
+    assert batch.halted.all()
+    for lane, n in enumerate(inputs):
+        cpu = run_clocked(program, {1: int(n), 30: STACK_ADDR})
+        assert batch.dump_regs()[lane].tolist() == cpu.dump_regs()
+        assert batch.next_instruction[lane] == cpu.next_instruction
+    assert batch.read_register(2).tolist() == [1, 2, 6, 24, 120, 720, 5040, 40320]
+
+
+def test_fib_lanes_diverge():
+    # take the loop count from t2 instead of loading it
+    program = fib_program(9)
+    program[2] = r_type(Instructions.ADD, 7, 7, 0)
+    counts = np.array([1, 5, 9, 20])
+
+    batch = CPUBatch(lanes=len(counts), num_registers=32, ram_size=20)
+    batch.load_program(program)
+    batch.set_register(7, counts)
+    result = batch.run()
+
+    assert batch.read_register(6).tolist() == [1, 8, 55, 10946]
+    assert batch.retired.tolist() == (3 + counts * 5).tolist()
+    assert result.instructions == int((3 + counts * 5).sum())
+    assert result.cycles == 3 + 20 * 5 + 1
+
+
+def test_load_assembled_image(tmp_path):
+    # the default assembler output is a sectioned image, not flat words
+    source = tmp_path / "entry.asm"
+    source.write_text(".entry MAIN\nADDI r1, zero, 1\nMAIN: ADDI r2, zero, x\nLW r3, 0(r2)\n.data\nx: 42\n")
+    path = tmp_path / "entry.bin"
+    assembler_assemble_file(str(source), use_cache=False).save(str(path))
+
+    batch = CPUBatch(lanes=2, num_registers=32, ram_size=16)
+    image = batch.load_file(str(path))
+    assert batch.read_ram(image.symbols["X"]).tolist() == [42, 42]
+    assert batch.run().reason == HaltReason.HALTED
+    assert batch.read_register(1).tolist() == [0, 0]
+    assert batch.read_register(3).tolist() == [42, 42]
+
+    assembler_assemble_file("Fibsq.asm", use_cache=False).save(str(path))
+    batch = CPUBatch(lanes=1, num_registers=32, ram_size=64)
+    assert batch.load_file(str(path)) is not None
+    batch.run()
+    assert batch.read_register(6).tolist() == [55]
+
+
+def test_step_budget():
+    batch = CPUBatch(lanes=2, num_registers=32, ram_size=20)
+    batch.load_program(fib_program(9))
+
+    result = batch.run(max_steps=4)
+
+    assert result.reason == HaltReason.CYCLE_LIMIT
+    assert batch.next_instruction.tolist() == [4, 4]
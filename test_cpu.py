@@ -1,5 +1,10 @@
-from cpu import  Bus, RAM, CPU
-from instructions import Flags, Instructions, r_type, i_type, b_type, lw, sw
+import io
+import os
+
+import pytest
+
+from cpu import  Bus, RAM, ArrayRAM, MappedRAM, PagedRAM, CPU, CPUClocked, CPUStates, HaltReason, Memory, STDOut, STDIn, DMA, DMA_MEM_TO_MEM, DMA_FILE_TO_MEM, DMA_MEM_TO_FILE
+from instructions import Flags, Instructions, r_type, i_type, b_type, lw, sw, decode_instruction
 
 
 def test_add():
@@ -344,3 +349,432 @@ def test_lw_2():
     r2_value = cpu.read_register(2)
     assert r2_value == expected_mem_value
 
+
+
+def test_decode_cache_reused():
+    instr_0 = i_type(Instructions.ADDI, 1, 1, 1)
+    instr_1 = b_type(Instructions.BEQ, 0, 0, -1)
+
+    ram = RAM(10)
+
+    ram.write_addr(0, instr_0)
+    ram.write_addr(1, instr_1)
+
+    bus = Bus(ram, None, None)
+
+    cpu = CPU(num_registers=32, bus=bus)
+
+    for _ in range(6):
+        cpu.cycle()
+
+    assert cpu.read_register(1) == 3
+    assert cpu._decode_cache.lookup(0) == (instr_0, *decode_instruction(instr_0))
+
+
+def test_decode_cache_invalidated_on_write():
+    instr_0 = i_type(Instructions.ADDI, 1, 1, 1)
+    instr_1 = b_type(Instructions.BEQ, 0, 0, -1)
+
+    ram = RAM(10)
+
+    ram.write_addr(0, instr_0)
+    ram.write_addr(1, instr_1)
+
+    bus = Bus(ram, None, None)
+
+    cpu = CPU(num_registers=32, bus=bus)
+
+    cpu.cycle() # r1 += 1
+    cpu.cycle() # back to start of loop
+
+    # overwrite the cached instruction, the next fetch must see the new word
+    ram.write_addr(0, i_type(Instructions.ADDI, 1, 1, 5))
+    assert cpu._decode_cache.lookup(0) is None
+
+    cpu.cycle() # r1 += 5
+
+    assert cpu.read_register(1) == 6
+
+
+def test_array_ram_load_and_dump(tmp_path):
+    program = [i_type(Instructions.ADDI, 1, 0, 5), r_type(Instructions.ADD, 2, 1, 1)]
+    image = tmp_path / "prog.bin"
+    image.write_bytes(b"".join(x.to_bytes(4, byteorder="big") for x in program) + b"\x00\x01")
+
+    ram = ArrayRAM(10)
+    ram.load_file(str(image))
+    assert [ram.read_addr(0), ram.read_addr(1), ram.read_addr(2)] == program + [0]
+
+    cpu = CPU(num_registers=32, bus=Bus(ram, None, None))
+    cpu.cycle()
+    cpu.cycle()
+    assert cpu.read_register(2) == 10
+
+    dumped = tmp_path / "dump.bin"
+    ram.dump(str(dumped), 0, 2)
+    assert dumped.read_bytes() == image.read_bytes()[:8]
+
+
+def test_array_ram_wraps_and_views():
+    ram = ArrayRAM(4)
+    view = ram.view(1, 3)
+
+    ram.write_addr(1, -3)
+    ram.write_addr(2, 1 << 32 | 9)
+
+    assert ram.read_addr(1) == -3
+    assert ram.read_addr(2) == 9
+    assert view.tolist() == [-3, 9]
+
+
+def test_mapped_ram_copy_on_write(tmp_path):
+    program = [i_type(Instructions.ADDI, 1, 0, 5), r_type(Instructions.ADD, 2, 1, 1)]
+    image = tmp_path / "prog.bin"
+    image_bytes = b"".join(x.to_bytes(4, byteorder="big") for x in program)
+    image.write_bytes(image_bytes)
+
+    ram = MappedRAM(10)
+    ram.load_file(str(image))
+
+    cpu = CPU(num_registers=32, bus=Bus(ram, None, None))
+    cpu.cycle()
+    cpu.cycle()
+    assert cpu.read_register(2) == 10
+
+    # writes inside and past the image stay private
+    ram.write_addr(0, 7)
+    ram.write_addr(8, -1)
+    assert ram.read_addr(0) == 7
+    assert ram.read_addr(8) == -1
+    ram.close()
+    assert image.read_bytes() == image_bytes
+
+
+def test_mapped_ram_persist(tmp_path):
+    image = tmp_path / "prog.bin"
+    image.write_bytes((3).to_bytes(4, byteorder="big"))
+
+    ram = MappedRAM(4, persist=True)
+    ram.load_file(str(image))
+    ram.write_addr(2, 9)
+    ram.close()
+
+    reloaded = ArrayRAM(4)
+    reloaded.load_file(str(image))
+    assert [reloaded.read_addr(i) for i in range(4)] == [3, 0, 9, 0]
+
+
+def test_paged_ram_sparse():
+    ram = PagedRAM(1 << 24)
+    assert ram.resident_pages == 0
+
+    instr = sw(0, 2, 0) # mem[0] = r2
+    ram.write_addr(0, instr)
+    bus = Bus(ram, None, None)
+    cpu = CPU(num_registers=32, bus=bus)
+    cpu.set_register(2, 5)
+    cpu.cycle()
+    assert ram.read_addr(0) == 5
+
+    high_addr = (1 << 24) - 1
+    assert bus.read_addr(high_addr) == 0
+    assert ram.resident_pages == 1
+    ram.write_addr(high_addr, 0)
+    assert ram.resident_pages == 1
+    ram.write_addr(high_addr, -4)
+    assert ram.read_addr(high_addr) == -4
+    assert ram.resident_pages == 2
+
+
+def loop_program() -> list[int]:
+    # r1 counts up to 3, then the program ends
+    return [
+        i_type(Instructions.ADDI, 2, 0, 3),
+        i_type(Instructions.ADDI, 1, 1, 1),
+        b_type(Instructions.BNE, 1, 2, -1),
+        0,
+    ]
+
+
+def build_cpu(cpu_class, program: list[int]):
+    ram = RAM(10)
+    for i, instr in enumerate(program):
+        ram.write_addr(i, instr)
+    return cpu_class(num_registers=32, bus=Bus(ram, None, None))
+
+
+def test_run_to_halt():
+    cpu = build_cpu(CPU, loop_program())
+
+    result = cpu.run()
+
+    assert result.reason == HaltReason.HALTED
+    assert result.instructions == 7
+    assert result.cycles == 7
+    assert cpu.read_register(1) == 3
+    assert cpu.next_instruction == 3
+    assert cpu.cycle() == CPUStates.STOPPED.value
+
+
+def test_run_instruction_budget():
+    cpu = build_cpu(CPU, loop_program())
+
+    result = cpu.run(max_instructions=3)
+    assert result.reason == HaltReason.INSTRUCTION_LIMIT
+    assert result.instructions == 3
+    assert cpu.read_register(1) == 1
+
+    result = cpu.run()
+    assert result.reason == HaltReason.HALTED
+    assert result.instructions == 4
+    assert cpu.read_register(1) == 3
+
+
+def test_clocked_run_matches_cycle():
+    stepped = build_cpu(CPUClocked, loop_program())
+    cycles = 1
+    while stepped.cycle() != CPUStates.STOPPED.value:
+        cycles += 1
+
+    cpu = build_cpu(CPUClocked, loop_program())
+    result = cpu.run()
+
+    assert result.reason == HaltReason.HALTED
+    assert result.instructions == 7
+    assert result.cycles == cycles == 7 * 5 + 2
+    assert cpu.dump_regs() == stepped.dump_regs()
+    assert cpu.next_instruction == stepped.next_instruction
+
+
+def test_clocked_run_cycle_budget():
+    cpu = build_cpu(CPUClocked, loop_program())
+
+    # stops two stages into the third instruction
+    result = cpu.run(max_cycles=12)
+    assert result.reason == HaltReason.CYCLE_LIMIT
+    assert result.instructions == 2
+    assert result.cycles == 12
+    assert cpu.cur_state == CPUStates.EXECUTE.value
+
+    result = cpu.run()
+    assert result.reason == HaltReason.HALTED
+    assert result.instructions == 5
+    assert result.cycles == 3 + 4 * 5 + 2
+    assert cpu.read_register(1) == 3
+
+
+class RecordingDevice(Memory):
+    """Test device that remembers writes and reads back addr * 10"""
+    def __init__(self):
+        self.writes: list[tuple[int, int]] = []
+
+    def write_addr(self, addr: int, value: int) -> None:
+        self.writes.append((addr, value))
+
+    def read_addr(self, addr: int) -> int:
+        return addr * 10
+
+
+def test_bus_boundary_consistent():
+    ram = RAM(100)
+    device = RecordingDevice()
+    bus = Bus(ram, 99, device)
+
+    # reads and writes agree that max_ram_addr is the first mmio address
+    bus.write_addr(98, 1, Flags.MEM_WRITE_FLAG.value)
+    bus.write_addr(99, 2, Flags.MEM_WRITE_FLAG.value)
+    assert bus.read_addr(98) == 1
+    assert bus.read_addr(99) == 0
+    assert bus.read_addr(100) == 10
+    assert device.writes == [(0, 2)]
+    assert ram.read_addr(99) == 0
+
+
+def test_bus_multiple_devices():
+    ram = RAM(64)
+    timer = RecordingDevice()
+    console = RecordingDevice()
+    bus = Bus(ram)
+    bus.map_device(128, 4, timer)
+    bus.map_device(130 + 64, 2, console)
+
+    bus.write_addr(129, 5, Flags.MEM_WRITE_FLAG.value)
+    bus.write_addr(195, 6, Flags.MEM_WRITE_FLAG.value)
+    assert timer.writes == [(1, 5)]
+    assert console.writes == [(1, 6)]
+    assert bus.read_addr(131) == 30
+    assert [base for base, _, _ in bus.devices] == [0, 128, 194]
+
+    for addr in (-1, 64, 132, 196):
+        with pytest.raises(ValueError):
+            bus.read_addr(addr)
+    with pytest.raises(ValueError):
+        bus.map_device(120, 10, RecordingDevice())
+
+
+def test_bus_map_device_updates_only_its_pages():
+    ram = PagedRAM(1 << 24)
+    bus = Bus(ram, page_shift=6)
+    before = list(bus._pages)
+    device = RecordingDevice()
+    bus.map_device((1 << 24) + 100, 50, device)
+
+    # ram pages are untouched, the new range starts part way into a page
+    assert len(bus._pages) == ((1 << 24) + 150 + 63) >> 6
+    assert all(a is b for a, b in zip(before, bus._pages))
+    assert bus.read_addr((1 << 24) + 149) == 490
+    for addr in ((1 << 24) + 99, (1 << 24) + 150):
+        with pytest.raises(ValueError):
+            bus.read_addr(addr)
+    ram.write_addr((1 << 24) - 1, 7)
+    assert bus.read_addr((1 << 24) - 1) == 7
+
+
+def test_stdout_capture():
+    std_out = STDOut(capture=True)
+    bus = Bus(RAM(10), 10, std_out)
+
+    for c in b"hi\n":
+        bus.write_addr(10, c, Flags.MEM_WRITE_FLAG.value)
+    bus.write_addr(11, 0, Flags.MEM_WRITE_FLAG.value)
+    bus.write_addr(10, ord("!") | 0x100, Flags.MEM_WRITE_FLAG.value)
+
+    assert std_out.getvalue() == b"hi\n!"
+
+
+def test_stdout_stream_threshold():
+    stream = io.BytesIO()
+    std_out = STDOut(stream=stream, flush_threshold=4)
+
+    for c in b"abcdef":
+        std_out.write_addr(0, c)
+    assert stream.getvalue() == b"abcd"
+    std_out.write_addr(1, 0)
+    assert stream.getvalue() == b"abcdef"
+
+
+def test_stdout_fd():
+    read_fd, write_fd = os.pipe()
+    std_out = STDOut(fd=write_fd)
+
+    for c in b"ok":
+        std_out.write_addr(0, c)
+    std_out.flush()
+    os.close(write_fd)
+
+    assert os.read(read_fd, 10) == b"ok"
+    os.close(read_fd)
+
+
+def test_stdin_registers():
+    std_in = STDIn(io.BytesIO(b"\x00\x00\x01\x00\xff\xff\xff\xfeAB"), buffer_size=3)
+
+    assert std_in.read_addr(0) == 3
+    assert std_in.read_addr(2) == 256
+    assert std_in.read_addr(2) == -2
+    assert std_in.read_addr(1) == ord("A")
+    assert std_in.read_addr(2) == ord("B") << 24
+    assert std_in.read_addr(0) == 0
+    assert std_in.read_addr(1) == -1
+    assert std_in.read_addr(2) == -1
+
+
+def test_stdin_guest_sums_words():
+    words = list(range(1, 101))
+    data = b"".join(w.to_bytes(4, "big") for w in words)
+    program = [
+        i_type(Instructions.ADDI, 4, 0, 50), # r4 = stdin base
+        lw(3, 4, 0), # r3 = bytes available
+        b_type(Instructions.BEQ, 3, 0, 4), # done when input is exhausted
+        lw(3, 4, 2), # r3 = next word
+        r_type(Instructions.ADD, 2, 2, 3), # r2 += r3
+        b_type(Instructions.BEQ, 0, 0, -4),
+        0,
+    ]
+    ram = RAM(50)
+    for i, instr in enumerate(program):
+        ram.write_addr(i, instr)
+    cpu = CPUClocked(num_registers=32, bus=Bus(ram, 50, STDIn(io.BytesIO(data), buffer_size=64)))
+
+    assert cpu.run().reason == HaltReason.HALTED
+    assert cpu.read_register(2) == sum(words)
+
+
+def make_mapped_ram(tmp_path):
+    # image covers the first 10 words so ranges cross into the anonymous tail
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes(40))
+    ram = MappedRAM(40)
+    ram.load_file(str(image))
+    return ram
+
+
+@pytest.mark.parametrize("make_ram", [
+    lambda tmp_path: RAM(40),
+    lambda tmp_path: ArrayRAM(40),
+    make_mapped_ram,
+    lambda tmp_path: PagedRAM(40, page_shift=2),
+])
+def test_ram_bulk_words(tmp_path, make_ram):
+    ram = make_ram(tmp_path)
+    ram.write_words(3, list(range(1, 13)))
+    assert list(ram.read_words(0, 16)) == [0, 0, 0] + list(range(1, 13)) + [0]
+
+    # overlapping copy forwards and backwards
+    ram.copy_words(3, 5, 12)
+    assert list(ram.read_words(3, 14)) == [1, 2] + list(range(1, 13))
+    ram.copy_words(5, 3, 12)
+    assert list(ram.read_words(3, 12)) == list(range(1, 13))
+    assert ram.read_addr(14) == 12
+
+    with pytest.raises(ValueError):
+        ram.read_words(35, 10)
+    with pytest.raises(ValueError):
+        ram.write_words(-1, [1])
+
+
+def test_dma_guest_copy_invalidates_decode_cache():
+    program = [
+        i_type(Instructions.ADDI, 4, 0, 50), # r4 = dma base
+        i_type(Instructions.ADDI, 1, 1, 1), # r1 += 1, overwritten by the copy
+        i_type(Instructions.ADDI, 2, 0, 20),
+        sw(4, 2, 0), # src = 20
+        i_type(Instructions.ADDI, 2, 0, 1),
+        sw(4, 2, 1), # dst = 1
+        sw(4, 2, 2), # length = 1
+        sw(4, 2, 3), # control = mem to mem
+        b_type(Instructions.BEQ, 1, 2, -7), # run the copied instruction once
+        0,
+    ]
+    ram = RAM(50)
+    for i, instr in enumerate(program):
+        ram.write_addr(i, instr)
+    ram.write_addr(20, i_type(Instructions.ADDI, 1, 1, 10))
+    dma = DMA(ram)
+    cpu = CPU(num_registers=32, bus=Bus(ram, 50, dma))
+
+    assert cpu.run().reason == HaltReason.HALTED
+    assert cpu.read_register(1) == 11
+    assert dma.read_addr(4) == 1
+
+
+def test_dma_host_file(tmp_path):
+    path = tmp_path / "disk.bin"
+    path.write_bytes(b"".join(x.to_bytes(4, "big", signed=True) for x in [7, -8, 9]) + b"\x01")
+    ram = ArrayRAM(10)
+    dma = DMA(ram, str(path))
+
+    for addr, value in [(0, 0), (1, 2), (2, 10), (3, DMA_FILE_TO_MEM)]:
+        dma.write_addr(addr, value)
+    assert dma.read_addr(4) == 3
+    assert list(ram.read_words(2, 3)) == [7, -8, 9]
+
+    ram.write_addr(5, 42)
+    for addr, value in [(0, 2), (1, 4), (2, 4), (3, DMA_MEM_TO_FILE)]:
+        dma.write_addr(addr, value)
+    dma.close()
+    data = path.read_bytes()
+    assert [int.from_bytes(data[i:i + 4], "big", signed=True) for i in range(0, len(data), 4)] == [7, -8, 9, 1 << 24, 7, -8, 9, 42]
+
+    with pytest.raises(ValueError):
+        DMA(ram).write_addr(3, DMA_FILE_TO_MEM)
@@ -1,4 +1,4 @@
-from cpu import RAM, Bus, CPUClocked, CPUStates, STDOut
+from cpu import RAM, Bus, CPUClocked, STDOut
 
 STACK_ADDR = 2500
 MAX_RAM_ADDR = 3000
@@ -12,10 +12,8 @@ def main():
     cpu = CPUClocked(num_registers=32, bus=bus)
 
     cpu.set_register(30, STACK_ADDR)
-    while True:
-        state = cpu.cycle()
-        if state == CPUStates.STOPPED.value:
-            break
+    cpu.run()
+    print("r2 =", cpu.read_register(2))
 
 if __name__ == "__main__":
     main()
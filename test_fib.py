@@ -1,4 +1,4 @@
-from cpu import RAM, Bus, CPUClocked, CPUStates
+from cpu import RAM, Bus, CPUClocked
 
 def main():
 
@@ -10,10 +10,7 @@ def main():
     cpu = CPUClocked(num_registers=32, bus=bus)
 
 
-    while True:
-        state = cpu.cycle()
-        if state == CPUStates.STOPPED.value:
-            break
+    cpu.run()
 
     T1_INDEX = 6
     result = cpu.read_register(T1_INDEX)
@@ -1,4 +1,4 @@
-from cpu import RAM, Bus, CPUClocked, CPUStates, STDOut
+from cpu import RAM, Bus, CPUClocked, STDOut
 
 def main():
     ram = RAM(size=256)
@@ -8,10 +8,7 @@ def main():
     bus = Bus(random_access_memory=ram, max_ram_addr=256, memory_mapped_io=mmio)
     cpu = CPUClocked(num_registers=32, bus=bus)
 
-    while True:
-        state = cpu.cycle()
-        if state == CPUStates.STOPPED.value:
-            break
+    cpu.run()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,89 @@
+import pytest
+
+from cpu import RAM, CPU, CPUClocked, HaltReason, STDOut
+from fixtures import build
+from hostcall import HostCallPort, HOSTCALL_MEMCPY, HOSTCALL_MEMSET, HOSTCALL_PRINT_INT, HOSTCALL_FACTORIAL
+from instructions import Instructions, i_type, r_type, sw
+from pipeline import CPUPipelined
+from translator import CPUTranslated
+
+PORT_BASE = 60
+
+
+def call_program(number: int) -> list[int]:
+    return [
+        i_type(Instructions.ADDI, 10, 0, PORT_BASE), # r10 = port base
+        i_type(Instructions.ADDI, 5, 0, number),
+        sw(10, 5, 0), # host call
+        0,
+    ]
+
+
+def build_with_port(cpu_class, program: list[int], std_out: STDOut | None = None):
+    ram = RAM(PORT_BASE)
+    port = HostCallPort(ram, std_out)
+    cpu = build(cpu_class, program, ram=ram, mmio=port)
+    port.attach(cpu)
+    return cpu, ram, port
+
+
+@pytest.mark.parametrize("cpu_class", [CPU, CPUClocked, CPUTranslated, CPUPipelined])
+def test_factorial(cpu_class):
+    cpu, _, port = build_with_port(cpu_class, call_program(HOSTCALL_FACTORIAL))
+    cpu.set_register(1, 20)
+
+    assert cpu.run().reason == HaltReason.HALTED
+    assert cpu.read_register(1) == 2432902008176640000
+    assert port.calls == 1
+
+
+@pytest.mark.parametrize("cpu_class", [CPU, CPUClocked, CPUTranslated, CPUPipelined])
+def test_next_instruction_sees_call_result(cpu_class):
+    program = call_program(HOSTCALL_FACTORIAL)
+    # reads r1 right after the call
+    program[3:] = [r_type(Instructions.ADD, 6, 1, 0), 0]
+    cpu, _, _ = build_with_port(cpu_class, program)
+    cpu.set_register(1, 5)
+
+    assert cpu.run().reason == HaltReason.HALTED
+    assert cpu.read_register(6) == 120
+
+
+def test_memcpy_and_memset():
+    cpu, ram, _ = build_with_port(CPUClocked, call_program(HOSTCALL_MEMCPY))
+    ram.write_words(20, [1, 2, 3, 4])
+    cpu.set_register(1, 30)
+    cpu.set_register(2, 20)
+    cpu.set_register(3, 4)
+    cpu.run()
+    assert ram.read_words(30, 4) == [1, 2, 3, 4]
+    assert cpu.read_register(1) == 30
+
+    cpu, ram, _ = build_with_port(CPUClocked, call_program(HOSTCALL_MEMSET))
+    cpu.set_register(1, 40)
+    cpu.set_register(2, -7)
+    cpu.set_register(3, 3)
+    cpu.run()
+    assert ram.read_words(39, 5) == [0, -7, -7, -7, 0]
+
+
+def test_print_int_to_stdout_device():
+    std_out = STDOut(capture=True)
+    cpu, _, _ = build_with_port(CPUClocked, call_program(HOSTCALL_PRINT_INT), std_out)
+    cpu.set_register(1, -1234)
+    cpu.run()
+
+    assert std_out.getvalue() == b"-1234"
+
+
+def test_custom_and_unknown_calls():
+    cpu, _, port = build_with_port(CPUClocked, call_program(9))
+    port.register(9, lambda port, a, b, c: a + b + c)
+    for register in (1, 2, 3):
+        cpu.set_register(register, register)
+    cpu.run()
+    assert cpu.read_register(1) == 6
+
+    cpu, _, _ = build_with_port(CPUClocked, call_program(10))
+    with pytest.raises(ValueError):
+        cpu.run()
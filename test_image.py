@@ -0,0 +1,94 @@
+import pytest
+
+from assembler import assembler_assemble
+from cpu import RAM, ArrayRAM, MappedRAM, PagedRAM, Bus, CPU, CPUClocked, DecodeCache, HaltReason
+from image import Image, Section, is_image, IMAGE_MAGIC
+from instructions import Instructions, decode_instruction, i_type
+from runner import Job, run_job
+
+
+def test_round_trip(tmp_path):
+    image = Image([Section(".text", 0, [i_type(Instructions.ADDI, 1, 0, 5), 0]), Section(".data", 40, [-1, 1 << 31, 3])],
+                  entry=1, symbols={"MAIN": 1, "VALUES": 40})
+    path = tmp_path / "prog.bin"
+    image.save(str(path))
+    assert is_image(str(path))
+
+    loaded = Image.load(str(path))
+    assert [(section.name, section.base, list(section.words)) for section in loaded.sections] == \
+        [(".text", 0, [i_type(Instructions.ADDI, 1, 0, 5), 0]), (".data", 40, [-1, -(1 << 31), 3])]
+    assert (loaded.entry, loaded.symbols, loaded.end) == (1, {"MAIN": 1, "VALUES": 40}, 43)
+
+    # the flat layout fills the gap between the sections with zeroes
+    assert len(image.to_flat_bytes()) == 4 * 43
+    assert not is_image("test.bin")
+
+
+def test_rejects_bad_images():
+    with pytest.raises(ValueError):
+        Image.from_bytes(IMAGE_MAGIC)
+    data = Image([Section(".text", 0, [1, 2]), Section(".data", 8, [3])], 0, {"MAIN": 0}).to_bytes()
+    # cut anywhere, in the header, section table, symbol table or words
+    for length in range(len(data)):
+        with pytest.raises(ValueError):
+            Image.from_bytes(data[:length])
+    with pytest.raises(ValueError):
+        Section(".toolongname", 0, [])
+
+
+# a flat image can never start with the magic, since its first word is the first instruction
+def test_magic_is_not_an_instruction():
+    with pytest.raises(ValueError):
+        decode_instruction(int.from_bytes(IMAGE_MAGIC, "big"))
+
+
+@pytest.mark.parametrize("ram_class", [RAM, ArrayRAM, MappedRAM, PagedRAM])
+def test_load_sections(tmp_path, ram_class):
+    path = tmp_path / "prog.bin"
+    Image([Section(".text", 0, [7, 8]), Section(".data", 30, [9, -2])]).save(str(path))
+    ram = ram_class(64)
+    cache = DecodeCache()
+    ram.attach_decode_cache(cache)
+    cache.insert(30, 0, (0, 0, 0, 0, 0))
+
+    image = ram.load_file(str(path))
+    assert image.section(".data").base == 30
+    assert list(ram.read_words(0, 3)) == [7, 8, 0]
+    assert list(ram.read_words(30, 2)) == [9, -2]
+    assert cache.lookup(30) is None
+
+    with pytest.raises(ValueError):
+        ram_class(31).load_file(str(path))
+
+
+def test_mapped_ram_persist_needs_flat_image(tmp_path):
+    path = tmp_path / "prog.bin"
+    Image([Section(".text", 0, [1])]).save(str(path))
+    with pytest.raises(ValueError):
+        MappedRAM(8, persist=True).load_file(str(path))
+
+
+@pytest.mark.parametrize("cpu_class", [CPU, CPUClocked])
+def test_assembled_program_runs(tmp_path, cpu_class):
+    with open("Fibsq.asm") as f:
+        image = assembler_assemble(f)
+    path = tmp_path / "fib.bin"
+    image.save(str(path))
+    # the whole program fits in far less than the old fixed 2000 word layout
+    assert path.stat().st_size < 200
+
+    ram = RAM(64)
+    ram.load_file(str(path))
+    cpu = cpu_class(num_registers=32, bus=Bus(ram))
+    assert cpu.run().reason == HaltReason.HALTED
+    assert cpu.read_register(6) == 55
+
+
+def test_job_starts_at_entry(tmp_path):
+    lines = [".entry MAIN", "ADDI r1, zero, 1", "MAIN: ADDI r2, zero, x", "LW r3, 0(r2)", ".data", "x: 42"]
+    path = tmp_path / "entry.bin"
+    assembler_assemble(lines).save(str(path))
+
+    result = run_job(0, Job(str(path), ram_size=16))
+    assert result.error is None
+    assert result.registers[1:4] == [0, 4, 42]
@@ -1,5 +1,9 @@
+import random
 from enum import Enum
-from instructions import Instructions, Flags, decode_instruction
+
+import pytest
+
+from instructions import Instructions, Flags, decode_instruction, decode_instruction_table, OPCODE_MASK, r_type, i_type, b_type, lw, jal
 
 class InstructionsStrings(Enum):
     NO_OP = "00000_00"
@@ -357,3 +361,42 @@ def test_lw():
     assert rd_addr == int(rd, 2)
     assert rs1_addr == int(rs1, 2)
     assert imm == int(imm_src, 2)
+
+
+def test_decode_table_matches_reference():
+    rng = random.Random(220)
+    # every opcode with edge case fields, then random words with that opcode
+    fields = [0, 0xFFFFFFFF & ~OPCODE_MASK, 1 << 30, 1 << 29, 1 << 18, 0x7FF << 19] + [rng.getrandbits(32) & ~OPCODE_MASK for _ in range(500)]
+    for opcode in range(OPCODE_MASK + 1):
+        for field_bits in fields:
+            instr = field_bits | opcode
+            try:
+                expected = decode_instruction(instr)
+            except ValueError:
+                with pytest.raises(ValueError):
+                    decode_instruction_table(instr)
+                continue
+            assert decode_instruction_table(instr) == expected, f"0x{instr:08X}"
+
+
+@pytest.mark.parametrize("imm", [-1024, -1, 0, 1, 1023])
+def test_encoded_imm_round_trips(imm):
+    _, rd_addr, rs1_addr, _, decoded = decode_instruction(i_type(Instructions.ADDI, 31, 17, imm))
+    assert (rd_addr, rs1_addr, decoded) == (31, 17, imm)
+
+
+@pytest.mark.parametrize("imm", [-(1 << 23), -5, 5, (1 << 23) - 1])
+def test_encoded_jal_round_trips(imm):
+    assert decode_instruction(jal(imm))[-1] == imm
+
+
+@pytest.mark.parametrize("build", [
+    lambda: i_type(Instructions.ADDI, 1, 0, 1024),
+    lambda: b_type(Instructions.BEQ, 0, 0, -1025),
+    lambda: jal(1 << 23),
+    lambda: r_type(Instructions.ADD, 32, 0, 0),
+    lambda: lw(1, -1, 0),
+])
+def test_encode_out_of_range(build):
+    with pytest.raises(ValueError):
+        build()
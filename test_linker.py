@@ -0,0 +1,149 @@
+import pytest
+
+import assembler
+from assembler import assembler_assemble, assembler_assemble_object, assembler_assemble_object_file
+from cpu import RAM, Bus, CPUClocked, HaltReason
+from linker import ObjectFile, link, RELOC_BRANCH, RELOC_DATA, RELOC_JAL
+
+MAIN = """
+.entry MAIN
+.global MAIN
+MAIN:
+    ADDI r30, zero, 60
+    LW r1, n(zero)          # this module's .data
+    JAL FACT                # imported from lib
+    SW zero, result(r2)
+    LW r3, scale(zero)      # .data imported from lib
+    MUL r2, r2, r3
+    BNE r2, zero, DONE
+DONE:
+.data
+n: 5
+result: 0
+"""
+
+LIB = """
+.global FACT, SCALE
+FACT:
+    ADDI r2, zero, 1
+LOOP:
+    BEQ r1, zero, RETURN
+    MUL r2, r2, r1
+    ADDI r1, r1, -1
+    BEQ zero, zero, LOOP
+RETURN:
+    ADD r29, zero, r31
+.data
+pad: 9 9
+scale: 2
+"""
+
+
+def modules() -> list[ObjectFile]:
+    return [assembler_assemble_object(MAIN.splitlines(), "main"), assembler_assemble_object(LIB.splitlines(), "lib")]
+
+
+def run(image) -> tuple[CPUClocked, RAM]:
+    ram = RAM(64)
+    for section in image.sections:
+        ram.write_words(section.base, section.words)
+    cpu = CPUClocked(num_registers=32, bus=Bus(ram))
+    cpu.next_instruction = image.entry or 0
+    assert cpu.run(max_instructions=500).reason == HaltReason.HALTED
+    return cpu, ram
+
+
+def test_object_relocations():
+    main, lib = modules()
+    assert main.imports == {"FACT", "SCALE"} and main.exports == {"MAIN"}
+    assert sorted((reloc.kind, reloc.offset, reloc.symbol) for reloc in main.relocations) == [
+        (RELOC_JAL, 2, "FACT"),
+        (RELOC_DATA, 1, None),
+        (RELOC_DATA, 3, None),
+        (RELOC_DATA, 4, "SCALE"),
+    ]
+    # branches inside a module are resolved when it is assembled
+    assert lib.relocations == [] and lib.symbols["SCALE"] == (".data", 2)
+
+
+def test_link_and_run():
+    image = link(modules())
+    assert image.entry == 0
+    assert image.symbols["FACT"] == 8 and image.symbols["SCALE"] == 15 + 4
+    assert image.symbols["main.RESULT"] == 16 and image.symbols["lib.LOOP"] == 9
+
+    cpu, ram = run(image)
+    assert cpu.read_register(2) == 240
+    assert ram.read_addr(image.symbols["main.RESULT"]) == 120
+
+
+def test_link_order_and_object_files(tmp_path):
+    main, lib = modules()
+    lib.save(str(tmp_path / "lib.o"))
+    # the library first, so every relocated address moves
+    image = link([ObjectFile.load(str(tmp_path / "lib.o")), main])
+    assert image.entry == image.symbols["MAIN"] == 7
+    cpu, _ = run(image)
+    assert cpu.read_register(2) == 240
+
+
+def test_single_module_matches_assembler():
+    with open("fact.asm") as f:
+        source = f.readlines()
+    assert link([assembler_assemble_object(source)]).to_bytes() == assembler_assemble(source).to_bytes()
+
+
+@pytest.mark.parametrize("sources, entry", [
+    ([MAIN], None),  # FACT and SCALE are never defined
+    ([MAIN, LIB, ".global FACT\nFACT: NO_OP"], None),  # FACT exported twice
+    ([MAIN, LIB, ".entry OTHER\nOTHER: NO_OP"], None),  # two entry points
+    ([MAIN, LIB], "LOOP"),  # entry symbol that is not exported
+])
+def test_link_errors(sources, entry):
+    objects = [assembler_assemble_object(source.splitlines()) for source in sources]
+    with pytest.raises(ValueError):
+        link(objects, entry=entry)
+
+
+def test_undefined_export():
+    with pytest.raises(ValueError):
+        assembler_assemble_object([".global MISSING", "NO_OP"])
+
+
+def test_only_changed_modules_are_assembled(tmp_path, monkeypatch):
+    (tmp_path / "main.asm").write_text(MAIN)
+    (tmp_path / "lib.asm").write_text(LIB)
+    cache_dir = str(tmp_path / "cache")
+    paths = [str(tmp_path / "main.asm"), str(tmp_path / "lib.asm")]
+    first = link([assembler_assemble_object_file(path, cache_dir=cache_dir) for path in paths])
+
+    parsed = []
+    assemble_object = assembler.assembler_assemble_object
+    def counting(lines, name=None):
+        parsed.append(name)
+        return assemble_object(lines, name)
+    monkeypatch.setattr(assembler, "assembler_assemble_object", counting)
+
+    (tmp_path / "lib.asm").write_text(LIB.replace("scale: 2", "scale: 3"))
+    second = link([assembler_assemble_object_file(path, cache_dir=cache_dir) for path in paths])
+    assert parsed == ["lib"]
+    assert second.symbols == first.symbols
+    assert run(second)[0].read_register(2) == 360
+
+
+def test_truncated_object_file(tmp_path):
+    main, _ = modules()
+    data = main.to_bytes()
+    # cut anywhere, in the header, strings, tables or words
+    for length in range(len(data)):
+        with pytest.raises(ValueError):
+            ObjectFile.from_bytes(data[:length])
+
+    # a truncated cache entry is assembled again
+    (tmp_path / "main.asm").write_text(MAIN)
+    cache_dir = tmp_path / "cache"
+    assembler_assemble_object_file(str(tmp_path / "main.asm"), cache_dir=str(cache_dir))
+    (entry,) = cache_dir.iterdir()
+    entry.write_bytes(data[:len(data) // 2])
+    rebuilt = assembler_assemble_object_file(str(tmp_path / "main.asm"), cache_dir=str(cache_dir))
+    assert rebuilt.to_bytes() == data
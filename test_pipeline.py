@@ -0,0 +1,129 @@
+import random
+
+import pytest
+
+from cpu import CPUClocked, HaltReason
+from instructions import Instructions, r_type, i_type, b_type, lw, sw
+from pipeline import CPUPipelined
+from fixtures import fib_program, fact_program, build
+
+
+def assert_same_as_clocked(program: list[int], registers: dict[int, int] | None = None, ram_size: int = 100) -> CPUPipelined:
+    clocked = build(CPUClocked, program, ram_size)
+    pipelined = build(CPUPipelined, program, ram_size)
+    for register, value in (registers or {}).items():
+        clocked.set_register(register, value)
+        pipelined.set_register(register, value)
+
+    assert clocked.run().reason == HaltReason.HALTED
+    result = pipelined.run()
+    assert result.reason == HaltReason.HALTED
+    assert pipelined.dump_regs() == clocked.dump_regs()
+    assert pipelined.next_instruction == clocked.next_instruction
+    assert pipelined._bus.ram.memory == clocked._bus.ram.memory
+    assert result.instructions == pipelined.retired
+    return pipelined
+
+
+def test_fib():
+    cpu = assert_same_as_clocked(fib_program(9))
+    assert cpu.read_register(6) == 55
+    # the loop branch is taken 8 times, each flushing two fetched instructions
+    assert cpu.flushes == 8
+    assert cpu.cycles == 48 + 2 * 8 + 5
+    assert cpu.cpi < 1.5
+
+
+def test_fact():
+    cpu = assert_same_as_clocked(fact_program(5), {30: 50})
+    assert cpu.read_register(2) == 120
+
+
+def test_load_use_stall():
+    program = [
+        i_type(Instructions.ADDI, 1, 0, 7),
+        sw(0, 1, 40), # mem[40] = 7
+        lw(2, 0, 40), # r2 = mem[40]
+        r_type(Instructions.ADD, 3, 2, 2), # needs r2 right away
+        r_type(Instructions.ADD, 4, 3, 2), # forwarded from EX/MEM and MEM/WB
+        0,
+    ]
+    cpu = assert_same_as_clocked(program)
+    assert cpu.read_register(4) == 21
+    assert cpu.stalls == 1
+
+
+@pytest.mark.parametrize("imm", [3, 5])
+def test_immediate_is_not_a_load_use(imm):
+    # the immediate's low bits sit in the rs2 field, imm = 3 names the loaded register there
+    cpu = assert_same_as_clocked([lw(3, 0, 20), i_type(Instructions.ADDI, 4, 2, imm), 0])
+    assert cpu.stalls == 0
+    assert cpu.cycles == 7
+
+    # rs1 is still a real dependency
+    cpu = assert_same_as_clocked([lw(3, 0, 20), i_type(Instructions.ADDI, 4, 3, imm), 0])
+    assert cpu.stalls == 1
+    assert cpu.cycles == 8
+
+
+def test_load_into_pc_register():
+    program = [
+        i_type(Instructions.ADDI, 1, 0, 4),
+        sw(0, 1, 40), # mem[40] = 4
+        lw(29, 0, 40), # jump to 4
+        i_type(Instructions.ADDI, 2, 0, 1), # skipped
+        i_type(Instructions.ADDI, 3, 0, 1),
+        0,
+    ]
+    cpu = assert_same_as_clocked(program)
+    assert (cpu.read_register(2), cpu.read_register(3)) == (0, 1)
+
+
+def test_store_into_fetched_instruction():
+    program = [
+        i_type(Instructions.ADDI, 1, 0, 0),
+        sw(0, 1, 2), # overwrite the next instruction with a NO_OP
+        i_type(Instructions.ADDI, 2, 0, 1),
+        0,
+    ]
+    cpu = assert_same_as_clocked(program)
+    assert cpu.read_register(2) == 0
+
+
+def test_run_budgets():
+    cpu = build(CPUPipelined, fib_program(9))
+    result = cpu.run(max_instructions=10)
+    assert (result.reason, result.instructions) == (HaltReason.INSTRUCTION_LIMIT, 10)
+    result = cpu.run(max_cycles=3)
+    assert (result.reason, result.cycles) == (HaltReason.CYCLE_LIMIT, 3)
+    assert cpu.run().reason == HaltReason.HALTED
+    assert cpu.read_register(6) == 55
+
+
+def random_program(rng: random.Random, length: int) -> list[int]:
+    # straight line code with loads, stores and forward branches, r9 holds the data base
+    program = [i_type(Instructions.ADDI, 9, 0, 60)]
+    ops = [Instructions.ADD, Instructions.SUB, Instructions.MUL, Instructions.SLT]
+    branches = [Instructions.BEQ, Instructions.BNE, Instructions.BGE, Instructions.BLT]
+    for index in range(1, length):
+        kind = rng.randrange(6)
+        rd, rs1, rs2 = rng.randrange(1, 9), rng.randrange(0, 9), rng.randrange(0, 9)
+        if kind == 0:
+            program.append(r_type(rng.choice(ops), rd, rs1, rs2))
+        elif kind == 1:
+            program.append(i_type(Instructions.ADDI, rd, rs1, rng.randrange(-5, 6)))
+        elif kind == 2:
+            program.append(lw(rd, 9, rng.randrange(8)))
+        elif kind == 3:
+            program.append(sw(9, rs1, rng.randrange(8)))
+        elif kind == 4:
+            program.append(b_type(rng.choice(branches), rs1, rs2, rng.randrange(1, min(4, length - index) + 1)))
+        else:
+            program.append(r_type(Instructions.ADD, rd, rd, rs1))
+    return program + [0]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_random_programs(seed):
+    rng = random.Random(seed)
+    assert_same_as_clocked(random_program(rng, 40), {register: rng.randrange(-3, 4) for register in range(1, 9)})
@@ -0,0 +1,88 @@
+import pytest
+
+from assembler import assembler_assemble, assembler_source_map
+from cpu import CPU, CPUClocked, HaltReason
+from profiler import Profiler, STAGE_NAMES
+from fixtures import fib_program, fact_program, build
+
+
+@pytest.mark.parametrize("cpu_class, cycles_per_instruction", [(CPU, 1), (CPUClocked, 5)])
+def test_fib_counts(cpu_class, cycles_per_instruction):
+    profiler = Profiler(16)
+    cpu = build(cpu_class, fib_program(9), profiler=profiler)
+
+    result = cpu.run()
+    assert result.reason == HaltReason.HALTED
+    assert cpu.read_register(6) == 55
+    assert profiler.instructions == result.instructions == 3 + 9 * 5
+    assert list(profiler.counts[:9]) == [1, 1, 1, 9, 9, 9, 9, 9, 0]
+    assert profiler.cycles[3] == 9 * cycles_per_instruction
+    # the loop branch is taken every time but the last
+    assert (profiler.taken[7], profiler.not_taken[7]) == (8, 1)
+    assert profiler.hot_spots(1)[0] in range(3, 8)
+
+
+def test_clocked_stage_cycles_and_memory():
+    profiler = Profiler()
+    cpu = build(CPUClocked, fact_program(5), profiler=profiler)
+    cpu.set_register(30, 64)
+
+    result = cpu.run()
+    assert cpu.read_register(2) == 120
+    assert sum(profiler.stage_cycles) == result.cycles
+    assert profiler.stage_cycles[STAGE_NAMES.index("WB")] == result.instructions
+    # the stack lives in the region starting at 64
+    assert profiler.writes[1] == 8 and profiler.reads[1] == 10
+    assert profiler.reads[0] == profiler.writes[0] == 0
+
+
+def test_report_uses_source_map():
+    with open("fact.asm") as f:
+        source, labels = assembler_source_map(f.readlines())
+    assert labels["FACT"] == 5 and labels["END"] == 17
+    assert source[5][1] == "ADDI r2, zero, 1"
+
+    profiler = Profiler()
+    cpu = build(CPUClocked, fact_program(5), profiler=profiler)
+    cpu.set_register(30, 64)
+    cpu.run()
+
+    report = profiler.report(source, labels)
+    assert "[FACT]" in report
+    assert "ADDI r2, zero, 1" in report
+    assert "MUL" in report
+
+
+def test_source_map_matches_image_symbols():
+    lines = [
+        "# directives are not instructions",
+        ".entry main",
+        "main: ADDI r1, zero, 3",
+        "loop:",
+        "    ADDI r1, r1, -1",
+        "    BNE r1, zero, loop",
+        "end:",
+    ]
+    source, labels = assembler_source_map(lines)
+    image = assembler_assemble(lines)
+    assert labels == image.symbols == {"MAIN": 0, "LOOP": 1, "END": 3}
+    assert source == [(3, "main: ADDI r1, zero, 3"), (5, "ADDI r1, r1, -1"), (6, "BNE r1, zero, loop")]
+
+
+def test_source_map_skips_module_directives():
+    lines = [
+        ".global Fact, scale",
+        ".entry fact",
+        ".global done",
+        "fact: LW r1, scale(zero)",
+        "    JAL done",
+        "done: ADD r29, zero, r31",
+        ".data",
+        "scale: 2",
+    ]
+    source, labels = assembler_source_map(lines)
+    image = assembler_assemble(lines)
+    assert labels == {"FACT": 0, "DONE": 2}
+    assert all(image.symbols[label] == pc for label, pc in labels.items())
+    assert [number for number, _ in source] == [4, 5, 6]
+    assert source[labels["DONE"]][1] == "done: ADD r29, zero, r31"
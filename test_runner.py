@@ -0,0 +1,54 @@
+from instructions import Instructions, i_type, sw
+from runner import Job, run_job, run_jobs
+from fixtures import fact_program
+
+STACK_ADDR = 50
+MMIO_BASE = 90
+
+
+def write_image(path, program: list[int]) -> str:
+    path.write_bytes(b"".join(x.to_bytes(4, byteorder="big") for x in program))
+    return str(path)
+
+
+def hello_program() -> list[int]:
+    # writes "hi" to the STDOut device and flushes it
+    return [
+        i_type(Instructions.ADDI, 11, 0, MMIO_BASE),
+        i_type(Instructions.ADDI, 5, 0, ord("h")),
+        sw(11, 5, 0),
+        i_type(Instructions.ADDI, 5, 0, ord("i")),
+        sw(11, 5, 0),
+        sw(11, 5, 1),
+        0,
+    ]
+
+
+def test_run_jobs(tmp_path):
+    fact = write_image(tmp_path / "fact.bin", fact_program(5))
+    hello = write_image(tmp_path / "hello.bin", hello_program())
+    jobs = [
+        Job(fact, registers={30: STACK_ADDR}, ram_size=100),
+        Job(fact, registers={30: STACK_ADDR}, ram_size=100, engine="translated"),
+        Job(hello, ram_size=100, mmio_base=MMIO_BASE),
+        Job(str(tmp_path / "missing.bin")),
+    ]
+
+    results = sorted(run_jobs(jobs, max_workers=2), key=lambda result: result.index)
+
+    assert [result.index for result in results] == [0, 1, 2, 3]
+    assert results[0].registers[2] == 120
+    assert results[0].reason == "HALTED"
+    assert results[1].registers == results[0].registers
+    assert results[2].stdout == "hi"
+    assert results[3].registers is None
+    assert results[3].error.startswith("FileNotFoundError")
+
+
+def test_run_job_budget(tmp_path):
+    fact = write_image(tmp_path / "fact.bin", fact_program(5))
+
+    result = run_job(0, Job(fact, registers={30: STACK_ADDR}, ram_size=100, max_instructions=3))
+
+    assert result.reason == "INSTRUCTION_LIMIT"
+    assert result.instructions == 3
@@ -0,0 +1,124 @@
+import pytest
+
+from cpu import Bus, RAM, PagedRAM, CPU, CPUClocked, HaltReason, STDOut
+from instructions import Instructions, i_type, sw
+from fixtures import fib_program, build
+from snapshot import Snapshot
+
+
+@pytest.mark.parametrize("cpu_class", [CPU, CPUClocked])
+def test_restore_replays_the_same_run(cpu_class):
+    cpu = build(cpu_class, fib_program(9))
+    # stop part way through an instruction on the clocked cpu
+    cpu.run(max_cycles=23)
+    snapshot = cpu.snapshot()
+
+    cpu.run()
+    expected = cpu.dump_regs()
+    assert cpu.read_register(6) == 55
+
+    cpu.restore(snapshot)
+    assert cpu.cur_state == snapshot.cpu.get("state", cpu.cur_state)
+    assert cpu.run().reason == HaltReason.HALTED
+    assert cpu.dump_regs() == expected
+
+
+def test_pages_shared_between_snapshots():
+    ram = PagedRAM(1 << 14)
+    cpu = CPUClocked(num_registers=32, bus=Bus(ram, None, None))
+    first = cpu.snapshot()
+
+    ram.write_addr(1000, 5)
+    second = cpu.snapshot()
+
+    changed = [index for index, (a, b) in enumerate(zip(first.pages, second.pages)) if a is not b]
+    assert changed == [1000 >> first.page_shift]
+    assert ram.resident_pages == 1
+
+    cpu.restore(first)
+    assert ram.read_addr(1000) == 0
+
+
+def test_sparse_ram_snapshot_stays_sparse():
+    ram = PagedRAM(1 << 24)
+    cpu = CPUClocked(num_registers=32, bus=Bus(ram, None, None))
+    ram.write_addr(5000, 7)
+    snapshot = cpu.snapshot()
+
+    # every untouched page is one shared tuple
+    assert len({id(page) for page in snapshot.pages}) == 2
+    # only the written page is stored
+    assert len(snapshot.to_bytes()) < 2048
+    assert ram.resident_pages == 1
+
+    ram.write_addr(5000, 0)
+    ram.write_addr(1 << 23, 9)
+    cpu.restore(Snapshot.from_bytes(snapshot.to_bytes()))
+    assert ram.read_addr(5000) == 7
+    assert ram.read_addr(1 << 23) == 0
+
+
+def test_restore_reverts_ram_and_devices(tmp_path):
+    program = [
+        i_type(Instructions.ADDI, 1, 0, 72),
+        sw(0, 1, 40), # mem[40] = 72
+        sw(0, 1, 50), # stdout <- 72
+        0,
+    ]
+    ram = RAM(50)
+    ram.write_words(0, program)
+    std_out = STDOut(capture=True)
+    cpu = CPUClocked(num_registers=32, bus=Bus(ram, 50, std_out))
+    snapshot = cpu.snapshot()
+    cpu.run()
+    assert ram.read_addr(40) == 72
+    assert std_out.getvalue() == b"H"
+
+    cpu.restore(snapshot)
+    assert ram.read_addr(40) == 0
+    assert std_out.getvalue() == b""
+    assert cpu.read_register(1) == 0
+    assert cpu.next_instruction == 0
+
+    # a saved snapshot restores onto a freshly built machine
+    path = tmp_path / "machine.snap"
+    cpu.run(max_instructions=2)
+    cpu.snapshot().save(str(path))
+
+    ram = RAM(50)
+    fresh_out = STDOut(capture=True)
+    fresh = CPUClocked(num_registers=32, bus=Bus(ram, 50, fresh_out))
+    fresh.restore(Snapshot.load(str(path)))
+    assert ram.read_words(0, 4) == program
+    assert fresh.run().instructions == 1
+    assert ram.read_addr(40) == 72
+    assert fresh_out.getvalue() == b"H"
+
+
+def test_restore_rejects_other_ram_sizes():
+    snapshot = build(CPU, fib_program(3), ram_size=100).snapshot()
+    with pytest.raises(ValueError):
+        build(CPU, fib_program(3), ram_size=5000).restore(snapshot)
+
+
+def test_snapshot_file_round_trip():
+    # plain RAM and registers hold python ints of any size
+    ram = RAM(300)
+    ram.write_words(0, [i_type(Instructions.ADDI, 1, 0, 3), 0])
+    ram.write_addr(260, 1 << 70)
+    ram.write_addr(270, -5)
+    std_out = STDOut(capture=True)
+    cpu = CPUClocked(num_registers=32, bus=Bus(ram, 300, std_out))
+    cpu.set_register(2, -(1 << 65))
+    cpu.run(max_cycles=2)
+    snapshot = cpu.snapshot()
+
+    loaded = Snapshot.from_bytes(snapshot.to_bytes())
+    assert loaded.pages == snapshot.pages
+    assert loaded.devices == snapshot.devices
+    assert loaded.cpu == {name: tuple(value) if isinstance(value, list) else value for name, value in snapshot.cpu.items()}
+
+    data = snapshot.to_bytes()
+    for length in range(len(data)):
+        with pytest.raises(ValueError):
+            Snapshot.from_bytes(data[:length])
@@ -94,8 +94,5 @@ if __name__ == '__main__':
 
     expected_mem_value = 2
     cpu = CPUClocked(num_registers=32, bus=bus)
-    while True:
-        z = cpu.cycle()
-        if z == -1:
-            break
+    cpu.run()
 
@@ -0,0 +1,81 @@
+from cpu import CPU, CPUClocked, HaltReason
+from fixtures import build
+from instructions import Instructions, i_type, b_type, jal, lw, sw
+from tracing import RingBufferTraceSink, NullTraceSink, BinaryTraceSink, read_trace, WORD_MASK, TRACE_REG_WRITE, TRACE_MEM_READ, TRACE_MEM_WRITE
+
+
+def program() -> list[int]:
+    return [
+        i_type(Instructions.ADDI, 1, 0, 4), # r1 = 4
+        sw(0, 1, 8), # mem[8] = r1
+        lw(2, 0, 8), # r2 = mem[8]
+        b_type(Instructions.BEQ, 1, 2, 1), # fall through to the end
+        0,
+    ]
+
+
+def build_traced(cpu_class, trace=None):
+    return build(cpu_class, program(), 10, trace=trace)
+
+
+def test_ring_buffer_records():
+    for cpu_class in (CPU, CPUClocked):
+        sink = RingBufferTraceSink(3)
+        cpu = build_traced(cpu_class, sink)
+        result = cpu.run()
+
+        assert result.reason == HaltReason.HALTED
+        assert result.instructions == 4
+        records = sink.records()
+        assert len(records) == 3
+        assert records[0] == (1, program()[1], 0, 8, 8, 4, TRACE_MEM_WRITE)
+        assert records[1] == (2, program()[2], 2, 4, 8, 4, TRACE_REG_WRITE | TRACE_MEM_READ)
+        assert records[2][0] == 3
+        assert records[2][6] == 0
+
+
+def test_null_sink_is_untraced():
+    cpu = build_traced(CPU, NullTraceSink())
+
+    assert cpu._trace is None
+    assert cpu.run().instructions == 4
+
+
+def test_binary_trace_round_trip(tmp_path):
+    path = tmp_path / "trace.bin"
+    ring = RingBufferTraceSink(10)
+    with BinaryTraceSink(str(path), buffer_size=64) as sink:
+        build_traced(CPUClocked, sink).run()
+    build_traced(CPUClocked, ring).run()
+
+    assert list(read_trace(str(path))) == ring.records()
+
+
+def test_binary_trace_filters(tmp_path):
+    path = tmp_path / "trace.bin"
+    with BinaryTraceSink(str(path)) as sink:
+        build_traced(CPU, sink).run()
+
+    assert [record[0] for record in read_trace(str(path), pc_range=(1, 3))] == [1, 2]
+    assert [record[0] for record in read_trace(str(path), opcode=Instructions.LW)] == [2]
+
+
+def test_binary_trace_backward_jal(tmp_path):
+    # a backward JAL sets bit 31 of its word, so the word is negative once it is in ram
+    path = tmp_path / "trace.bin"
+    loop = [
+        i_type(Instructions.ADDI, 1, 0, 2), # r1 = 2
+        i_type(Instructions.ADDI, 1, 1, -1), # LOOP: r1 -= 1
+        b_type(Instructions.BEQ, 1, 0, 2), # exit once r1 == 0
+        jal(-2), # JAL LOOP
+        0,
+    ]
+    ring = RingBufferTraceSink(20)
+    with BinaryTraceSink(str(path)) as sink:
+        build(CPUClocked, loop, 10, trace=sink).run()
+    build(CPUClocked, loop, 10, trace=ring).run()
+
+    records = list(read_trace(str(path), opcode=Instructions.JAL))
+    assert [record[0] for record in records] == [3]
+    assert records[0][1] == loop[3] & WORD_MASK
+    assert [record[:2] for record in read_trace(str(path))] == [(pc, instr & WORD_MASK) for pc, instr, *_ in ring.records()]
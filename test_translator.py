@@ -0,0 +1,94 @@
+from cpu import RAM, CPUClocked, CPUStates, HaltReason
+from fixtures import fib_program, fact_program, build
+from instructions import Instructions, i_type, b_type, lw, sw
+from translator import CPUTranslated
+
+
+def run_to_halt(cpu) -> None:
+    while cpu.cycle() != CPUStates.STOPPED.value:
+        pass
+
+
+def test_fib_matches_clocked():
+    clocked = build(CPUClocked, fib_program(9))
+    run_to_halt(clocked)
+
+    translated = build(CPUTranslated, fib_program(9))
+    run_to_halt(translated)
+
+    assert translated.read_register(6) == 55
+    assert translated.dump_regs() == clocked.dump_regs()
+    assert translated.next_instruction == clocked.next_instruction
+    assert translated.retired == 3 + 9 * 5
+
+
+def test_fact_matches_clocked():
+    clocked = build(CPUClocked, fact_program(5))
+    clocked.set_register(30, 50)
+    run_to_halt(clocked)
+
+    translated = build(CPUTranslated, fact_program(5))
+    translated.set_register(30, 50)
+    run_to_halt(translated)
+
+    assert translated.read_register(2) == 120
+    assert translated.dump_regs() == clocked.dump_regs()
+
+
+def test_block_invalidated_on_write():
+    program = [
+        i_type(Instructions.ADDI, 1, 1, 1),
+        b_type(Instructions.BEQ, 0, 0, -1),
+    ]
+    ram = RAM(10)
+    cpu = build(CPUTranslated, program, ram=ram)
+
+    cpu.cycle() # r1 += 1
+    ram.write_addr(0, i_type(Instructions.ADDI, 1, 1, 5))
+    cpu.cycle() # r1 += 5
+
+    assert cpu.read_register(1) == 6
+    assert cpu.retired == 4
+
+
+def test_block_invalidated_on_bulk_write():
+    program = [
+        i_type(Instructions.ADDI, 1, 1, 1),
+        b_type(Instructions.BEQ, 0, 0, -1),
+    ]
+    ram = RAM(10)
+    cpu = build(CPUTranslated, program, ram=ram)
+
+    cpu.cycle() # r1 += 1
+    ram.write_words(0, [i_type(Instructions.ADDI, 1, 1, 5)])
+    cpu.cycle() # r1 += 5
+
+    assert cpu.read_register(1) == 6
+
+
+def test_store_and_load():
+    program = [
+        i_type(Instructions.ADDI, 2, 0, 7),
+        sw(0, 2, 20), # mem[20] = r2
+        lw(3, 0, 20), # r3 = mem[20]
+        0,
+    ]
+    cpu = build(CPUTranslated, program, ram_size=30)
+    run_to_halt(cpu)
+
+    assert cpu.read_register(3) == 7
+
+
+def test_run_budget():
+    cpu = build(CPUTranslated, fib_program(9))
+
+    result = cpu.run(max_instructions=5)
+    assert result.reason == HaltReason.INSTRUCTION_LIMIT
+    assert result.instructions == 5
+    assert cpu.next_instruction == 5
+
+    result = cpu.run()
+    assert result.reason == HaltReason.HALTED
+    assert result.instructions == 3 + 9 * 5 - 5
+    assert cpu.read_register(6) == 55
+    assert cpu.retired == 3 + 9 * 5
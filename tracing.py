@@ -0,0 +1,146 @@
+import struct
+import sys
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Iterator, TextIO
+
+from instructions import Instructions, OPCODE_MASK
+
+# kind bits of a trace record, saying which of its fields are meaningful
+TRACE_REG_WRITE = 0b001
+TRACE_MEM_READ = 0b010
+TRACE_MEM_WRITE = 0b100
+
+# (pc, instr, rd_addr, rd_value, mem_addr, mem_value, kind)
+TraceRecord = tuple[int, int, int, int, int, int, int]
+
+# binary trace file: a header followed by fixed size records
+TRACE_MAGIC = b"CPUTRACE"
+TRACE_VERSION = 1
+# little endian: magic, version, record size
+HEADER_STRUCT = struct.Struct("<8sHH")
+# little endian: pc, instr, rd_addr, kind, rd_value, mem_addr, mem_value
+RECORD_STRUCT = struct.Struct("<IIBBqqq")
+# bytes of records buffered by the writer before they are written out
+TRACE_BUFFER_SIZE = 1 << 20
+# records decoded per read by the reader
+TRACE_READ_RECORDS = 4096
+# pc and instruction words are stored unsigned, a word with bit 31 set (e.g. any backward JAL) is negative in ram
+WORD_MASK = 0xFFFFFFFF
+INT64_MASK = 0xFFFFFFFFFFFFFFFF
+INT64_SIGN_BIT = 0x8000000000000000
+
+
+def to_int64(value: int) -> int:
+    # register values are unbounded python ints, traces store them as wrapped 64 bit values
+    return ((value + INT64_SIGN_BIT) & INT64_MASK) - INT64_SIGN_BIT
+
+
+class TraceSink(ABC):
+    """Receives one record per retired instruction from a CPU built with it"""
+    @abstractmethod
+    def record(self, pc: int, instr: int, rd_addr: int, rd_value: int, mem_addr: int, mem_value: int, kind: int) -> None:
+        raise NotImplementedError("")
+
+    def close(self) -> None:
+        return
+
+
+class NullTraceSink(TraceSink):
+    """Sink that drops every record, CPUs given one run their untraced engine"""
+    def record(self, pc: int, instr: int, rd_addr: int, rd_value: int, mem_addr: int, mem_value: int, kind: int) -> None:
+        return
+
+
+class RingBufferTraceSink(TraceSink):
+    """Sink that keeps the last capacity records in memory"""
+    def __init__(self, capacity: int):
+        self._records: deque[TraceRecord] = deque(maxlen=capacity)
+
+    def record(self, pc: int, instr: int, rd_addr: int, rd_value: int, mem_addr: int, mem_value: int, kind: int) -> None:
+        self._records.append((pc, instr, rd_addr, rd_value, mem_addr, mem_value, kind))
+
+    def records(self) -> list[TraceRecord]:
+        return list(self._records)
+
+
+class ConsoleTraceSink(TraceSink):
+    """Sink that prints a line per instruction, for debugging small programs"""
+    def __init__(self, stream: TextIO | None = None):
+        self._stream: TextIO = stream if stream is not None else sys.stdout
+
+    def record(self, pc: int, instr: int, rd_addr: int, rd_value: int, mem_addr: int, mem_value: int, kind: int) -> None:
+        line = f"[PC = {pc}] INSTR = 0x{instr & WORD_MASK:08X}"
+        if kind & TRACE_REG_WRITE:
+            line += f" r{rd_addr} = {rd_value}"
+        if kind & TRACE_MEM_READ:
+            line += f" read [{mem_addr}] = {mem_value}"
+        if kind & TRACE_MEM_WRITE:
+            line += f" write [{mem_addr}] = {mem_value}"
+        print(line, file=self._stream)
+
+
+class BinaryTraceSink(TraceSink):
+    """Sink that writes a binary trace file, records are packed into a buffer and written in large chunks"""
+    def __init__(self, file_path: str, buffer_size: int = TRACE_BUFFER_SIZE):
+        self._file = open(file_path, "wb")
+        self._file.write(HEADER_STRUCT.pack(TRACE_MAGIC, TRACE_VERSION, RECORD_STRUCT.size))
+        self._buffer: bytearray = bytearray()
+        self._buffer_size: int = buffer_size
+
+    def record(self, pc: int, instr: int, rd_addr: int, rd_value: int, mem_addr: int, mem_value: int, kind: int) -> None:
+        self._buffer += RECORD_STRUCT.pack(pc & WORD_MASK, instr & WORD_MASK, rd_addr, kind, to_int64(rd_value), to_int64(mem_addr), to_int64(mem_value))
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self._file.write(self._buffer)
+        self._buffer.clear()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_trace(file_path: str, pc_range: tuple[int, int] | None = None, opcode: Instructions | int | None = None) -> Iterator[TraceRecord]:
+    """Streams the records of a binary trace file, optionally keeping only pcs in [start, stop) or one opcode.
+
+    The file is read a chunk of records at a time, so traces larger than memory can be filtered.
+    """
+    if isinstance(opcode, Instructions):
+        opcode = opcode.value
+    with open(file_path, "rb") as f:
+        header = f.read(HEADER_STRUCT.size)
+        if len(header) < HEADER_STRUCT.size:
+            raise ValueError(f"{file_path} is not a trace file")
+        magic, version, record_size = HEADER_STRUCT.unpack(header)
+        if magic != TRACE_MAGIC or record_size != RECORD_STRUCT.size:
+            raise ValueError(f"{file_path} is not a trace file")
+        if version != TRACE_VERSION:
+            raise ValueError(f"unsupported trace version {version}")
+
+        while True:
+            chunk = f.read(TRACE_READ_RECORDS * RECORD_STRUCT.size)
+            # ignore a partial record left by a run that was killed mid write
+            chunk = chunk[:len(chunk) - len(chunk) % RECORD_STRUCT.size]
+            if not chunk:
+                return
+            for pc, instr, rd_addr, kind, rd_value, mem_addr, mem_value in RECORD_STRUCT.iter_unpack(chunk):
+                if pc_range is not None and not pc_range[0] <= pc < pc_range[1]:
+                    continue
+                if opcode is not None and instr & OPCODE_MASK != opcode:
+                    continue
+                yield pc, instr, rd_addr, rd_value, mem_addr, mem_value, kind
+
+
+def is_traced(trace: TraceSink | None) -> bool:
+    # CPUs pick their engine once, a null sink is the same as no sink
+    return trace is not None and not isinstance(trace, NullTraceSink)
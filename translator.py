@@ -0,0 +1,268 @@
+from typing import Callable
+
+from cpu import Bus, CPUStates, HaltReason, ProgramCounter, RegisterFile, RunResult, limit_reached, PC_REGISTER, RETURN_ADDRESS_REGITSTER
+from instructions import decode_instruction_table, Flags
+
+# longest straight line run translated into one block
+MAX_BLOCK_LENGTH = 64
+
+USE_IMM_FLAG = Flags.USE_IMM_FLAG.value
+REG_WRITE_FLAG = Flags.REG_WRITE_FLAG.value
+MEM_READ_FLAG = Flags.MEM_READ_FLAG.value
+MEM_WRITE_FLAG = Flags.MEM_WRITE_FLAG.value
+BRANCH_FLAG = Flags.BRANCH_FLAG.value
+JAL_FLAG = Flags.JAL_FLAG.value
+
+# alu operations in the order the alu checks them, with the python expression each one computes
+ALU_EXPRESSIONS = [
+    (Flags.ALUOP_ADD_FLAG.value, "({a} + {b})"),
+    (Flags.ALUOP_MUL_FLAG.value, "({a} * {b})"),
+    (Flags.ALUOP_SHL_FLAG.value, "({a} << {b})"),
+    (Flags.ALUOP_SHR_FLAG.value, "({a} >> {b})"),
+    (Flags.ALUOP_SUB_FLAG.value, "({a} - {b})"),
+    (Flags.ALUOP_SLT_FLAG.value, "(1 if {a} < {b} else 0)"),
+    (Flags.ALUOP_SGE_FLAG.value, "(1 if {a} >= {b} else 0)"),
+    (Flags.ALUOP_SNE_FLAG.value, "(1 if {a} != {b} else 0)"),
+    (Flags.ALUOP_SEQ_FLAG.value, "(1 if {a} == {b} else 0)"),
+]
+
+# conditions used when the alu result only decides a branch
+BRANCH_CONDITIONS = [
+    (Flags.ALUOP_SLT_FLAG.value, "{a} < {b}"),
+    (Flags.ALUOP_SGE_FLAG.value, "{a} >= {b}"),
+    (Flags.ALUOP_SNE_FLAG.value, "{a} != {b}"),
+    (Flags.ALUOP_SEQ_FLAG.value, "{a} == {b}"),
+]
+
+
+def _reg(addr: int) -> str:
+    # register 0 is never written, so its reads fold to a constant
+    return "0" if addr == 0 else f"r[{addr}]"
+
+
+def _alu_expression(flags: int, rs1_addr: int, rs2_addr: int, imm: int) -> str:
+    a = _reg(rs1_addr)
+    b = repr(imm) if flags & USE_IMM_FLAG else _reg(rs2_addr)
+    for flag, expression in ALU_EXPRESSIONS:
+        if flags & flag:
+            return expression.format(a=a, b=b)
+    # at least 1 alu op flag must be set
+    raise ValueError("")
+
+
+def _branch_condition(flags: int, rs1_addr: int, rs2_addr: int) -> str:
+    a, b = _reg(rs1_addr), _reg(rs2_addr)
+    for flag, condition in BRANCH_CONDITIONS:
+        if flags & flag:
+            return condition.format(a=a, b=b)
+    return f"{_alu_expression(flags, rs1_addr, rs2_addr, 0)} > 0"
+
+
+class BlockCache:
+    """Class holding translated blocks by start address, invalidated when the code they cover is written"""
+    def __init__(self):
+        self._blocks: dict[int, tuple[Callable[[list[int]], int], int]] = {}
+        self._covering: dict[int, list[int]] = {}
+
+    def lookup(self, start: int) -> tuple[Callable[[list[int]], int], int] | None:
+        return self._blocks.get(start)
+
+    def insert(self, start: int, length: int, block: Callable[[list[int]], int]):
+        self._blocks[start] = (block, length)
+        for addr in range(start, start + length):
+            self._covering.setdefault(addr, []).append(start)
+
+    def invalidate(self, addr: int) -> None:
+        for start in self._covering.pop(addr, ()):
+            self._blocks.pop(start, None)
+
+    def invalidate_range(self, start: int, stop: int) -> None:
+        if stop - start > len(self._covering):
+            addrs = [addr for addr in self._covering if start <= addr < stop]
+        else:
+            addrs = range(start, stop)
+        for addr in addrs:
+            self.invalidate(addr)
+
+    def clear(self) -> None:
+        self._blocks.clear()
+        self._covering.clear()
+
+
+class CPUTranslated:
+    """CPU that translates basic blocks of guest code into python functions and runs them.
+
+    Blocks are straight line runs starting at the current PC that end at a branch, JAL or a write to
+    the PC register. Each one is compiled once into a function operating directly on the register list,
+    loads from ram index the ram's word list. Follows the same instruction semantics as CPUClocked.
+    A write to the code of the block currently running takes effect the next time that block is entered.
+    """
+    def __init__(self, num_registers: int, bus: Bus):
+        self._reg_file: RegisterFile = RegisterFile(num_registers)
+        self._pc: ProgramCounter = ProgramCounter(0)
+        self._bus: Bus = bus
+        self._blocks: BlockCache = BlockCache()
+        bus.attach_decode_cache(self._blocks)
+        self._retired: int = 0
+
+    def dump_regs(self) -> list[int]:
+        return self._reg_file.dump_regs()
+
+    @property
+    def next_instruction(self) -> int:
+        return self._pc.next_instruction
+
+    @next_instruction.setter
+    def next_instruction(self, addr: int):
+        # moves the pc between instructions, e.g. to start at an image's entry point
+        self._pc.write_next_instruction(addr)
+
+    @property
+    def retired(self) -> int:
+        # number of guest instructions completed
+        return self._retired
+
+    def set_register(self, register_number: int, value: int):
+        self._reg_file.write_register(register_number, value)
+
+    def read_register(self, register_number: int):
+        return self._reg_file.read_register(register_number)
+
+    def _namespace(self) -> dict:
+        # values the generated code binds as default arguments so every access is a local lookup
+        ram = self._bus.ram
+        memory = getattr(ram, "memory", None)
+        read_limit, write_limit = self._bus.ram_window()
+        if memory is None:
+            read_limit = write_limit = 0
+        else:
+            read_limit = min(read_limit, len(memory))
+            write_limit = min(write_limit, len(memory))
+        return {
+            "mem": memory,
+            "read_limit": read_limit,
+            "write_limit": write_limit,
+            "ram_write": ram.write_addr,
+            "bus_read": self._bus.read_addr,
+            "bus_write": self._bus.write_addr,
+            "MEM_WRITE_FLAG": MEM_WRITE_FLAG,
+        }
+
+    def translate(self, start: int, max_length: int = MAX_BLOCK_LENGTH) -> tuple[Callable[[list[int]], int], int] | None:
+        """Translates the basic block starting at start, returns (block, length) or None if start is a NO_OP
+
+        Blocks cut short by max_length (to stop inside a budget) are not cached.
+        """
+        lines: list[str] = []
+        addr = start
+        ended = False
+        while not ended and addr - start < max_length:
+            if addr != start and not self._bus.is_ram_addr(addr):
+                break
+            instr = self._bus.read_addr(addr)
+            try:
+                flags, rd_addr, rs1_addr, rs2_addr, imm = decode_instruction_table(instr)
+            except ValueError:
+                if addr == start:
+                    raise
+                # leave the invalid word for the next block so it raises when it would execute
+                break
+            if flags == 0:
+                # EOF is coded as no op, stop before it so the next block halts
+                break
+            lines.append(f"    # 0x{instr:08X} @ {addr}")
+            ended = self._translate_instruction(lines, addr, flags, rd_addr, rs1_addr, rs2_addr, imm)
+            addr += 1
+
+        length = addr - start
+        if length == 0:
+            return None
+        if not ended:
+            lines.append(f"    return {addr}")
+
+        namespace = self._namespace()
+        defaults = ", ".join(f"{name}={name}" for name in namespace)
+        source = f"def block_{start}(r, {defaults}):\n" + "\n".join(lines) + "\n"
+        exec(compile(source, f"<block {start}>", "exec"), namespace)
+        block = namespace[f"block_{start}"]
+        if self._bus.is_ram_addr(start) and (ended or max_length == MAX_BLOCK_LENGTH):
+            self._blocks.insert(start, length, block)
+        return block, length
+
+    def _translate_instruction(self, lines: list[str], addr: int, flags: int, rd_addr: int, rs1_addr: int, rs2_addr: int, imm: int) -> bool:
+        # appends the code for one instruction, returns True if it ends the block
+        if flags & JAL_FLAG:
+            lines.append(f"    r[{RETURN_ADDRESS_REGITSTER}] = {addr + 1}")
+            lines.append(f"    return {addr + imm}")
+            return True
+        if flags & BRANCH_FLAG:
+            lines.append(f"    if {_branch_condition(flags, rs1_addr, rs2_addr)}:")
+            lines.append(f"        return {addr + imm}")
+            lines.append(f"    return {addr + 1}")
+            return True
+
+        value = _alu_expression(flags, rs1_addr, rs2_addr, imm)
+        if flags & MEM_READ_FLAG:
+            lines.append(f"    a = {value}")
+            value = "(mem[a] if 0 <= a < read_limit else bus_read(a))"
+        elif flags & MEM_WRITE_FLAG:
+            lines.append(f"    a = {value}")
+            lines.append("    if 0 <= a < write_limit:")
+            lines.append(f"        ram_write(a, {_reg(rs2_addr)})")
+            lines.append("    else:")
+            lines.append(f"        bus_write(a, {_reg(rs2_addr)}, MEM_WRITE_FLAG)")
+
+        if flags & REG_WRITE_FLAG:
+            if rd_addr == PC_REGISTER:
+                # writes to the pc register are jumps
+                lines.append(f"    return {value}")
+                return True
+            if rd_addr == 0:
+                lines.append(f"    {value}")
+            else:
+                lines.append(f"    r[{rd_addr}] = {value}")
+        return False
+
+    def cycle(self) -> int:
+        # runs one basic block
+        start = self._pc.next_instruction
+        entry = self._blocks.lookup(start)
+        if entry is None:
+            entry = self.translate(start)
+            if entry is None:
+                return CPUStates.STOPPED.value
+        block, length = entry
+        self._pc.write_next_instruction(block(self._reg_file.registers))
+        self._retired += length
+        return CPUStates.FETCH.value
+
+    def run(self, max_instructions: int | None = None, max_cycles: int | None = None) -> RunResult:
+        """Runs blocks until the end of the program or until a budget runs out, one cycle per instruction"""
+        regs = self._reg_file.registers
+        lookup = self._blocks.lookup
+        translate = self.translate
+        pc = self._pc.next_instruction
+        count = 0
+        limit = -1
+        for budget in (max_instructions, max_cycles):
+            if budget is not None and (limit < 0 or budget < limit):
+                limit = budget
+        reason = HaltReason.HALTED
+        try:
+            while True:
+                if count == limit:
+                    reason = limit_reached(count, count, max_instructions, max_cycles)
+                    break
+                entry = lookup(pc)
+                if entry is None or (limit >= 0 and entry[1] > limit - count):
+                    # translate a block that stops inside the budget
+                    entry = translate(pc, MAX_BLOCK_LENGTH if limit < 0 else min(MAX_BLOCK_LENGTH, limit - count))
+                    if entry is None:
+                        break
+                block, length = entry
+                pc = block(regs)
+                count += length
+        finally:
+            self._pc.write_next_instruction(pc)
+            self._retired += count
+        return RunResult(reason, count, count)